@@ -1,9 +1,12 @@
 from ibapi.client import *
 from ibapi.wrapper import *
 from ibapi.contract import Contract
+import logging
 import time
 import threading
 
+logger = logging.getLogger(__name__)
+
 class PortfolioManager(EWrapper, EClient):
     def __init__(self): 
         EClient.__init__(self, self)
@@ -18,7 +21,7 @@ class PortfolioManager(EWrapper, EClient):
         if currency not in self.account_values[accountName]:
             self.account_values[accountName][currency] = {}
         self.account_values[accountName][currency][key] = val
-        print("UpdateAccountValue. Key:", key, "Value:", val, "Currency:", currency, "AccountName:", accountName)
+        logger.debug("UpdateAccountValue. Key: %s Value: %s Currency: %s AccountName: %s", key, val, currency, accountName)
 
     def updatePortfolio(self, contract: Contract, position: float,
                         marketPrice: float, marketValue: float,
@@ -40,26 +43,27 @@ class PortfolioManager(EWrapper, EClient):
             'realizedPNL': realizedPNL
         }
         
-        print("UpdatePortfolio.", "Symbol:", contract.symbol, "SecType:", contract.secType, "Exchange:",
-              contract.exchange, "Position:", position, "MarketPrice:", marketPrice,
-              "MarketValue:", marketValue, "AverageCost:", averageCost,
-              "UnrealizedPNL:", unrealizedPNL, "RealizedPNL:", realizedPNL,
-              "AccountName:", accountName)
+        logger.debug("UpdatePortfolio. Symbol: %s SecType: %s Exchange: %s Position: %s MarketPrice: %s "
+                     "MarketValue: %s AverageCost: %s UnrealizedPNL: %s RealizedPNL: %s AccountName: %s",
+                     contract.symbol, contract.secType, contract.exchange, position, marketPrice,
+                     marketValue, averageCost, unrealizedPNL, realizedPNL, accountName)
 
     def updateAccountTime(self, timeStamp: str):
         super().updateAccountTime(timeStamp)
         self.account_time = timeStamp
-        print("UpdateAccountTime. Time:", timeStamp)
+        logger.debug("UpdateAccountTime. Time: %s", timeStamp)
 
     def accountDownloadEnd(self, accountName: str):
         super().accountDownloadEnd(accountName)
-        print("AccountDownloadEnd. Account:", accountName)
+        logger.info("AccountDownloadEnd. Account: %s", accountName)
 
 def run_loop(app):
     app.run()
 
+logging.basicConfig(level=logging.INFO)
+
 # Create and connect the app
-app = TestWrapper()
+app = PortfolioManager()
 app.connect("127.0.0.1", 4002, clientId=15)
 
 # Start the app in a separate thread
@@ -70,7 +74,7 @@ api_thread.start()
 time.sleep(1)
 
 if app.isConnected():
-    print("Connected successfully")
+    logger.info("Connected successfully")
 
     # Request account updates
     app.reqAccountUpdates(True, "9001")
@@ -84,18 +88,15 @@ if app.isConnected():
     app.reqAccountUpdates(False, "9001")
     app.disconnect()
 else:
-    print("Failed to connect")
+    logger.error("Failed to connect")
 
 # Wait for the API thread to finish
 api_thread.join()
 
-# Print the collected data
-print("\nAccount Values:")
-print(app.account_values)
-print("\nPortfolio:")
-print(app.portfolio)
-print("\nAccount Time:")
-print(app.account_time)
+# Log the collected data
+logger.info("Account Values: %s", app.account_values)
+logger.info("Portfolio: %s", app.portfolio)
+logger.info("Account Time: %s", app.account_time)
 
 
 
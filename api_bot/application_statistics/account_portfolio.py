@@ -1,46 +1,48 @@
 import asyncio
 import logging
-from ibapi.client import EClient
-from ibapi.wrapper import EWrapper
-import queue
+import threading
+import time
 from datetime import datetime
+from data_storage.change_tracker import ChangeTracker
+from utilsL.instrumentation import timed
 
-class PortfolioManager(EWrapper, EClient):
-    def __init__(self, host, port, client_id, storage_manager):
-        EWrapper.__init__(self)
-        EClient.__init__(self, wrapper=self)
+class PortfolioManager:
+    def __init__(self, connection, storage_manager, write_buffer, account=None, keyframe_interval=3600):
         self.logger = logging.getLogger(__name__)
-        self.data_queue = queue.Queue()
+        self.connection = connection
         self.account_values = {}
         self.portfolio = {}
         self.account_time = None
-        self.req_id = 122
+        # time.monotonic() of the last update per value and position, for span tracing
+        self.received_at = {}
+        # Guards account_values/portfolio/received_at against the reader thread
+        self._lock = threading.Lock()
+        # store_data runs on the reader thread (accountDownloadEnd) and the loop; one at a time,
+        # so snapshots reach the change tracker and the write buffer in the order they were taken
+        self._store_lock = threading.Lock()
         self.storage_manager = storage_manager
+        self.write_buffer = write_buffer
+        # Only keys whose value changed are written, plus a periodic full keyframe
+        self.change_tracker = ChangeTracker(('account', 'currency', 'key'), 'value', keyframe_interval)
 
-        # Connect to IB API
-        self.connect(host, port, client_id)
-        self.run_loop()
-
-    def run_loop(self):
-        # Start the socket in a separate thread
-        asyncio.get_event_loop().run_in_executor(None, self.run)
+        # Account update callbacks are routed here by the shared connection
+        self.account = account
+        self.connection.subscribe_account(self, account)
 
     def request_account_updates(self):
-        self.reqAccountUpdates(True, "9001")
+        self.connection.client.reqAccountUpdates(True, "9001")
 
     def updateAccountValue(self, key: str, val: str, currency: str, accountName: str):
-        super().updateAccountValue(key, val, currency, accountName)
-        if accountName not in self.account_values:
-            self.account_values[accountName] = {}
-        if currency not in self.account_values[accountName]:
-            self.account_values[accountName][currency] = {}
-        self.account_values[accountName][currency][key] = val
+        with self._lock:
+            if accountName not in self.account_values:
+                self.account_values[accountName] = {}
+            if currency not in self.account_values[accountName]:
+                self.account_values[accountName][currency] = {}
+            self.account_values[accountName][currency][key] = val
+            self.received_at[(accountName, currency, key)] = time.monotonic()
 
     def updatePortfolio(self, contract, position, marketPrice, marketValue, averageCost, unrealizedPNL, realizedPNL, accountName):
-        super().updatePortfolio(contract, position, marketPrice, marketValue, averageCost, unrealizedPNL, realizedPNL, accountName)
-        if accountName not in self.portfolio:
-            self.portfolio[accountName] = {}
-        self.portfolio[accountName][contract.symbol] = {
+        details = {
             'secType': contract.secType,
             'exchange': contract.exchange,
             'position': position,
@@ -50,9 +52,13 @@ class PortfolioManager(EWrapper, EClient):
             'unrealizedPNL': unrealizedPNL,
             'realizedPNL': realizedPNL
         }
+        with self._lock:
+            if accountName not in self.portfolio:
+                self.portfolio[accountName] = {}
+            self.portfolio[accountName][contract.symbol] = details
+            self.received_at[(accountName, contract.symbol)] = time.monotonic()
 
     def updateAccountTime(self, timeStamp: str):
-        super().updateAccountTime(timeStamp)
         self.account_time = timeStamp
 
     def accountDownloadEnd(self, accountName: str):
@@ -60,16 +66,29 @@ class PortfolioManager(EWrapper, EClient):
         # print("-------------------------------------------------------------------------------")
         # print(self.portfolio)
 
-        super().accountDownloadEnd(accountName)
         self.store_data()
 
+    def _snapshot(self):
+        # Updates arrive incrementally, so the state is copied rather than taken over;
+        # position dicts are replaced whole by updatePortfolio, never mutated
+        with self._lock:
+            account_values = {account: {currency: dict(keys) for currency, keys in currencies.items()}
+                              for account, currencies in self.account_values.items()}
+            portfolio = {account: dict(positions) for account, positions in self.portfolio.items()}
+            return account_values, portfolio, dict(self.received_at)
+
+    @timed("portfolio_manager.store_data")
     def store_data(self):
+        with self._store_lock:
+            self._store_snapshot(*self._snapshot())
+
+    def _store_snapshot(self, account_values, portfolio, received_at):
         # Get current timestamp
         current_time = datetime.now().isoformat()
 
         # Process account_values data
         account_values_data = []
-        for account, currencies in self.account_values.items():
+        for account, currencies in account_values.items():
             for currency, keys in currencies.items():
                 for key, value in keys.items():
                     account_values_data.append({
@@ -82,7 +101,7 @@ class PortfolioManager(EWrapper, EClient):
 
         # Process portfolio data
         portfolio_data = []
-        for account, positions in self.portfolio.items():
+        for account, positions in portfolio.items():
             for contract, details in positions.items():
                 portfolio_data.append({
                     'account': account,
@@ -97,23 +116,31 @@ class PortfolioManager(EWrapper, EClient):
                     'updated_at': current_time
                 })
 
+        account_values_data, changed = self.change_tracker.filter_changes(account_values_data)
+
         # Store the collected data
         if account_values_data:
-            self.storage_manager.insert_data("account_values", account_values_data)
-            self.logger.info(f"Stored {len(account_values_data)} account values records.")
+            # Rows written only for the keyframe carry no new value, so no receive time
+            received = [received_at.get((row['account'], row['currency'], row['key'])) if is_changed else None
+                        for row, is_changed in zip(account_values_data, changed)]
+            self.write_buffer.put("account_values", account_values_data, received)
+            self.logger.info("Queued %d account values records.", len(account_values_data))
 
         if portfolio_data:
-            self.storage_manager.insert_data("account_portfolio", portfolio_data)
-            self.logger.info(f"Stored {len(portfolio_data)} portfolio records.")
+            received = [received_at.get((row['account'], row['contract'])) for row in portfolio_data]
+            self.write_buffer.put("account_portfolio", portfolio_data, received)
+            self.logger.info("Queued %d portfolio records.", len(portfolio_data))
 
-        if not account_values_data and not portfolio_data:
+        if not account_values and not portfolio_data:
             self.logger.warning("No data to store.")
 
     async def cleanup(self):
-        await self.storage_manager.close()
-        self.disconnect()
+        self.connection.unsubscribe_account(self, self.account)
+        # The pool is shared; it closes once its last holder releases it
+        await self.storage_manager.release(self)
 
     async def run_periodically(self, interval_seconds):
+        await self.storage_manager.acquire(self)
         while True:
             self.request_account_updates()
             await asyncio.sleep(interval_seconds)  # Wait for the specified interval
@@ -129,21 +156,34 @@ class PortfolioManager(EWrapper, EClient):
 
 import sys
 sys.path.append('..')
-from data_storage.postgresql_client import PostgresqlClient
+from connection.ib_connection import IBConnection
+from data_storage.async_postgresql_client import AsyncPostgresqlClient
+from data_storage.write_buffer import WriteBehindBuffer
 
 class MinimalApp:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
-        self.storage_manager = PostgresqlClient(db_name='test', db_user='myuser', db_password='kchau99', is_test_mode=False, use_local=True)
-        self.portfolio_manager = PortfolioManager('127.0.0.1', 4002, 122, self.storage_manager)
+        self.connection = IBConnection()
+        self.storage_manager = AsyncPostgresqlClient(db_name='test', db_user='myuser', db_password='kchau99', is_test_mode=False)
+        self.write_buffer = WriteBehindBuffer(self.storage_manager)
+        self.portfolio_manager = PortfolioManager(self.connection, self.storage_manager, self.write_buffer)
 
     async def run(self):
+        flusher = None
         try:
+            await self.storage_manager.acquire(self)
+            await self.connection.connect('127.0.0.1', 4002, 122)
+            flusher = asyncio.create_task(self.write_buffer.run())
             await self.portfolio_manager.run_periodically(60)  # Run every 60 seconds
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
         finally:
+            if flusher is not None:
+                flusher.cancel()
+                await asyncio.gather(flusher, return_exceptions=True)
             await self.portfolio_manager.cleanup()
+            await self.storage_manager.release(self)
+            await self.connection.disconnect()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
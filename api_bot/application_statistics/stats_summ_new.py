@@ -1,86 +1,101 @@
 import asyncio
 import logging
+import threading
+import time
 from datetime import datetime
-from ibapi.client import EClient
-from ibapi.wrapper import EWrapper
-import queue
+from connection.async_bridge import PendingRequests, IBRequestError
+from data_storage.change_tracker import ChangeTracker
+from utilsL.instrumentation import timed
 
 
-class StatsManager(EWrapper, EClient):
-    def __init__(self, host, port, client_id, storage_manager):
-        EWrapper.__init__(self)
-        EClient.__init__(self, wrapper=self)
+class StatsManager:
+    def __init__(self, connection, storage_manager, write_buffer, summary_timeout=10, keyframe_interval=3600):
         self.logger = logging.getLogger(__name__)
-        self.data_queue = queue.Queue()
+        self.connection = connection
         self.account_summary = {}
-        self.req_id = 123
+        # time.monotonic() each tag arrived, for span tracing
+        self.received_at = {}
+        # Guards account_summary/received_at against the reader thread
+        self._lock = threading.Lock()
         self.last_storage_date = None
         self.storage_manager = storage_manager
+        self.write_buffer = write_buffer
+        self.summary_timeout = summary_timeout
+        self.pending = PendingRequests()
+        # Only tags whose value changed are written, plus a periodic full keyframe
+        self.change_tracker = ChangeTracker(('account', 'currency', 'metric'), 'value', keyframe_interval)
 
-        # Connect to IB API
-        self.connect(host, port, client_id)
-        self.run_loop()
-
-    def run_loop(self):
-        # Start the socket in a separate thread
-        asyncio.get_event_loop().run_in_executor(None, self.run)
+        # Callbacks for our request id are routed here by the shared connection
+        self.req_id = self.connection.register_request(self)
 
     def request_account_summary(self):
-        self.account_summary.clear()
+        with self._lock:
+            self.account_summary = {}
+            self.received_at = {}
         #self.logger.info("Clearing previous account summary data")
 
-        self.reqAccountSummary(self.req_id, "All", "$LEDGER:ALL")
+        # Resolved from accountSummaryEnd on the reader thread
+        completed = self.pending.create(self.req_id)
+        self.connection.client.reqAccountSummary(self.req_id, "All", "$LEDGER:ALL")
         #self.logger.info(f"Requested account summary with reqId: {self.req_id}")
+        return completed
 
     def accountSummary(self, reqId, account, tag, value, currency):
         #self.logger.info(f"Received: ReqId: {reqId}, Account: {account}, Tag: {tag}, Value: {value}, Currency: {currency}")
-        if account not in self.account_summary:
-            self.account_summary[account] = {}
-        if currency not in self.account_summary[account]:
-            self.account_summary[account][currency] = {}
-        self.account_summary[account][currency][tag] = {'value': value, 'currency': currency}
-        self.data_queue.put(f"AccountSummary. ReqId: {reqId}, Account: {account}, Tag: {tag}, Value: {value}, Currency: {currency}")
+        with self._lock:
+            if account not in self.account_summary:
+                self.account_summary[account] = {}
+            if currency not in self.account_summary[account]:
+                self.account_summary[account][currency] = {}
+            self.account_summary[account][currency][tag] = {'value': value, 'currency': currency}
+            self.received_at[(account, currency, tag)] = time.monotonic()
 
     def accountSummaryEnd(self, reqId):
         self.logger.info(f"Account summary end received: ReqId: {reqId}")
-        self.data_queue.put(f"AccountSummaryEnd. ReqId: {reqId}")
+        self.pending.resolve(reqId, self.account_summary)
 
     def error(self, reqId, errorCode, errorString):
         self.logger.error(f"Error {errorCode}: {errorString}")
+        self.pending.reject(reqId, IBRequestError(reqId, errorCode, errorString))
 
+    @timed("stats_manager.process_account_summary")
     async def process_account_summary(self):
-        timeout = 5  
-        start_time = datetime.now()
-        #data_received = []
         storage_data = []  # New list to collect data for storage
-        while (datetime.now() - start_time).total_seconds() < timeout:
-            try:
-                data = self.data_queue.get(timeout=1)
-                #data_received.append(data)
-                # if data.startswith("AccountSummaryEnd"):
-                #     break
-            except queue.Empty:
-                pass
-
-        #self.logger.info(f"Queue size: {self.data_queue.qsize()}")
-        #self.logger.info(f"Data received: {data_received}")
+
         #self.logger.info(f"Account Summary: {self.account_summary}")
 
 
+        # Take the collected data over; updates arriving after the cancel land in fresh dicts
+        with self._lock:
+            account_summary, received_at = self.account_summary, self.received_at
+            self.account_summary, self.received_at = {}, {}
+
         current_date = datetime.now().date()
         is_new_day = self.last_storage_date != current_date
         self.last_storage_date = current_date
+        current_time = datetime.now().isoformat()
 
-        for account, currencies in self.account_summary.items():
+        for account, currencies in account_summary.items():
             for currency, metrics in currencies.items():
                 for metric, data in metrics.items():
                     value = float(data['value']) if data['value'].replace('.', '').isdigit() else 0.0
-                    storage_data.append((account, currency, metric, value, is_new_day))  
+                    storage_data.append({
+                        'account': account,
+                        'currency': currency,
+                        'metric': metric,
+                        'value': value,
+                        'is_latest': is_new_day,
+                        'updated_at': current_time
+                    })
 
         # Store all collected data in one call
         #print(storage_data)
         #await self.storage_manager.store_account_summary(storage_data)
-        self.storage_manager.insert_data("account_summary", storage_data)
+        storage_data, changed = self.change_tracker.filter_changes(storage_data)
+        # Rows written only for the keyframe carry no new value, so no receive time
+        received = [received_at.get((row['account'], row['currency'], row['metric'])) if is_changed else None
+                    for row, is_changed in zip(storage_data, changed)]
+        self.write_buffer.put("account_summary", storage_data, received)
 
 
 
@@ -88,25 +103,33 @@ class StatsManager(EWrapper, EClient):
 
 
     def cancel_account_summary(self):
-        self.cancelAccountSummary(self.req_id)
+        self.connection.client.cancelAccountSummary(self.req_id)
         #self.logger.info(f"Cancelled account summary request with reqId: {self.req_id}")
 
 
+    @timed("stats_manager.cycle")
     async def run_once(self):
-        self.request_account_summary()
-        await asyncio.sleep(5)  
-
-        if self.data_queue.empty():
+        completed = self.request_account_summary()
+        try:
+            await asyncio.wait_for(completed, timeout=self.summary_timeout)
+        except asyncio.TimeoutError:
+            self.pending.discard(self.req_id)
+            self.logger.warning(f"Account summary not complete after {self.summary_timeout}s, storing partial data")
+        except IBRequestError as e:
+            self.logger.error(f"Account summary request failed: {str(e)}")
+            self.cancel_account_summary()
+            return
+
+        # Cancel first so no further updates touch account_summary while it is processed
+        self.cancel_account_summary()
+        if not self.account_summary:
             self.logger.warning("No data received from IB API")
         else:
-            self.logger.info(f"Data queue size before processing: {self.data_queue.qsize()}")
-
-        await self.process_account_summary()
-        #await asyncio.sleep(5)  # Wait for data to load
-        self.cancel_account_summary()
+            await self.process_account_summary()
 
 
     async def run_periodically(self, interval_seconds):
+        await self.storage_manager.acquire(self)
         while True:
             #self.logger.info("Running account summary request")
             await self.run_once()
@@ -115,8 +138,9 @@ class StatsManager(EWrapper, EClient):
 
     async def cleanup(self):
         #self.logger.info("Cleaning up resources...")
-        await self.storage_manager.close()
-        self.disconnect()
+        self.connection.unregister_request(self.req_id)
+        # The pool is shared; it closes once its last holder releases it
+        await self.storage_manager.release(self)
 
 
 
@@ -131,22 +155,35 @@ class StatsManager(EWrapper, EClient):
 
 import sys
 sys.path.append('..')
-from data_storage.postgresql_client import PostgresqlClient
+from connection.ib_connection import IBConnection
+from data_storage.async_postgresql_client import AsyncPostgresqlClient
+from data_storage.write_buffer import WriteBehindBuffer
 
 
 class MinimalApp:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
-        self.storage_manager = PostgresqlClient(db_name='test', db_user='myuser', db_password='kchau99', is_test_mode=False, use_local=True)
-        self.stats_manager = StatsManager('127.0.0.1', 4002, 123, self.storage_manager)
+        self.connection = IBConnection()
+        self.storage_manager = AsyncPostgresqlClient(db_name='test', db_user='myuser', db_password='kchau99', is_test_mode=False)
+        self.write_buffer = WriteBehindBuffer(self.storage_manager)
+        self.stats_manager = StatsManager(self.connection, self.storage_manager, self.write_buffer)
 
     async def run(self):
+        flusher = None
         try:
+            await self.storage_manager.acquire(self)
+            await self.connection.connect('127.0.0.1', 4002, 123)
+            flusher = asyncio.create_task(self.write_buffer.run())
             await self.stats_manager.run_periodically(60)  # Run every 30 seconds
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
         finally:
+            if flusher is not None:
+                flusher.cancel()
+                await asyncio.gather(flusher, return_exceptions=True)
             await self.stats_manager.cleanup()
+            await self.storage_manager.release(self)
+            await self.connection.disconnect()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,340 @@
+import asyncio
+import itertools
+import logging
+import random
+import struct
+import threading
+import time
+from ibapi.message import IN, OUT
+
+
+# Recent enough that orderStatus, execDetails and realtimeBar use their current layouts
+SERVER_VERSION = 151
+
+ACCOUNT_VALUE_KEYS = (
+    'AccruedCash', 'AvailableFunds', 'BuyingPower', 'CashBalance', 'EquityWithLoanValue',
+    'ExcessLiquidity', 'FullAvailableFunds', 'FullExcessLiquidity', 'FullInitMarginReq',
+    'FullMaintMarginReq', 'GrossPositionValue', 'InitMarginReq', 'LookAheadAvailableFunds',
+    'LookAheadExcessLiquidity', 'MaintMarginReq', 'NetLiquidation', 'RealizedPnL', 'SMA',
+    'StockMarketValue', 'TotalCashValue', 'UnrealizedPnL',
+)
+LEDGER_TAGS = (
+    'CashBalance', 'TotalCashBalance', 'AccruedCash', 'StockMarketValue', 'OptionMarketValue',
+    'FutureOptionValue', 'FuturesPNL', 'NetLiquidationByCurrency', 'UnrealizedPnL', 'RealizedPnL',
+    'ExchangeRate', 'FundValue', 'NetDividend', 'MutualFundValue', 'MoneyMarketFundValue',
+    'CorporateBondValue', 'TBondValue', 'TBillValue', 'WarrantValue', 'FxCashBalance',
+)
+CURRENCIES = ('BASE', 'USD', 'EUR')
+
+
+def encode(*fields):
+    """One length-prefixed message, the way the gateway frames it."""
+    text = "".join(f"{'' if field is None else field}\0" for field in fields).encode()
+    return struct.pack("!I", len(text)) + text
+
+
+class GatewaySession:
+    """State of one client connection: its streams and working orders."""
+
+    def __init__(self, gateway, reader, writer):
+        self.gateway = gateway
+        self.reader = reader
+        self.writer = writer
+        self.bars = {}
+        self.bar_stream = None
+        self.account_stream = None
+        self.orders = {}
+        self.exec_ids = itertools.count(1)
+        self.tasks = []
+        self.messages_in = 0
+        self.messages_out = 0
+
+    def send(self, *fields):
+        if self.writer.is_closing():
+            return
+        self.writer.write(encode(*fields))
+        self.messages_out += 1
+
+
+class FakeGateway:
+    """Local stand-in for TWS / IB Gateway speaking the socket protocol.
+
+    Answers the handshake, nextValidId and managedAccounts, and the requests
+    the bot makes: reqAccountSummary, reqAccountUpdates, reqRealTimeBars,
+    placeOrder/cancelOrder, reqExecutions and reqIds. Streams are synthetic
+    and paced:
+      - `bar_rate` real-time bars per second per subscription (IB sends 0.2);
+        bar times advance 5 s per bar, so bars come faster than real time,
+      - `account_update_rate` updateAccountValue messages per second per
+        subscribed account, after the full snapshot each reqAccountUpdates gets,
+      - orders are acknowledged at once and filled after `fill_delay`
+        seconds, with execDetails and commissionReport.
+    A `silent` gateway accepts data requests without answering them, for
+    replaying recorded callbacks into a connected app.
+    The server runs its own event loop on a background thread, so the bot
+    under test keeps the main loop to itself. Port 0 picks a free port."""
+
+    def __init__(self, host='127.0.0.1', port=0, accounts=('DU000001',), positions=20,
+                 bar_rate=0.2, account_update_rate=1.0, fill_delay=0.05, silent=False, seed=None):
+        self.logger = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.accounts = list(accounts)
+        self.positions = positions
+        self.bar_rate = bar_rate
+        self.account_update_rate = account_update_rate
+        self.fill_delay = fill_delay
+        self.random = random.Random(seed)
+        self.sessions = []
+        self.next_order_id = 1
+        self._perm_ids = itertools.count(1000000)
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._handlers = {
+            OUT.START_API: self._start_api,
+            OUT.REQ_IDS: self._req_ids,
+            OUT.REQ_ACCOUNT_SUMMARY: self._req_account_summary,
+            OUT.REQ_ACCT_DATA: self._req_account_updates,
+            OUT.REQ_REAL_TIME_BARS: self._req_real_time_bars,
+            OUT.CANCEL_REAL_TIME_BARS: self._cancel_real_time_bars,
+            OUT.PLACE_ORDER: self._place_order,
+            OUT.CANCEL_ORDER: self._cancel_order,
+            OUT.REQ_EXECUTIONS: self._req_executions,
+        }
+        if silent:
+            for msg_id in (OUT.REQ_ACCOUNT_SUMMARY, OUT.REQ_ACCT_DATA, OUT.REQ_REAL_TIME_BARS):
+                del self._handlers[msg_id]
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        """Start serving on a background thread; returns the port."""
+        self._thread = threading.Thread(target=self._serve, name="fake-gateway", daemon=True)
+        self._thread.start()
+        if not self._started.wait(10) or self._server is None:
+            raise RuntimeError("Fake gateway did not start")
+        return self.port
+
+    def stop(self):
+        loop = self._loop
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(5)
+        self._loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._session, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            self.logger.info(f"Fake gateway listening on {self.host}:{self.port}")
+        except Exception as e:
+            self.logger.error(f"Fake gateway failed to start: {str(e)}")
+            self._started.set()
+            return
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    def stats(self):
+        return {
+            'sessions': len(self.sessions),
+            'messages_in': sum(session.messages_in for session in self.sessions),
+            'messages_out': sum(session.messages_out for session in self.sessions),
+        }
+
+    # ------------------------------------------------------------------
+    # Protocol
+    # ------------------------------------------------------------------
+    async def _session(self, reader, writer):
+        session = GatewaySession(self, reader, writer)
+        self.sessions.append(session)
+        try:
+            # "API\0", then the client's length-prefixed "v<min>..<max>"
+            if await reader.readexactly(4) != b"API\0":
+                return
+            await self._read_message(reader)
+            session.send(SERVER_VERSION, time.strftime("%Y%m%d %H:%M:%S UTC", time.gmtime()))
+            await writer.drain()
+
+            while True:
+                fields = await self._read_message(reader)
+                session.messages_in += 1
+                handler = self._handlers.get(int(fields[0]))
+                if handler is not None:
+                    handler(session, fields)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Client gone or gateway stopping; either way the session just ends
+            pass
+        finally:
+            for task in session.tasks:
+                task.cancel()
+            writer.close()
+
+    @staticmethod
+    async def _read_message(reader):
+        size = struct.unpack("!I", await reader.readexactly(4))[0]
+        return (await reader.readexactly(size)).decode().split("\0")[:-1]
+
+    def _spawn(self, session, coro):
+        task = self._loop.create_task(coro)
+        session.tasks.append(task)
+        return task
+
+    async def _paced(self, session, rate, emit):
+        """Call emit() `rate` times per second, in batches every 10 ms."""
+        due = 0.0
+        last = self._loop.time()
+        while not session.writer.is_closing():
+            await asyncio.sleep(0.01)
+            now = self._loop.time()
+            due += (now - last) * rate
+            last = now
+            count = int(due)
+            due -= count
+            for _ in range(count):
+                emit()
+            if count:
+                try:
+                    await session.writer.drain()
+                except ConnectionError:
+                    return
+
+    # ------------------------------------------------------------------
+    # Requests
+    # ------------------------------------------------------------------
+    def _start_api(self, session, fields):
+        session.send(IN.NEXT_VALID_ID, 1, self.next_order_id)
+        session.send(IN.MANAGED_ACCTS, 1, ",".join(self.accounts))
+
+    def _req_ids(self, session, fields):
+        session.send(IN.NEXT_VALID_ID, 1, self.next_order_id)
+
+    def _req_account_summary(self, session, fields):
+        req_id = fields[2]
+        for account in self.accounts:
+            for currency in CURRENCIES:
+                for tag in LEDGER_TAGS:
+                    value = f"{self.random.uniform(0, 1e6):.2f}"
+                    session.send(IN.ACCOUNT_SUMMARY, 1, req_id, account, tag, value, currency)
+        session.send(IN.ACCOUNT_SUMMARY_END, 1, req_id)
+
+    def _req_account_updates(self, session, fields):
+        subscribe, account = fields[2] == "1", fields[3]
+        if not subscribe:
+            if session.account_stream is not None:
+                session.account_stream.cancel()
+                session.account_stream = None
+            return
+        accounts = [account] if account in self.accounts else self.accounts
+        for name in accounts:
+            for currency in CURRENCIES[:2]:
+                for key in ACCOUNT_VALUE_KEYS:
+                    self._send_account_value(session, name, key, currency)
+            for position in range(self.positions):
+                self._send_portfolio(session, name, position)
+            session.send(IN.ACCT_UPDATE_TIME, 1, time.strftime("%H:%M"))
+            session.send(IN.ACCT_DOWNLOAD_END, 1, name)
+        if session.account_stream is None and self.account_update_rate:
+            def update():
+                self._send_account_value(session, self.random.choice(accounts),
+                                         self.random.choice(ACCOUNT_VALUE_KEYS), self.random.choice(CURRENCIES[:2]))
+            session.account_stream = self._spawn(
+                session, self._paced(session, self.account_update_rate * len(accounts), update))
+
+    def _send_account_value(self, session, account, key, currency):
+        session.send(IN.ACCT_VALUE, 2, key, f"{self.random.uniform(0, 1e6):.2f}", currency, account)
+
+    def _send_portfolio(self, session, account, position):
+        price = self.random.uniform(10, 500)
+        quantity = self.random.randint(1, 1000)
+        session.send(IN.PORTFOLIO_VALUE, 8, 100000 + position, f"SYM{position}", "STK", "", 0.0, "", "",
+                     "NASDAQ", "USD", f"SYM{position}", "NMS", quantity, price, price * quantity,
+                     price * 0.98, price * quantity * 0.02, 0.0, account)
+
+    def _req_real_time_bars(self, session, fields):
+        req_id, con_id, symbol = fields[2], fields[3], fields[4]
+        bar_time = int(time.time()) // 5 * 5
+        session.bars[req_id] = [bar_time, self.random.uniform(10, 500), symbol, con_id]
+        if session.bar_stream is None and self.bar_rate:
+            def bars():
+                for subscribed in list(session.bars):
+                    self._send_bar(session, subscribed)
+            session.bar_stream = self._spawn(session, self._paced(session, self.bar_rate, bars))
+
+    def _send_bar(self, session, req_id):
+        state = session.bars[req_id]
+        state[0] += 5
+        open_ = state[1]
+        close = max(0.01, open_ + self.random.gauss(0, open_ * 0.0005))
+        high, low = max(open_, close) * 1.0002, min(open_, close) * 0.9998
+        state[1] = close
+        session.send(IN.REAL_TIME_BARS, 3, req_id, state[0], f"{open_:.4f}", f"{high:.4f}", f"{low:.4f}",
+                     f"{close:.4f}", self.random.randint(0, 5000), f"{(high + low) / 2:.4f}",
+                     self.random.randint(0, 100))
+
+    def _cancel_real_time_bars(self, session, fields):
+        session.bars.pop(fields[2], None)
+        if not session.bars and session.bar_stream is not None:
+            session.bar_stream.cancel()
+            session.bar_stream = None
+
+    def _place_order(self, session, fields):
+        order_id = int(fields[1])
+        self.next_order_id = max(self.next_order_id, order_id + 1)
+        contract = fields[2:16]
+        action, quantity, limit_price = fields[16], float(fields[17]), fields[19]
+        price = float(limit_price) if limit_price else 100.0
+        perm_id = next(self._perm_ids)
+        self._order_status(session, order_id, "Submitted", 0, quantity, 0.0, perm_id, 0.0)
+        session.orders[order_id] = self._loop.call_later(
+            self.fill_delay, self._fill, session, order_id, contract, action, quantity, price, perm_id)
+
+    def _fill(self, session, order_id, contract, action, quantity, price, perm_id):
+        if session.orders.pop(order_id, None) is None:
+            return
+        con_id, symbol, sec_type, last_trade, strike, right, multiplier, exchange, _, currency, \
+            local_symbol, trading_class = contract[:12]
+        exec_id = f"0000e0d5.{order_id:08x}.{next(session.exec_ids):02d}.01"
+        account = self.accounts[0]
+        session.send(IN.EXECUTION_DATA, -1, order_id, con_id or 0, symbol, sec_type, last_trade, strike or 0.0,
+                     right, multiplier, exchange, currency, local_symbol, trading_class, exec_id,
+                     time.strftime("%Y%m%d  %H:%M:%S"), account, exchange, "BOT" if action == "BUY" else "SLD",
+                     quantity, price, perm_id, 0, 0, quantity, price, "", "", "", "", 1)
+        self._order_status(session, order_id, "Filled", quantity, 0, price, perm_id, price)
+        session.send(IN.COMMISSION_REPORT, 1, exec_id, 1.0, "USD", 0.0, 0.0, 0)
+
+    def _cancel_order(self, session, fields):
+        order_id = int(fields[2])
+        pending = session.orders.pop(order_id, None)
+        if pending is not None:
+            pending.cancel()
+            self._order_status(session, order_id, "Cancelled", 0, 0, 0.0, 0, 0.0)
+
+    def _order_status(self, session, order_id, status, filled, remaining, avg_price, perm_id, last_price):
+        session.send(IN.ORDER_STATUS, order_id, status, filled, remaining, avg_price, perm_id, 0,
+                     last_price, 0, "", 0.0)
+
+    def _req_executions(self, session, fields):
+        session.send(IN.EXECUTION_DATA_END, 1, fields[2])
@@ -0,0 +1,113 @@
+"""Replay recorded callbacks into TradingApp and report how it coped.
+
+Record with TradingApp(record_dir=...) or `python -m benchmarks.throughput --record DIR`,
+then run from api_bot/:
+
+    python -m benchmarks.replay recordings/ --speed 10
+    python -m benchmarks.replay recordings/callbacks-20240102-093000-0001.seg --max-speed --no-db
+
+The app connects to a silent fake gateway, so its own requests go nowhere
+and every data callback comes from the recording. Real-time bar streams
+are re-subscribed under synthetic contracts and account summaries are
+routed to the StatsManager, whatever request ids they were recorded with."""
+import argparse
+import asyncio
+import time
+import tracemalloc
+from benchmarks.fake_gateway import FakeGateway
+from benchmarks.throughput import (LatencyProbe, add_common_arguments, build_contracts, make_storage,
+                                   run_main, sample_memory)
+from connection.recording import CallbackReplayer
+from main import TradingApp
+
+
+# Connection-level callbacks of the recorded session would confuse the live one
+SESSION_CALLBACKS = ('connectAck', 'connectionClosed', 'nextValidId', 'managedAccounts')
+
+
+def map_request_ids(app, recorded):
+    """Recorded reqId -> live reqId of the component that now handles that stream."""
+    req_ids = {}
+    bar_streams = sorted(req_id for req_id, names in recorded.items() if 'realtimeBar' in names)
+    for req_id, contract in zip(bar_streams, build_contracts(len(bar_streams))):
+        app.data_stream.subscribe(contract)
+        key = (contract.conId, app.subscriptions.BARS, app.data_stream.what_to_show)
+        req_ids[req_id] = app.subscriptions.subscriptions[key].req_id
+    for req_id, names in recorded.items():
+        if names & {'accountSummary', 'accountSummaryEnd'}:
+            req_ids[req_id] = app.stats_manager.req_id
+    return req_ids
+
+
+async def run_replay(args):
+    gateway = FakeGateway(silent=True)
+    port = gateway.start()
+    storage = make_storage(args)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    app = TradingApp(port=port, client_id=args.client_id, storage_manager=storage, cycle_interval=args.cycle_interval)
+    probe = LatencyProbe(app)
+    probe.install()
+    replayer = CallbackReplayer(args.path, speed=None if args.max_speed else args.speed, max_gap=args.max_gap,
+                                skip=SESSION_CALLBACKS)
+    samples = []
+    started = time.perf_counter()
+    runner = asyncio.create_task(app.run())
+    sampler = None
+    try:
+        await app.order_executor.wait_until_ready(timeout=30)
+        # Start once the periodic tasks have made their first requests, as they would have when recording
+        while not app.tasks:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        replayer.req_ids.update(map_request_ids(app, replayer.request_ids()))
+        sampler = asyncio.create_task(sample_memory(app, probe, samples, args.sample_interval, started))
+        replay_stats = await replayer.run(app.connection.dispatcher)
+        # Let the write buffer commit what the replay queued
+        await asyncio.sleep(app.write_buffer.flush_interval * 2)
+    finally:
+        replayer.stop()
+        if sampler is not None:
+            sampler.cancel()
+            await asyncio.gather(sampler, return_exceptions=True)
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        gateway.stop()
+
+    report = {
+        'config': vars(args),
+        'replay': replay_stats,
+        'elapsed': elapsed,
+        'callbacks': sum(probe.callbacks.values()),
+        'callbacks_per_second': replay_stats['callbacks_per_second'],
+        'callbacks_by_name': {name: count / replay_stats['elapsed'] for name, count in probe.callbacks.most_common()},
+        'commit_latency': probe.summary(),
+        'never_committed': len(probe.stamped),
+        'write_buffer': app.write_buffer.stats(),
+        'memory': samples,
+        'peak_traced_mb': tracemalloc.get_traced_memory()[1] / 2**20 if tracemalloc.is_tracing() else None,
+    }
+    tracemalloc.stop()
+    print(f"Replayed {replay_stats['callbacks']} callbacks recorded over {replay_stats['recorded_duration']:.1f}s "
+          f"in {replay_stats['elapsed']:.1f}s (max lag behind schedule {replay_stats['max_lag'] * 1000:.1f} ms)")
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="segment file or directory of segments")
+    parser.add_argument('--speed', type=float, default=1.0, help="multiple of the recorded pace")
+    parser.add_argument('--max-speed', action='store_true', help="replay as fast as the app takes callbacks")
+    parser.add_argument('--max-gap', type=float, help="shorten idle gaps to this many seconds")
+    add_common_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    run_main(parse_args(argv), run_replay)
+
+
+if __name__ == "__main__":
+    main()
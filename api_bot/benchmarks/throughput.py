@@ -0,0 +1,339 @@
+"""End-to-end throughput benchmark of TradingApp against the fake gateway.
+
+Run from api_bot/:
+
+    python -m benchmarks.throughput --duration 60 --contracts 50 --bar-rate 5
+    python -m benchmarks.throughput --no-db --json report.json
+
+Reports callbacks per second, callback-to-commit latency percentiles per
+table and memory / queue depth sampled over the run."""
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from ibapi.contract import Contract
+from benchmarks.fake_gateway import FakeGateway
+from data_storage.async_postgresql_client import AsyncPostgresqlClient
+from main import TradingApp
+from utilsL.instrumentation import metrics
+from utilsL.tracing import tracer
+
+
+PERCENTILES = (50, 90, 99)
+
+# Key of a committed row, matched against the key stamped when its callback arrived
+ROW_KEYS = {
+    'bar_data': lambda row: (row['con_id'], row['bar_size'], int(row['time'].timestamp())),
+    'account_values': lambda row: (row['account'], row['currency'], row['key']),
+    'account_summary': lambda row: (row['account'], row['currency'], row['metric']),
+    'account_portfolio': lambda row: (row['account'], row['contract']),
+    'account_trades': lambda row: (row['ExecId'],),
+}
+
+
+class NullStorage:
+    """Storage stand-in that accepts every write, optionally after `commit_delay` seconds.
+
+    Measures the bot alone, without Postgres."""
+
+    def __init__(self, commit_delay=0.0):
+        self.commit_delay = commit_delay
+        self.rows = collections.Counter()
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def acquire(self, owner=None):
+        return self
+
+    async def release(self, owner=None):
+        pass
+
+    async def maintain_partitions(self, interval=86400):
+        pass
+
+    async def insert_data(self, table_name, data_list, chunk_size=1000):
+        if self.commit_delay:
+            await asyncio.sleep(self.commit_delay)
+        self.rows[table_name] += len(data_list)
+
+    async def upsert_data(self, table_name, data_list, conflict_columns, update_columns=None, chunk_size=1000):
+        await self.insert_data(table_name, data_list)
+
+    async def fetch(self, query, *args):
+        return []
+
+
+class LatencyProbe:
+    """Counts dispatcher callbacks and times each record from callback to commit.
+
+    Callbacks are seen through a tap on the app's dispatcher; the ones that
+    produce rows stamp a key (table plus the row's identity) on arrival,
+    and insert_data pops the keys of the rows it committed. A key updated
+    several times before a commit keeps its latest stamp, so the latency is
+    that of the freshest value. Only 5-second bars are timed: resampled
+    bars wait for their window by design."""
+
+    def __init__(self, app):
+        self.app = app
+        self.callbacks = collections.Counter()
+        self.latencies = collections.defaultdict(list)
+        self.stamped = {}
+        self._stampers = {
+            'realtimeBar': self._stamp_bar,
+            'updateAccountValue': lambda t, key, val, currency, account:
+                self._stamp('account_values', t, account, currency, key),
+            'accountSummary': lambda t, req_id, account, tag, value, currency:
+                self._stamp('account_summary', t, account, currency, tag),
+            'updatePortfolio': lambda t, contract, *args:
+                self._stamp('account_portfolio', t, args[-1], contract.symbol),
+            'execDetails': lambda t, req_id, contract, execution:
+                self._stamp('account_trades', t, execution.execId),
+        }
+
+    def install(self):
+        self.app.connection.add_tap(self._on_callback)
+
+        storage = self.app.storage_manager
+        insert_data = storage.insert_data
+
+        async def timed_insert(table_name, data_list, *args, **kwargs):
+            result = await insert_data(table_name, data_list, *args, **kwargs)
+            self._committed(table_name, data_list, time.perf_counter())
+            return result
+
+        storage.insert_data = timed_insert
+
+    def _on_callback(self, name, args):
+        self.callbacks[name] += 1
+        stamp = self._stampers.get(name)
+        if stamp is not None:
+            stamp(time.perf_counter(), *args)
+
+    def _stamp(self, table, t, *key):
+        self.stamped[(table,) + key] = t
+
+    def _stamp_bar(self, t, req_id, bar_time, *args):
+        subscription = self.app.subscriptions.by_req_id.get(req_id)
+        if subscription is not None:
+            self.stamped[('bar_data', subscription.con_id, self.app.data_stream.BAR_SIZE, bar_time)] = t
+
+    def _committed(self, table_name, rows, t):
+        row_key = ROW_KEYS.get(table_name)
+        if row_key is None:
+            return
+        latencies = self.latencies[table_name]
+        for row in rows:
+            stamped = self.stamped.pop((table_name,) + row_key(row), None)
+            if stamped is not None:
+                latencies.append(t - stamped)
+
+    def summary(self):
+        result = {}
+        for table, latencies in sorted(self.latencies.items()):
+            if not latencies:
+                continue
+            values = np.array(latencies) * 1000
+            result[table] = {'count': len(values), 'mean_ms': float(values.mean()), 'max_ms': float(values.max())}
+            for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                result[table][f'p{p}_ms'] = float(value)
+        return result
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        # Peak rather than current where /proc is not available (KiB on Linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def sample_memory(app, probe, samples, interval, started):
+    while True:
+        await asyncio.sleep(interval)
+        buffered = sum(stats['queue_depth'] for stats in app.write_buffer.stats().values())
+        samples.append({
+            'elapsed': round(time.perf_counter() - started, 2),
+            'rss_mb': round(rss_mb(), 1),
+            'traced_mb': round(tracemalloc.get_traced_memory()[0] / 2**20, 1) if tracemalloc.is_tracing() else None,
+            'callbacks': sum(probe.callbacks.values()),
+            'write_buffer_rows': buffered,
+            'send_queue': app.connection.client.queue_depth(),
+            'awaiting_commit': len(probe.stamped),
+        })
+
+
+async def place_orders(app, contracts, rate):
+    index = 0
+    while True:
+        await asyncio.sleep(1 / rate)
+        contract = contracts[index % len(contracts)]
+        app.order_executor.place_limit_order(contract, "BUY", 1, 100.0)
+        index += 1
+
+
+def make_storage(args):
+    if args.no_db:
+        return NullStorage(args.commit_delay)
+    return AsyncPostgresqlClient(db_name=args.db_name, db_user=args.db_user, db_password=args.db_password,
+                                 is_test_mode=True, host=args.db_host, port=args.db_port)
+
+
+def build_contracts(count):
+    contracts = []
+    for n in range(count):
+        contract = Contract()
+        contract.conId = 500000 + n
+        contract.symbol = f"BENCH{n}"
+        contract.secType = "STK"
+        contract.exchange = "SMART"
+        contract.currency = "USD"
+        contracts.append(contract)
+    return contracts
+
+
+async def run_benchmark(args):
+    gateway = FakeGateway(accounts=[f"DU{n:06d}" for n in range(1, args.accounts + 1)], positions=args.positions,
+                          bar_rate=args.bar_rate, account_update_rate=args.account_update_rate,
+                          fill_delay=args.fill_delay, seed=args.seed)
+    port = gateway.start()
+    storage = make_storage(args)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    app = TradingApp(port=port, client_id=args.client_id, storage_manager=storage, cycle_interval=args.cycle_interval,
+                     record_dir=args.record)
+    probe = LatencyProbe(app)
+    probe.install()
+    samples = []
+    started = time.perf_counter()
+    runner = asyncio.create_task(app.run())
+    helpers = []
+    try:
+        await app.order_executor.wait_until_ready(timeout=30)
+        contracts = build_contracts(args.contracts)
+        for contract in contracts:
+            app.data_stream.subscribe(contract)
+        helpers.append(asyncio.create_task(sample_memory(app, probe, samples, args.sample_interval, started)))
+        if args.order_rate:
+            helpers.append(asyncio.create_task(place_orders(app, contracts, args.order_rate)))
+        await asyncio.wait([runner], timeout=args.duration)
+    finally:
+        for task in helpers:
+            task.cancel()
+        await asyncio.gather(*helpers, return_exceptions=True)
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        gateway.stop()
+
+    report = {
+        'config': vars(args),
+        'elapsed': elapsed,
+        'callbacks': sum(probe.callbacks.values()),
+        'callbacks_per_second': sum(probe.callbacks.values()) / elapsed,
+        'callbacks_by_name': {name: count / elapsed for name, count in probe.callbacks.most_common()},
+        'commit_latency': probe.summary(),
+        'never_committed': len(probe.stamped),
+        'write_buffer': app.write_buffer.stats(),
+        'rate_limiter': app.connection.client.stats(),
+        'gateway': gateway.stats(),
+        'memory': samples,
+        'peak_traced_mb': tracemalloc.get_traced_memory()[1] / 2**20 if tracemalloc.is_tracing() else None,
+    }
+    tracemalloc.stop()
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['callbacks']} callbacks in {report['elapsed']:.1f}s: "
+          f"{report['callbacks_per_second']:.0f}/s")
+    for name, rate in report['callbacks_by_name'].items():
+        print(f"  {name:<24}{rate:>10.1f}/s")
+
+    print("\nCallback to commit latency (ms)")
+    print(f"  {'table':<20}{'count':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for table, stats in report['commit_latency'].items():
+        print(f"  {table:<20}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p90_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    print(f"  {report['never_committed']} stamped records not committed by the end of the run")
+
+    print("\nMemory over time")
+    print(f"  {'t (s)':>8}{'rss MB':>10}{'traced MB':>11}{'buffered':>10}{'send q':>8}")
+    for sample in report['memory']:
+        traced = f"{sample['traced_mb']:.1f}" if sample['traced_mb'] is not None else "-"
+        print(f"  {sample['elapsed']:>8.1f}{sample['rss_mb']:>10.1f}{traced:>11}"
+              f"{sample['write_buffer_rows']:>10}{sample['send_queue']:>8}")
+
+
+def add_common_arguments(parser):
+    parser.add_argument('--cycle-interval', type=float, default=5,
+                        help="StatsManager / PortfolioManager cycle, 60 s in production")
+    parser.add_argument('--sample-interval', type=float, default=1.0)
+    parser.add_argument('--tracemalloc', action='store_true', help="also trace Python allocations (slower)")
+    parser.add_argument('--client-id', type=int, default=900)
+    parser.add_argument('--workdir', help="directory for the archive and order id state (default: a temp dir)")
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--no-db', action='store_true', help="commit to NullStorage instead of Postgres")
+    parser.add_argument('--commit-delay', type=float, default=0.0, help="simulated commit time with --no-db")
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=5432)
+    parser.add_argument('--db-name', default='test')
+    parser.add_argument('--db-user', default='myuser')
+    parser.add_argument('--db-password', help="default: PGPASSWORD / .pgpass")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=30, help="seconds to run")
+    parser.add_argument('--contracts', type=int, default=20, help="real-time bar subscriptions")
+    parser.add_argument('--bar-rate', type=float, default=5, help="bars per second per subscription")
+    parser.add_argument('--accounts', type=int, default=1)
+    parser.add_argument('--positions', type=int, default=20, help="portfolio positions per account")
+    parser.add_argument('--account-update-rate', type=float, default=10,
+                        help="updateAccountValue messages per second per account")
+    parser.add_argument('--order-rate', type=float, default=1, help="limit orders placed per second (0: none)")
+    parser.add_argument('--fill-delay', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--record', help="also record the callbacks into segment files in this directory")
+    add_common_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def run_main(args, benchmark):
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    json_path = os.path.abspath(args.json) if args.json else None
+    # Paths given on the command line are relative to where it was typed
+    for name in ('record', 'path'):
+        if getattr(args, name, None):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    # The app writes its archive and order id state relative to the working directory
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix='ib-bench-'))
+    report = asyncio.run(benchmark(args))
+    report['metrics'] = metrics.snapshot()
+    report['spans'] = tracer.snapshot()
+    print_report(report)
+    print("\n" + metrics.report())
+    print("\n" + tracer.report())
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+def main(argv=None):
+    run_main(parse_args(argv), run_benchmark)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules import each other relative to api_bot (e.g. `from data_storage.schemas import get_schema`)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
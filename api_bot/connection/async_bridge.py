@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+
+class IBRequestError(Exception):
+    def __init__(self, req_id, error_code, error_string):
+        super().__init__(f"IB request {req_id} failed with error {error_code}: {error_string}")
+        self.req_id = req_id
+        self.error_code = error_code
+        self.error_string = error_string
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, exception):
+    if not future.done():
+        future.set_exception(exception)
+
+
+def resolve_threadsafe(future, result=None):
+    """Complete an asyncio future from any thread (e.g. the IB reader thread)."""
+    future.get_loop().call_soon_threadsafe(_set_result, future, result)
+
+
+def reject_threadsafe(future, exception):
+    future.get_loop().call_soon_threadsafe(_set_exception, future, exception)
+
+
+class PendingRequests:
+    """Futures keyed by IB request id, created on the loop, completed from callbacks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def create(self, req_id):
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._futures[req_id] = future
+        return future
+
+    def get(self, req_id):
+        return self._futures.get(req_id)
+
+    def resolve(self, req_id, result=None):
+        with self._lock:
+            future = self._futures.pop(req_id, None)
+        if future is not None:
+            resolve_threadsafe(future, result)
+        return future is not None
+
+    def reject(self, req_id, exception):
+        with self._lock:
+            future = self._futures.pop(req_id, None)
+        if future is not None:
+            reject_threadsafe(future, exception)
+        return future is not None
+
+    def discard(self, req_id):
+        with self._lock:
+            self._futures.pop(req_id, None)
+
+    def __contains__(self, req_id):
+        return req_id in self._futures
+
+    def __len__(self):
+        return len(self._futures)
@@ -1,20 +1,344 @@
+import asyncio
+import inspect
+import itertools
 import logging
-from ibapi.client import EClient
+import threading
+import time
+from ibapi.wrapper import EWrapper
+from connection.rate_limiter import ThrottledClient
+from utilsL.instrumentation import metrics
+
+
+# Request ids handed out by the shared connection start far above any order id
+# (order ids come from nextValidId and share the error callback's id field),
+# and above the fixed ids the standalone scripts used (122/123). Both must
+# stay below 2**31, the API's int range.
+REQUEST_ID_START = 2**30
+
+# Every callback the decoder can deliver
+WRAPPER_CALLBACKS = tuple(name for name, _ in inspect.getmembers(EWrapper, inspect.isfunction)
+                          if not name.startswith('_') and name != 'logAnswer')
+
+
+class CallbackDispatcher(EWrapper):
+    """Single EWrapper for the shared connection.
+
+    Callbacks are routed to registered handler objects, which implement the
+    EWrapper methods they are interested in:
+      - request callbacks (first argument is a reqId) go to the handler
+        registered for that reqId; errors only when the id is in the request
+        id range, since below it the id is an order id,
+      - account callbacks go to handlers subscribed to that account (or to
+        all accounts),
+      - everything else (orders, executions, ids, errors without a reqId)
+        is broadcast to the general subscribers.
+
+    Registries are copy-on-write so the reader thread never takes a lock.
+    Taps see every callback, routed or not, before it is routed; with no
+    tap installed the callbacks carry no extra cost.
+    """
+
+    def __init__(self):
+        EWrapper.__init__(self)
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._request_handlers = {}
+        self._account_handlers = {}
+        self._subscribers = ()
+        self._taps = ()
+        self._histograms = {}
+
+    # ------------------------------------------------------------------
+    # Registration
+    # ------------------------------------------------------------------
+    def register_request(self, req_id, handler):
+        with self._lock:
+            handlers = dict(self._request_handlers)
+            handlers[req_id] = handler
+            self._request_handlers = handlers
+
+    def unregister_request(self, req_id):
+        with self._lock:
+            handlers = dict(self._request_handlers)
+            handlers.pop(req_id, None)
+            self._request_handlers = handlers
+
+    def subscribe_account(self, handler, account=None):
+        with self._lock:
+            handlers = dict(self._account_handlers)
+            handlers[account] = handlers.get(account, ()) + (handler,)
+            self._account_handlers = handlers
+
+    def unsubscribe_account(self, handler, account=None):
+        with self._lock:
+            handlers = dict(self._account_handlers)
+            remaining = tuple(h for h in handlers.get(account, ()) if h is not handler)
+            if remaining:
+                handlers[account] = remaining
+            else:
+                handlers.pop(account, None)
+            self._account_handlers = handlers
+
+    def subscribe(self, handler):
+        with self._lock:
+            self._subscribers = self._subscribers + (handler,)
+
+    def unsubscribe(self, handler):
+        with self._lock:
+            self._subscribers = tuple(h for h in self._subscribers if h is not handler)
+
+    def add_tap(self, tap):
+        """Call tap(name, args) on the reader thread before each callback is routed."""
+        with self._lock:
+            if not self._taps:
+                for name in WRAPPER_CALLBACKS:
+                    # Instance attributes shadow the methods the decoder looks up
+                    self.__dict__[name] = self._tapped(name, getattr(self, name))
+            self._taps = self._taps + (tap,)
+
+    def remove_tap(self, tap):
+        with self._lock:
+            self._taps = tuple(t for t in self._taps if t != tap)
+            if not self._taps:
+                for name in WRAPPER_CALLBACKS:
+                    self.__dict__.pop(name, None)
+
+    def _tapped(self, name, callback):
+        def tapped(*args):
+            for tap in self._taps:
+                try:
+                    tap(name, args)
+                except Exception as e:
+                    self.logger.error("Tap on %s failed: %s", name, e)
+            return callback(*args)
+        return tapped
+
+    # ------------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------------
+    def _call(self, handler, name, args):
+        callback = getattr(handler, name, None)
+        if callback is None:
+            return
+        key = (type(handler), name)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = metrics.histogram(f"callback.{type(handler).__name__}.{name}")
+        start = time.perf_counter()
+        try:
+            callback(*args)
+        except Exception as e:
+            metrics.count(f"callback.{type(handler).__name__}.{name}.errors")
+            self.logger.error("Handler %s.%s failed: %s", type(handler).__name__, name, e)
+        histogram.record(time.perf_counter() - start)
+
+    def _route_request(self, name, req_id, *args):
+        handler = self._request_handlers.get(req_id)
+        if handler is None:
+            return False
+        self._call(handler, name, (req_id,) + args)
+        return True
+
+    def _route_account(self, name, account, *args):
+        handlers = self._account_handlers
+        for handler in handlers.get(account, ()):
+            self._call(handler, name, args)
+        if account is not None:
+            for handler in handlers.get(None, ()):
+                self._call(handler, name, args)
+
+    def _route_all_accounts(self, name, *args):
+        seen = set()
+        for handlers in self._account_handlers.values():
+            for handler in handlers:
+                if id(handler) not in seen:
+                    seen.add(id(handler))
+                    self._call(handler, name, args)
+
+    def _broadcast(self, name, *args):
+        for handler in self._subscribers:
+            self._call(handler, name, args)
+
+    # ------------------------------------------------------------------
+    # Connection level callbacks
+    # ------------------------------------------------------------------
+    def error(self, reqId, errorCode, errorString):
+        # Below REQUEST_ID_START the id belongs to an order, whose handlers are subscribers
+        if reqId < REQUEST_ID_START or not self._route_request("error", reqId, errorCode, errorString):
+            self.logger.error("Error %s (reqId %s): %s", errorCode, reqId, errorString)
+            self._broadcast("error", reqId, errorCode, errorString)
+
+    def connectionClosed(self):
+        self.logger.info("IB connection closed")
+        self._broadcast("connectionClosed")
+
+    def nextValidId(self, orderId):
+        self._broadcast("nextValidId", orderId)
+
+    def managedAccounts(self, accountsList):
+        self._broadcast("managedAccounts", accountsList)
+
+    # ------------------------------------------------------------------
+    # Account summary
+    # ------------------------------------------------------------------
+    def accountSummary(self, reqId, account, tag, value, currency):
+        self._route_request("accountSummary", reqId, account, tag, value, currency)
+
+    def accountSummaryEnd(self, reqId):
+        self._route_request("accountSummaryEnd", reqId)
+
+    # ------------------------------------------------------------------
+    # Account updates
+    # ------------------------------------------------------------------
+    def updateAccountValue(self, key, val, currency, accountName):
+        self._route_account("updateAccountValue", accountName, key, val, currency, accountName)
+
+    def updatePortfolio(self, contract, position, marketPrice, marketValue,
+                        averageCost, unrealizedPNL, realizedPNL, accountName):
+        self._route_account("updatePortfolio", accountName, contract, position, marketPrice,
+                            marketValue, averageCost, unrealizedPNL, realizedPNL, accountName)
+
+    def updateAccountTime(self, timeStamp):
+        self._route_all_accounts("updateAccountTime", timeStamp)
+
+    def accountDownloadEnd(self, accountName):
+        self._route_account("accountDownloadEnd", accountName, accountName)
+
+    # ------------------------------------------------------------------
+    # Contract details
+    # ------------------------------------------------------------------
+    def contractDetails(self, reqId, contractDetails):
+        self._route_request("contractDetails", reqId, contractDetails)
+
+    def contractDetailsEnd(self, reqId):
+        self._route_request("contractDetailsEnd", reqId)
+
+    # ------------------------------------------------------------------
+    # Market data
+    # ------------------------------------------------------------------
+    def historicalData(self, reqId, bar):
+        self._route_request("historicalData", reqId, bar)
+
+    def historicalDataUpdate(self, reqId, bar):
+        self._route_request("historicalDataUpdate", reqId, bar)
+
+    def historicalDataEnd(self, reqId, start, end):
+        self._route_request("historicalDataEnd", reqId, start, end)
+
+    def realtimeBar(self, reqId, time, open_, high, low, close, volume, wap, count):
+        self._route_request("realtimeBar", reqId, time, open_, high, low, close, volume, wap, count)
+
+    def tickPrice(self, reqId, tickType, price, attrib):
+        self._route_request("tickPrice", reqId, tickType, price, attrib)
+
+    def tickSize(self, reqId, tickType, size):
+        self._route_request("tickSize", reqId, tickType, size)
+
+    def tickString(self, reqId, tickType, value):
+        self._route_request("tickString", reqId, tickType, value)
+
+    def tickGeneric(self, reqId, tickType, value):
+        self._route_request("tickGeneric", reqId, tickType, value)
+
+    def updateMktDepth(self, reqId, position, operation, side, price, size):
+        self._route_request("updateMktDepth", reqId, position, operation, side, price, size)
+
+    def updateMktDepthL2(self, reqId, position, marketMaker, operation, side, price, size, isSmartDepth):
+        self._route_request("updateMktDepthL2", reqId, position, marketMaker, operation, side, price, size, isSmartDepth)
+
+    # ------------------------------------------------------------------
+    # Orders and executions
+    # ------------------------------------------------------------------
+    def orderStatus(self, orderId, status, filled, remaining, avgFillPrice, permId,
+                    parentId, lastFillPrice, clientId, whyHeld, mktCapPrice):
+        self._broadcast("orderStatus", orderId, status, filled, remaining, avgFillPrice, permId,
+                        parentId, lastFillPrice, clientId, whyHeld, mktCapPrice)
+
+    def openOrder(self, orderId, contract, order, orderState):
+        self._broadcast("openOrder", orderId, contract, order, orderState)
+
+    def openOrderEnd(self):
+        self._broadcast("openOrderEnd")
+
+    def execDetails(self, reqId, contract, execution):
+        # Live executions arrive with reqId -1, answers to reqExecutions carry the request id
+        if not self._route_request("execDetails", reqId, contract, execution):
+            self._broadcast("execDetails", reqId, contract, execution)
+
+    def execDetailsEnd(self, reqId):
+        self._route_request("execDetailsEnd", reqId)
+
+    def commissionReport(self, commissionReport):
+        self._broadcast("commissionReport", commissionReport)
+
 
 class IBConnection:
-    def __init__(self, app):
-        self.app = app
+    """One socket to the gateway shared by every component of the bot.
+
+    All requests go out through a ThrottledClient, keeping the connection
+    under IB's message rate limit (`rate` per second plus `burst`)."""
+
+    def __init__(self, rate=40, burst=10):
         self.logger = logging.getLogger(__name__)
+        self.dispatcher = CallbackDispatcher()
+        self.client = ThrottledClient(self.dispatcher, rate=rate, burst=burst)
+        self._reader_thread = None
+        self._req_ids = itertools.count(REQUEST_ID_START)
+        self._req_id_lock = threading.Lock()
 
     async def connect(self, host, port, client_id):
         try:
-            self.app.connect(host, port, client_id)
-            self.logger.info(f"Connected to IB on {host}:{port}")
-            # Remove self.app.run() from here
+            await asyncio.to_thread(self.client.connect, host, port, client_id)
+            if not self.client.isConnected():
+                raise ConnectionError(f"Could not connect to IB on {host}:{port}")
+
+            # A single reader thread decodes messages for all subscribers
+            self._reader_thread = threading.Thread(target=self.client.run, name="ib-reader", daemon=True)
+            self._reader_thread.start()
+            self.logger.info(f"Connected to IB on {host}:{port} with clientId {client_id}")
         except Exception as e:
             self.logger.error(f"Failed to connect to IB: {str(e)}")
             raise
 
     async def disconnect(self):
-        self.app.disconnect()
-        self.logger.info("Disconnected from IB")
\ No newline at end of file
+        self.client.disconnect()
+        if self._reader_thread is not None:
+            await asyncio.to_thread(self._reader_thread.join, 5)
+            self._reader_thread = None
+        self.logger.info("Disconnected from IB")
+
+    def is_connected(self):
+        return self.client.isConnected()
+
+    def next_request_id(self):
+        with self._req_id_lock:
+            return next(self._req_ids)
+
+    def register_request(self, handler, req_id=None):
+        if req_id is None:
+            req_id = self.next_request_id()
+        elif req_id < REQUEST_ID_START:
+            raise ValueError(f"Request id {req_id} is in the order id range (below {REQUEST_ID_START})")
+        self.dispatcher.register_request(req_id, handler)
+        return req_id
+
+    def unregister_request(self, req_id):
+        self.dispatcher.unregister_request(req_id)
+
+    def subscribe_account(self, handler, account=None):
+        self.dispatcher.subscribe_account(handler, account)
+
+    def unsubscribe_account(self, handler, account=None):
+        self.dispatcher.unsubscribe_account(handler, account)
+
+    def subscribe(self, handler):
+        self.dispatcher.subscribe(handler)
+
+    def unsubscribe(self, handler):
+        self.dispatcher.unsubscribe(handler)
+
+    def add_tap(self, tap):
+        self.dispatcher.add_tap(tap)
+
+    def remove_tap(self, tap):
+        self.dispatcher.remove_tap(tap)
@@ -0,0 +1,254 @@
+import collections
+import itertools
+import logging
+import queue
+import threading
+import time
+from ibapi.client import EClient
+from ibapi.message import OUT
+from ibapi.server_versions import MIN_SERVER_VER_SYNT_REALTIME_BARS
+
+
+# Priority classes, lowest value is sent first
+ORDERS, CANCELS, ACCOUNT, DATA = range(4)
+PRIORITY_NAMES = {ORDERS: 'orders', CANCELS: 'cancels', ACCOUNT: 'account', DATA: 'data'}
+
+MESSAGE_PRIORITIES = {
+    OUT.PLACE_ORDER: ORDERS,
+    OUT.CANCEL_ORDER: ORDERS,
+    OUT.REQ_GLOBAL_CANCEL: ORDERS,
+    OUT.REQ_IDS: ORDERS,
+    # Cancelling a subscription frees a line, so it goes before new data requests
+    OUT.CANCEL_MKT_DATA: CANCELS,
+    OUT.CANCEL_MKT_DEPTH: CANCELS,
+    OUT.CANCEL_HISTORICAL_DATA: CANCELS,
+    OUT.CANCEL_REAL_TIME_BARS: CANCELS,
+    OUT.CANCEL_ACCOUNT_SUMMARY: CANCELS,
+    OUT.CANCEL_POSITIONS: CANCELS,
+    OUT.CANCEL_SCANNER_SUBSCRIPTION: CANCELS,
+    OUT.CANCEL_FUNDAMENTAL_DATA: CANCELS,
+    OUT.REQ_OPEN_ORDERS: ACCOUNT,
+    OUT.REQ_ALL_OPEN_ORDERS: ACCOUNT,
+    OUT.REQ_AUTO_OPEN_ORDERS: ACCOUNT,
+    OUT.REQ_ACCT_DATA: ACCOUNT,
+    OUT.REQ_EXECUTIONS: ACCOUNT,
+    OUT.REQ_POSITIONS: ACCOUNT,
+    OUT.REQ_ACCOUNT_SUMMARY: ACCOUNT,
+    OUT.REQ_MANAGED_ACCTS: ACCOUNT,
+}
+
+# Sent straight away: the handshake must complete before the sender runs
+UNTHROTTLED = {OUT.START_API}
+
+# The request each cancel undoes. A cancel jumps ahead of data requests, but
+# never ahead of its own request, which must reach the gateway first.
+CANCELLED_REQUESTS = {
+    OUT.CANCEL_MKT_DATA: OUT.REQ_MKT_DATA,
+    OUT.CANCEL_MKT_DEPTH: OUT.REQ_MKT_DEPTH,
+    OUT.CANCEL_HISTORICAL_DATA: OUT.REQ_HISTORICAL_DATA,
+    OUT.CANCEL_REAL_TIME_BARS: OUT.REQ_REAL_TIME_BARS,
+    OUT.CANCEL_ACCOUNT_SUMMARY: OUT.REQ_ACCOUNT_SUMMARY,
+    OUT.CANCEL_POSITIONS: OUT.REQ_POSITIONS,
+    OUT.CANCEL_SCANNER_SUBSCRIPTION: OUT.REQ_SCANNER_SUBSCRIPTION,
+    OUT.CANCEL_FUNDAMENTAL_DATA: OUT.REQ_FUNDAMENTAL_DATA,
+}
+CANCELLABLE = frozenset(CANCELLED_REQUESTS.values())
+# Positions requests and cancels carry no request id
+WITHOUT_REQ_ID = {OUT.REQ_POSITIONS, OUT.CANCEL_POSITIONS}
+
+
+def message_priority(msg):
+    return MESSAGE_PRIORITIES.get(int(msg[:msg.index('\0')]), DATA)
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst` tokens.
+
+    The worst one-second window is burst + rate messages, so with IB's limit
+    of 50 messages per second the defaults keep 10 in reserve for bursts and
+    send 40 per second sustained."""
+
+    def __init__(self, rate=40, burst=10):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available (0 when one is)."""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+
+class PriorityStats:
+    def __init__(self):
+        self.queued = 0
+        self.max_queued = 0
+        self.sent = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self):
+        return {
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'sent': self.sent,
+            'throttled': self.throttled,
+            'avg_wait': self.total_wait / self.sent if self.sent else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+class ThrottledClient(EClient):
+    """EClient whose outgoing messages all pass through one token bucket.
+
+    Every request method of EClient ends in sendMsg(), so overriding it
+    throttles placeOrder, reqAccountSummary, reqHistoricalData and the rest
+    alike. sendMsg() only queues the message, by priority class (orders,
+    then cancels, then account requests, then market data), and returns at
+    once; a sender thread takes the highest-priority message whenever a
+    token is available. A cancel whose request is still queued is held back
+    until that request has been sent. On disconnect, queued orders and
+    cancels are still sent; the other queued messages are dropped."""
+
+    def __init__(self, wrapper, rate=40, burst=10):
+        EClient.__init__(self, wrapper)
+        self.logger = logging.getLogger(__name__)
+        self.bucket = TokenBucket(rate, burst)
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._stats = {priority: PriorityStats() for priority in PRIORITY_NAMES}
+        self._stats_lock = threading.Lock()
+        self._sender = None
+        self._sender_lock = threading.Lock()
+        # Queued requests per (request message id, reqId), and the cancels waiting on them
+        self._unsent = collections.Counter()
+        self._held = {}
+        self._held_lock = threading.Lock()
+
+    def _stream_key(self, msg_id, msg):
+        """(request message id, reqId) a request or cancel refers to."""
+        request = CANCELLED_REQUESTS.get(msg_id, msg_id)
+        if msg_id in WITHOUT_REQ_ID:
+            return request, None
+        fields = msg.split('\0', 3)
+        if msg_id == OUT.REQ_HISTORICAL_DATA and self.serverVersion() >= MIN_SERVER_VER_SYNT_REALTIME_BARS:
+            # Newer servers take no version field here
+            return request, fields[1]
+        return request, fields[2]
+
+    def sendMsg(self, msg):
+        msg_id = int(msg[:msg.index('\0')])
+        if msg_id in UNTHROTTLED:
+            EClient.sendMsg(self, msg)
+            return
+
+        priority = message_priority(msg)
+        with self._stats_lock:
+            stats = self._stats[priority]
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+        item = (priority, next(self._sequence), time.perf_counter(), msg)
+        if msg_id in CANCELLABLE or msg_id in CANCELLED_REQUESTS:
+            key = self._stream_key(msg_id, msg)
+            with self._held_lock:
+                if msg_id in CANCELLABLE:
+                    self._unsent[key] += 1
+                elif self._unsent[key]:
+                    self._held.setdefault(key, []).append(item)
+                    return
+        self._queue.put(item)
+        self._ensure_sender()
+
+    def _sent(self, msg):
+        msg_id = int(msg[:msg.index('\0')])
+        if msg_id not in CANCELLABLE:
+            return
+        key = self._stream_key(msg_id, msg)
+        with self._held_lock:
+            self._unsent[key] -= 1
+            if self._unsent[key] > 0:
+                return
+            del self._unsent[key]
+            held = self._held.pop(key, ())
+        for item in held:
+            self._queue.put(item)
+
+    def _ensure_sender(self):
+        if self._sender is not None:
+            return
+        with self._sender_lock:
+            if self._sender is None:
+                self._sender = threading.Thread(target=self._send_loop, name="ib-sender", daemon=True)
+                self._sender.start()
+
+    def _send_loop(self):
+        while True:
+            item = self._queue.get()
+            priority, _, queued_at, msg = item
+            if msg is None:
+                break
+
+            wait = self.bucket.wait_time()
+            if wait > 0:
+                # Put it back so a higher-priority message queued meanwhile goes first
+                self._queue.put(item)
+                time.sleep(wait)
+                continue
+
+            self.bucket.take()
+            waited = time.perf_counter() - queued_at
+            with self._stats_lock:
+                stats = self._stats[priority]
+                stats.queued -= 1
+                stats.sent += 1
+                stats.total_wait += waited
+                stats.max_wait = max(stats.max_wait, waited)
+                if waited > 1 / self.bucket.rate:
+                    stats.throttled += 1
+            try:
+                EClient.sendMsg(self, msg)
+            except Exception as e:
+                self.logger.error(f"Failed to send message {msg[:msg.index(chr(0))]}: {str(e)}")
+            self._sent(msg)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            return {PRIORITY_NAMES[priority]: stats.as_dict() for priority, stats in self._stats.items()}
+
+    def disconnect(self):
+        with self._sender_lock:
+            sender, self._sender = self._sender, None
+        if sender is not None:
+            # Queued after every order and cancel, so cleanup's cancels still go out
+            self._queue.put((CANCELS, next(self._sequence), 0.0, None))
+            sender.join(5)
+        dropped = 0
+        while True:
+            try:
+                self._queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                break
+        with self._held_lock:
+            # Their requests were never sent, so there is nothing to cancel
+            self._held.clear()
+            self._unsent.clear()
+        if dropped:
+            self.logger.warning(f"Dropped {dropped} unsent messages on disconnect")
+        with self._stats_lock:
+            for stats in self._stats.values():
+                stats.queued = 0
+        EClient.disconnect(self)
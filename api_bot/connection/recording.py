@@ -0,0 +1,249 @@
+import asyncio
+import glob
+import inspect
+import logging
+import os
+import pickle
+import queue
+import struct
+import threading
+import time
+from ibapi.wrapper import EWrapper
+from connection.ib_connection import WRAPPER_CALLBACKS
+
+
+# Segment file layout:
+#   header: magic, format version, wall clock (epoch seconds) and monotonic ns at the start
+#   records: monotonic ns, callback id, reqId, payload length, then the payload
+# Callback id DEFINE introduces a callback name (the payload, UTF-8) under the
+# next free id, so each segment is self-describing. Payloads are the pickled
+# arguments, without the reqId, which is kept in the record header so ids
+# can be scanned and remapped without unpickling.
+MAGIC = b'IBCB'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHdq')
+RECORD = struct.Struct('<qHiI')
+DEFINE = 0
+NO_REQ_ID = -2**31
+
+# Callbacks whose first argument is a request id
+REQUEST_CALLBACKS = frozenset(
+    name for name in WRAPPER_CALLBACKS
+    if list(inspect.signature(getattr(EWrapper, name)).parameters)[1:2] in (['reqId'], ['tickerId'], ['requestId'])
+)
+
+
+class CallbackRecorder:
+    """Records every inbound EWrapper callback into binary segment files.
+
+    Install with connection.add_tap(recorder.record). The reader thread only
+    stamps the callback with time.monotonic_ns() and queues it; a writer
+    thread pickles the arguments and appends to the current segment in
+    `directory`, starting a new one after `segment_bytes` bytes or
+    `segment_seconds` seconds."""
+
+    def __init__(self, directory, segment_bytes=256 * 2**20, segment_seconds=3600, buffer_bytes=2**20):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.buffer_bytes = buffer_bytes
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._ids = {}
+        self._segment_started = 0.0
+        self._segment_number = 0
+        self.segments = []
+        self.records = 0
+        self.bytes_written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, name, args):
+        self._queue.put((time.monotonic_ns(), name, args))
+        if self._writer is None:
+            self._start_writer()
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="callback-recorder", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                self.logger.error(f"Failed to record {item[1]} callback: {str(e)}")
+        self._close_segment()
+
+    def _write(self, timestamp, name, args):
+        if self._file is None or self._file.tell() >= self.segment_bytes \
+                or time.monotonic() - self._segment_started >= self.segment_seconds:
+            self._open_segment()
+
+        callback_id = self._ids.get(name)
+        if callback_id is None:
+            callback_id = self._ids[name] = len(self._ids) + 1
+            encoded = name.encode()
+            self._file.write(RECORD.pack(timestamp, DEFINE, NO_REQ_ID, len(encoded)))
+            self._file.write(encoded)
+
+        if name in REQUEST_CALLBACKS:
+            req_id, args = args[0], args[1:]
+        else:
+            req_id = NO_REQ_ID
+        payload = pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(RECORD.pack(timestamp, callback_id, req_id, len(payload)))
+        self._file.write(payload)
+        self.records += 1
+        self.bytes_written += RECORD.size + len(payload)
+
+    def _open_segment(self):
+        self._close_segment()
+        self._segment_number += 1
+        path = os.path.join(self.directory,
+                            f"callbacks-{time.strftime('%Y%m%d-%H%M%S')}-{self._segment_number:04d}.seg")
+        self._file = open(path, 'wb', buffering=self.buffer_bytes)
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, time.time(), time.monotonic_ns()))
+        self._ids = {}
+        self._segment_started = time.monotonic()
+        self.segments.append(path)
+        self.logger.info(f"Recording callbacks to {path}")
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """Write out everything queued and close the segment."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+
+
+def read_segment(path, with_args=True):
+    """Yield (wall clock ns, callback name, reqId or None, args) for each record of a segment.
+
+    With with_args=False payloads are skipped and args is None."""
+    with open(path, 'rb') as f:
+        magic, version, wall_start, monotonic_start = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} callback segment")
+        offset = int(wall_start * 1e9) - monotonic_start
+        names = {}
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                # A segment cut short by a crash ends at its last whole record
+                return
+            timestamp, callback_id, req_id, length = RECORD.unpack(header)
+            if callback_id == DEFINE:
+                names[len(names) + 1] = f.read(length).decode()
+                continue
+            req_id = None if req_id == NO_REQ_ID else req_id
+            if not with_args:
+                f.seek(length, os.SEEK_CUR)
+                yield timestamp + offset, names[callback_id], req_id, None
+                continue
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            args = pickle.loads(payload)
+            if req_id is not None:
+                args = (req_id,) + args
+            yield timestamp + offset, names[callback_id], req_id, args
+
+
+class CallbackReplayer:
+    """Feeds recorded callbacks into an EWrapper, normally a connection's dispatcher.
+
+    `speed` scales the recorded pacing (1 replays in real time, 10 ten times
+    faster); None replays as fast as the target takes them. Idle gaps longer
+    than `max_gap` seconds are shortened to it. `req_ids` maps recorded
+    request ids to the ids live handlers are registered under; callbacks
+    named in `skip` are not delivered."""
+
+    def __init__(self, paths, speed=1.0, max_gap=None, req_ids=None, skip=()):
+        self.logger = logging.getLogger(__name__)
+        if isinstance(paths, str):
+            paths = sorted(glob.glob(os.path.join(paths, '*.seg'))) if os.path.isdir(paths) else [paths]
+        self.paths = list(paths)
+        self.speed = speed
+        self.max_gap = max_gap
+        self.req_ids = dict(req_ids or {})
+        self.skip = frozenset(skip)
+        self._stopped = threading.Event()
+
+    def records(self, with_args=True):
+        for path in self.paths:
+            yield from read_segment(path, with_args)
+
+    def request_ids(self):
+        """{recorded reqId: set of callback names delivered for it}, without unpickling."""
+        found = {}
+        for _, name, req_id, _ in self.records(with_args=False):
+            if req_id is not None:
+                found.setdefault(req_id, set()).add(name)
+        return found
+
+    def stop(self):
+        self._stopped.set()
+
+    def replay(self, target):
+        """Deliver every record to target on the calling thread. Returns replay statistics."""
+        delivered = 0
+        max_lag = 0.0
+        started = time.perf_counter()
+        schedule = 0.0
+        previous = None
+        for timestamp, name, req_id, args in self.records():
+            if self._stopped.is_set():
+                break
+            if name in self.skip:
+                continue
+            if previous is not None:
+                gap = (timestamp - previous) / 1e9
+                if self.max_gap is not None:
+                    gap = min(gap, self.max_gap)
+                schedule += gap
+            previous = timestamp
+
+            if self.speed:
+                lag = time.perf_counter() - started - schedule / self.speed
+                if lag < 0:
+                    time.sleep(-lag)
+                else:
+                    max_lag = max(max_lag, lag)
+
+            if req_id is not None and req_id in self.req_ids:
+                args = (self.req_ids[req_id],) + args[1:]
+            try:
+                getattr(target, name)(*args)
+            except Exception as e:
+                self.logger.error(f"Replaying {name} failed: {str(e)}")
+            delivered += 1
+
+        elapsed = time.perf_counter() - started
+        return {
+            'callbacks': delivered,
+            'elapsed': elapsed,
+            'recorded_duration': schedule,
+            'callbacks_per_second': delivered / elapsed if elapsed else 0.0,
+            'max_lag': max_lag,
+        }
+
+    async def run(self, target):
+        """replay() on a worker thread, as the reader thread would deliver them."""
+        try:
+            return await asyncio.to_thread(self.replay, target)
+        finally:
+            self.stop()
@@ -0,0 +1,92 @@
+import pytest
+from ibapi.client import EClient
+from ibapi.message import OUT
+from ibapi.wrapper import EWrapper
+from connection.rate_limiter import TokenBucket, ThrottledClient, PRIORITY_NAMES
+
+
+def message(*fields):
+    return "".join(f"{field}\0" for field in fields)
+
+
+def sent_ids(sent):
+    return [tuple(msg.split('\0')[:3:2]) for msg in sent]
+
+
+class InlineSender:
+    """Stands in for the sender thread: join() runs the send loop on the caller's thread."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def join(self, timeout=None):
+        self.client._send_loop()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    sent = []
+    monkeypatch.setattr(EClient, 'sendMsg', lambda self, msg: sent.append(msg))
+    monkeypatch.setattr(EClient, 'disconnect', lambda self: None)
+    client = ThrottledClient(EWrapper(), rate=1000, burst=1000)
+    # Queue without sending; drain() sends the lot in priority order
+    monkeypatch.setattr(client, '_ensure_sender', lambda: None)
+    client.sent = sent
+    return client
+
+
+def drain(client):
+    client._queue.put((len(PRIORITY_NAMES), next(client._sequence), 0.0, None))
+    client._send_loop()
+    return sent_ids(client.sent)
+
+
+def test_token_bucket_allows_burst_then_refills():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.wait_time() == 0.0
+    bucket.take()
+    bucket.take()
+    assert 0.0 < bucket.wait_time() <= 0.1
+
+    bucket.updated -= 1.0
+    assert bucket.wait_time() == 0.0
+    assert bucket.tokens == 2
+
+
+def test_messages_go_out_by_priority_then_fifo(client):
+    client.sendMsg(message(OUT.REQ_MKT_DATA, 11, 1))
+    client.sendMsg(message(OUT.REQ_ACCOUNT_SUMMARY, 1, 2))
+    client.sendMsg(message(OUT.REQ_MKT_DATA, 11, 3))
+    client.sendMsg(message(OUT.CANCEL_REAL_TIME_BARS, 1, 4))
+    client.sendMsg(message(OUT.PLACE_ORDER, 45, 5))
+
+    assert drain(client) == [(str(OUT.PLACE_ORDER), '5'), (str(OUT.CANCEL_REAL_TIME_BARS), '4'),
+                             (str(OUT.REQ_ACCOUNT_SUMMARY), '2'), (str(OUT.REQ_MKT_DATA), '1'),
+                             (str(OUT.REQ_MKT_DATA), '3')]
+    assert client.stats()['data']['sent'] == 2
+
+
+def test_cancel_waits_for_its_own_request(client):
+    client.sendMsg(message(OUT.REQ_MKT_DATA, 11, 7))
+    client.sendMsg(message(OUT.CANCEL_MKT_DATA, 2, 7))
+    client.sendMsg(message(OUT.CANCEL_MKT_DATA, 2, 8))
+
+    # The cancel for 8 has no queued request and jumps ahead; the one for 7 follows its request
+    assert drain(client) == [(str(OUT.CANCEL_MKT_DATA), '8'), (str(OUT.REQ_MKT_DATA), '7'),
+                             (str(OUT.CANCEL_MKT_DATA), '7')]
+    assert not client._held and not client._unsent
+
+
+def test_disconnect_sends_orders_and_cancels_and_drops_data(client):
+    client.sendMsg(message(OUT.REQ_MKT_DATA, 11, 1))
+    client.sendMsg(message(OUT.CANCEL_MKT_DEPTH, 1, 2))
+    client.sendMsg(message(OUT.PLACE_ORDER, 45, 3))
+    client.sendMsg(message(OUT.REQ_MKT_DEPTH, 5, 4))
+    client.sendMsg(message(OUT.CANCEL_MKT_DEPTH, 1, 4))
+    client._sender = InlineSender(client)
+
+    client.disconnect()
+
+    assert sent_ids(client.sent) == [(str(OUT.PLACE_ORDER), '3'), (str(OUT.CANCEL_MKT_DEPTH), '2')]
+    assert client.queue_depth() == 0
+    assert not client._held
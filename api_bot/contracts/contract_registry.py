@@ -0,0 +1,255 @@
+import asyncio
+import collections
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from ibapi.contract import Contract, ContractDetails
+from connection.async_bridge import PendingRequests, IBRequestError
+
+
+# "No security definition has been found for the request"
+NO_SECURITY_DEFINITION = 200
+
+SPEC_FIELDS = ('symbol', 'secType', 'exchange', 'currency', 'lastTradeDateOrContractMonth',
+               'strike', 'right', 'multiplier', 'localSymbol', 'primaryExchange')
+
+
+def _fields_key(contract):
+    return "|".join(str(getattr(contract, field) or '') for field in SPEC_FIELDS)
+
+
+def spec_key(contract):
+    """Stable text key of the fields that identify a contract request."""
+    if contract.conId:
+        return f"conId:{contract.conId}"
+    return _fields_key(contract)
+
+
+def _plain_fields(obj):
+    # Lists of TagValue/ComboLeg etc. are dropped; nothing downstream reads them
+    return {name: value for name, value in vars(obj).items() if isinstance(value, (str, int, float, bool, type(None)))}
+
+
+def details_to_json(details):
+    fields = _plain_fields(details)
+    fields['contract'] = _plain_fields(details.contract)
+    return json.dumps(fields)
+
+
+def details_from_json(text):
+    fields = json.loads(text) if isinstance(text, str) else dict(text)
+    details = ContractDetails()
+    contract = Contract()
+    contract.__dict__.update(fields.pop('contract'))
+    details.__dict__.update(fields)
+    details.contract = contract
+    return details
+
+
+class ContractRegistry:
+    """Resolves contract specs to ContractDetails and lets the app address instruments by conId.
+
+    Lookups go memory (an LRU of `capacity` entries), then the contract_details
+    table (rows younger than `ttl`), then reqContractDetails. Misses of a batch
+    are requested concurrently (up to `concurrency` at once; the connection's
+    rate limiter paces the messages) and stored back in one upsert, so a
+    restart resolves a known universe with one query and no gateway traffic.
+    A spec can match several contracts; resolve() insists on exactly one.
+    A spec matching nothing (error 200) is remembered for `negative_ttl`
+    only, so a transient failure is retried after that."""
+
+    TABLE_NAME = 'contract_details'
+
+    def __init__(self, connection, storage_manager, capacity=5000, ttl=timedelta(days=7),
+                 negative_ttl=timedelta(minutes=15), concurrency=20, request_timeout=30):
+        self.logger = logging.getLogger(__name__)
+        self.connection = connection
+        self.storage_manager = storage_manager
+        self.capacity = capacity
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.concurrency = concurrency
+        self.request_timeout = request_timeout
+        self.pending = PendingRequests()
+        self._details = collections.OrderedDict()
+        self._specs = {}
+        # time.monotonic() at which each spec that matched nothing may be requested again
+        self._misses = {}
+        self._responses = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.requests = 0
+
+    # ------------------------------------------------------------------
+    # In-memory cache
+    # ------------------------------------------------------------------
+    def _remember(self, key, details_list):
+        with self._lock:
+            if not key.startswith("conId:"):
+                self._specs[key] = [details.contract.conId for details in details_list]
+                if details_list:
+                    self._misses.pop(key, None)
+                else:
+                    self._misses[key] = time.monotonic() + self.negative_ttl.total_seconds()
+            for details in details_list:
+                self._details[details.contract.conId] = details
+                self._details.move_to_end(details.contract.conId)
+            while len(self._details) > self.capacity:
+                self._details.popitem(last=False)
+
+    def _cached(self, key):
+        if key.startswith("conId:"):
+            details = self.get(int(key[len("conId:"):]))
+            return [details] if details is not None else None
+        with self._lock:
+            con_ids = self._specs.get(key)
+            if not con_ids and key in self._misses and time.monotonic() >= self._misses[key]:
+                del self._specs[key], self._misses[key]
+                return None
+            if con_ids is None or any(con_id not in self._details for con_id in con_ids):
+                return None
+            for con_id in con_ids:
+                self._details.move_to_end(con_id)
+            return [self._details[con_id] for con_id in con_ids]
+
+    def get(self, con_id):
+        """ContractDetails of a conId already resolved, or None."""
+        with self._lock:
+            details = self._details.get(con_id)
+            if details is not None:
+                self._details.move_to_end(con_id)
+            return details
+
+    def contract(self, con_id):
+        details = self.get(con_id)
+        return details.contract if details is not None else None
+
+    def __len__(self):
+        return len(self._details)
+
+    # ------------------------------------------------------------------
+    # Resolution
+    # ------------------------------------------------------------------
+    async def resolve(self, contract):
+        """The single ContractDetails matching a spec; raises LookupError otherwise."""
+        matches = (await self.resolve_many([contract]))[0]
+        if len(matches) != 1:
+            raise LookupError(f"{spec_key(contract)} matched {len(matches)} contracts")
+        return matches[0]
+
+    async def resolve_con_id(self, con_id):
+        contract = Contract()
+        contract.conId = con_id
+        return self.get(con_id) or await self.resolve(contract)
+
+    async def resolve_many(self, contracts):
+        """List of matching ContractDetails for each spec, in order."""
+        keys = [spec_key(contract) for contract in contracts]
+        results = {}
+        for key in set(keys):
+            cached = self._cached(key)
+            if cached is not None:
+                results[key] = cached
+        self.hits += len(results)
+
+        missing = [key for key in set(keys) if key not in results]
+        if missing:
+            stored = await self._load(missing)
+            self.db_hits += len(stored)
+            results.update(stored)
+
+        to_request = {key: contract for key, contract in zip(keys, contracts) if key not in results}
+        if to_request:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def request(contract):
+                async with semaphore:
+                    return await self._request(contract)
+
+            fetched = await asyncio.gather(*(request(contract) for contract in to_request.values()),
+                                           return_exceptions=True)
+            rows = {}
+            for key, details_list in zip(to_request, fetched):
+                if isinstance(details_list, Exception):
+                    self.logger.error(f"Could not resolve contract {key}: {str(details_list)}")
+                    details_list = []
+                else:
+                    self._remember(key, details_list)
+                    # Specs resolving to the same conId share one row; ON CONFLICT rejects duplicates
+                    rows.update((row['con_id'], row) for row in self._rows(key, details_list))
+                results[key] = details_list
+            if rows:
+                try:
+                    await self.storage_manager.upsert_data(self.TABLE_NAME, list(rows.values()),
+                                                           conflict_columns=['con_id'])
+                except Exception as e:
+                    # The details stay cached in memory; only the Postgres copy is missing
+                    self.logger.error(f"Could not store {len(rows)} contract details: {str(e)}")
+
+        return [results[key] for key in keys]
+
+    async def _load(self, keys):
+        table = await self.storage_manager.get_or_create_table(self.TABLE_NAME)
+        con_ids = [int(key[len("conId:"):]) for key in keys if key.startswith("conId:")]
+        records = await self.storage_manager.fetch(
+            f'SELECT con_id, spec_key, details FROM "{table.schema}"."{table.name}" '
+            'WHERE (spec_key = ANY($1::varchar[]) OR con_id = ANY($2::bigint[])) AND expires_at > now()',
+            keys, con_ids)
+        requested = set(keys)
+        found = collections.defaultdict(list)
+        for record in records:
+            details = details_from_json(record['details'])
+            for key in (record['spec_key'], f"conId:{record['con_id']}"):
+                if key in requested:
+                    found[key].append(details)
+        for key, details_list in found.items():
+            self._remember(key, details_list)
+        return dict(found)
+
+    def _rows(self, key, details_list):
+        now = datetime.now(timezone.utc)
+        return [{
+            'con_id': details.contract.conId,
+            # A conId lookup stores the spec of the contract it resolved to
+            'spec_key': _fields_key(details.contract) if key.startswith("conId:") else key,
+            'symbol': details.contract.symbol,
+            'sec_type': details.contract.secType,
+            'exchange': details.contract.exchange,
+            'currency': details.contract.currency,
+            'local_symbol': details.contract.localSymbol,
+            'details': details_to_json(details),
+            'fetched_at': now,
+            'expires_at': now + self.ttl,
+        } for details in details_list]
+
+    async def _request(self, contract):
+        req_id = self.connection.register_request(self)
+        self._responses[req_id] = []
+        completed = self.pending.create(req_id)
+        self.requests += 1
+        try:
+            self.connection.client.reqContractDetails(req_id, contract)
+            return await asyncio.wait_for(completed, timeout=self.request_timeout)
+        finally:
+            self.pending.discard(req_id)
+            self._responses.pop(req_id, None)
+            self.connection.unregister_request(req_id)
+
+
+
+    def contractDetails(self, reqId, contractDetails):
+        responses = self._responses.get(reqId)
+        if responses is not None:
+            responses.append(contractDetails)
+
+    def contractDetailsEnd(self, reqId):
+        self.pending.resolve(reqId, self._responses.get(reqId, []))
+
+    def error(self, reqId, errorCode, errorString):
+        if errorCode == NO_SECURITY_DEFINITION:
+            self.pending.resolve(reqId, [])
+        else:
+            self.pending.reject(reqId, IBRequestError(reqId, errorCode, errorString))
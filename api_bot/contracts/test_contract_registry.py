@@ -0,0 +1,98 @@
+import asyncio
+from datetime import timedelta
+from types import SimpleNamespace
+from ibapi.contract import Contract, ContractDetails
+from contracts.contract_registry import ContractRegistry, NO_SECURITY_DEFINITION
+
+
+class FakeClient:
+    """Answers reqContractDetails from a {symbol: conId} map, or with error 200."""
+
+    def __init__(self, registry, known):
+        self.registry = registry
+        self.known = known
+        self.requested = []
+
+    def reqContractDetails(self, req_id, contract):
+        self.requested.append(contract.symbol)
+        if contract.symbol in self.known:
+            details = ContractDetails()
+            details.contract.conId = self.known[contract.symbol]
+            details.contract.symbol = contract.symbol
+            self.registry.contractDetails(req_id, details)
+            self.registry.contractDetailsEnd(req_id)
+        else:
+            self.registry.error(req_id, NO_SECURITY_DEFINITION, "No security definition")
+
+
+class FakeConnection:
+    def __init__(self):
+        self.client = None
+        self.next_id = 0
+
+    def register_request(self, handler):
+        self.next_id += 1
+        return self.next_id
+
+    def unregister_request(self, req_id):
+        pass
+
+
+class EmptyStorage:
+    async def get_or_create_table(self, table_name):
+        return SimpleNamespace(schema='public', name=table_name)
+
+    async def fetch(self, query, *args):
+        return []
+
+    async def upsert_data(self, table_name, rows, conflict_columns=None):
+        pass
+
+
+def stock(symbol):
+    contract = Contract()
+    contract.symbol, contract.secType, contract.exchange, contract.currency = symbol, 'STK', 'SMART', 'USD'
+    return contract
+
+
+def make_registry(known, **kwargs):
+    connection = FakeConnection()
+    registry = ContractRegistry(connection, EmptyStorage(), **kwargs)
+    connection.client = FakeClient(registry, known)
+    return registry, connection.client
+
+
+def test_resolved_specs_are_served_from_memory():
+    registry, client = make_registry({'AAPL': 265598})
+
+    async def scenario():
+        first = await registry.resolve(stock('AAPL'))
+        second = await registry.resolve(stock('AAPL'))
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.contract.conId == second.contract.conId == 265598
+    assert client.requested == ['AAPL']
+    assert registry.contract(265598).symbol == 'AAPL'
+
+
+def test_miss_is_cached_until_negative_ttl():
+    registry, client = make_registry({}, negative_ttl=timedelta(hours=1))
+
+    async def scenario():
+        return [await registry.resolve_many([stock('NOPE')]) for _ in range(2)]
+
+    assert asyncio.run(scenario()) == [[[]], [[]]]
+    assert client.requested == ['NOPE']
+
+
+def test_expired_miss_is_requested_again():
+    registry, client = make_registry({}, negative_ttl=timedelta(0))
+
+    async def scenario():
+        await registry.resolve_many([stock('NOPE')])
+        client.known['NOPE'] = 1234
+        return await registry.resolve(stock('NOPE'))
+
+    assert asyncio.run(scenario()).contract.conId == 1234
+    assert client.requested == ['NOPE', 'NOPE']
@@ -0,0 +1,383 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
+import asyncpg
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+from datetime import datetime, timezone
+from data_storage.schemas import get_schema, is_partitioned, get_partition_statements
+from data_storage.postgresql_client import Singleton, SharedPool, COPY_THRESHOLD, PARTITION_LOOKBEHIND, PARTITION_LOOKAHEAD
+from data_storage.utils import scalar_default, has_unique_key, schema_upgrade_statements, check_upgradable
+from utilsL.instrumentation import metrics, timed
+
+
+class AsyncPostgresqlClient(SharedPool, metaclass=Singleton):
+    """asyncio storage backend on an asyncpg connection pool.
+
+    Mirrors the table API of PostgresqlClient (get_or_create_table,
+    insert_data, stream_data, copy_data) but never blocks the event loop.
+    The pool settings follow PostgresqlClient's as far as asyncpg allows:
+    pool_recycle closes connections idle that long, and pool_pre_ping runs
+    a SELECT 1 on checkout, replacing a connection that fails it. Pool
+    metrics are reported under METRICS_PREFIX."""
+
+    METRICS_PREFIX = "db.pool.async"
+
+    def __init__(self, db_name, db_user, db_password, is_test_mode=False, host="localhost", port=5432,
+                 min_pool_size=2, max_pool_size=10, copy_threshold=COPY_THRESHOLD, pool_timeout=30,
+                 pool_recycle=1800, pool_pre_ping=True, statement_timeout=None):
+        self.logger = logging.getLogger(__name__)
+
+        self.db_name = db_name
+        self.db_user = db_user
+        self.db_password = db_password
+        self.is_test_mode = is_test_mode
+        self.db_schema = "test" if is_test_mode else "dev"
+        self.host = host
+        self.port = port
+        self.min_pool_size = min_pool_size
+        self.max_pool_size = max_pool_size
+        self.pool_timeout = pool_timeout
+        self.pool_recycle = pool_recycle
+        self.pool_pre_ping = pool_pre_ping
+        self.statement_timeout = statement_timeout
+        self.copy_threshold = copy_threshold
+        self.dialect = postgresql.dialect()
+        self.pool = None
+        self.tables = {}
+        self._statements = {}
+        self._table_lock = asyncio.Lock()
+        self._init_shared_pool()
+        metrics.gauge(f"{self.METRICS_PREFIX}.in_use", self._in_use)
+        metrics.gauge(f"{self.METRICS_PREFIX}.utilization",
+                      lambda: None if self.pool is None else self._in_use() / self.max_pool_size)
+
+    def _in_use(self):
+        if self.pool is None:
+            return None
+        return self.pool.get_size() - self.pool.get_idle_size()
+
+    async def connect(self):
+        if self.pool is not None:
+            return self.pool
+        try:
+            self.pool = await asyncpg.create_pool(
+                host=self.host,
+                port=self.port,
+                user=self.db_user,
+                password=self.db_password,
+                database=self.db_name,
+                min_size=self.min_pool_size,
+                max_size=self.max_pool_size,
+                max_inactive_connection_lifetime=self.pool_recycle or 0,
+                server_settings={'statement_timeout': str(int(self.statement_timeout * 1000))}
+                if self.statement_timeout else None,
+            )
+            self.logger.info(f"Connected asyncpg pool to {self.host}:{self.port}/{self.db_name}, schema: {self.db_schema}")
+            return self.pool
+        except Exception as e:
+            self.logger.error(f"Failed to connect to PostgreSQL: {str(e)}")
+            raise
+
+    async def _open_pool(self):
+        return await self.connect()
+
+    async def _close_pool(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            self.logger.info("Database connection pool closed")
+
+    async def close(self):
+        """Close the pool now, whoever still holds it. Components use release()."""
+        if self.holders:
+            self.logger.warning(f"Closing connection pool still held by {self.holders} owner(s)")
+        self._holders.clear()
+        await self._close_pool()
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """pool.acquire() with the wait for a free connection measured."""
+        if not self.pool.get_idle_size():
+            metrics.count(f"{self.METRICS_PREFIX}.checkouts_without_idle")
+        start_time = time.perf_counter()
+        conn = None
+        try:
+            try:
+                conn = await self.pool.acquire(timeout=self.pool_timeout)
+                if self.pool_pre_ping and not await self._ping(conn):
+                    dead, conn = conn, None
+                    await self.pool.release(dead)
+                    conn = await self.pool.acquire(timeout=self.pool_timeout)
+            except asyncio.TimeoutError:
+                metrics.count(f"{self.METRICS_PREFIX}.checkout_timeouts")
+                raise
+            metrics.histogram(f"{self.METRICS_PREFIX}.checkout_wait").record(time.perf_counter() - start_time)
+            yield conn
+        finally:
+            # Also reached when the ping is cancelled or fails unexpectedly
+            if conn is not None:
+                await self.pool.release(conn)
+
+    async def _ping(self, conn):
+        """False (with the connection terminated) if it no longer answers."""
+        try:
+            await conn.fetchval("SELECT 1")
+            return True
+        except (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, OSError) as e:
+            self.logger.warning(f"Replacing dead pooled connection: {str(e)}")
+            conn.terminate()
+            return False
+
+
+
+
+    async def create_schema_if_not_exists(self):
+        await self.connect()
+        async with self.connection() as conn:
+            await conn.execute(f"CREATE SCHEMA IF NOT EXISTS {self._quote(self.db_schema)}")
+        self.logger.info(f"Schema '{self.db_schema}' created or already exists.")
+
+    async def get_or_create_table(self, table_name):
+        if table_name in self.tables:
+            return self.tables[table_name]
+
+        async with self._table_lock:
+            if table_name not in self.tables:
+                table = get_schema(table_name=table_name)
+                if table is None:
+                    raise ValueError(f"No schema defined for table '{table_name}'")
+                table.schema = self.db_schema
+
+                await self.create_schema_if_not_exists()
+                async with self.connection() as conn:
+                    existing = {record['column_name'] for record in await conn.fetch(
+                        "SELECT column_name FROM information_schema.columns WHERE table_schema = $1 AND table_name = $2",
+                        self.db_schema, table_name)}
+                check_upgradable(table, existing)
+                ddl = [str(CreateTable(table, if_not_exists=True).compile(dialect=self.dialect))]
+                ddl += schema_upgrade_statements(table, self.dialect)
+                try:
+                    async with self.connection() as conn:
+                        async with conn.transaction():
+                            for statement in ddl:
+                                await conn.execute(statement)
+                    self.logger.info(f"Table '{table_name}' ready in schema '{self.db_schema}'")
+                except asyncpg.PostgresError as e:
+                    self.logger.error(f"Error creating table '{table_name}': {e}")
+                    raise
+                if is_partitioned(table):
+                    now = datetime.now(timezone.utc)
+                    await self._create_partitions(table, now - PARTITION_LOOKBEHIND, now + PARTITION_LOOKAHEAD)
+                self.tables[table_name] = table
+
+        return self.tables[table_name]
+
+
+
+
+    async def ensure_partitions(self, table_name, start, end):
+        """Create the monthly partitions of a partitioned table covering [start, end)."""
+        table = await self.get_or_create_table(table_name)
+        await self._create_partitions(table, start, end)
+
+    async def maintain_partitions(self, interval=86400):
+        """Extend open tables' monthly partitions daily, as PostgresqlClient.maintain_partitions does."""
+        while True:
+            await asyncio.sleep(interval)
+            now = datetime.now(timezone.utc)
+            for table in list(self.tables.values()):
+                if is_partitioned(table):
+                    await self._create_partitions(table, now, now + PARTITION_LOOKAHEAD)
+
+    async def _create_partitions(self, table, start, end):
+        # One statement at a time: a month whose rows already sit in the default
+        # partition cannot be attached, which must not block the other months.
+        for statement in get_partition_statements(table, start, end):
+            try:
+                async with self.connection() as conn:
+                    await conn.execute(statement)
+            except asyncpg.PostgresError as e:
+                self.logger.warning(f"Could not create partition of '{table.name}': {e}")
+
+
+
+
+    @timed("db.insert_data")
+    async def insert_data(self, table_name, data_list, chunk_size=1000):
+        total_length = len(data_list)
+        if self.copy_threshold and total_length >= self.copy_threshold:
+            return await self.copy_data(table_name, data_list)
+
+        table = await self.get_or_create_table(table_name)
+        statement = self._insert_statement(table, "ON CONFLICT DO NOTHING")
+        inserted_count = 0
+
+        async with self.connection() as conn:
+            try:
+                async with conn.transaction():
+                    for i in range(0, total_length, chunk_size):
+                        chunk = data_list[i:i + chunk_size]
+                        status = await conn.execute(statement, *self._columnar(table, chunk))
+                        inserted_count += self._status_count(status)
+
+                self.logger.info("Total inserted into '%s': %d rows", table_name, inserted_count)
+                return inserted_count
+            except asyncpg.PostgresError as e:
+                self.logger.error(f"Error inserting data into '{table_name}': {e}")
+                raise
+
+    @timed("db.upsert_data")
+    async def upsert_data(self, table_name, data_list, conflict_columns, update_columns=None, chunk_size=1000):
+        table = await self.get_or_create_table(table_name)
+        if update_columns is None:
+            update_columns = [c.name for c in table.columns if c.name not in conflict_columns]
+        conflict = ", ".join(self._quote(name) for name in conflict_columns)
+        if update_columns:
+            assignments = ", ".join(f"{self._quote(name)} = EXCLUDED.{self._quote(name)}" for name in update_columns)
+            clause = f"ON CONFLICT ({conflict}) DO UPDATE SET {assignments}"
+        else:
+            clause = f"ON CONFLICT ({conflict}) DO NOTHING"
+        statement = self._insert_statement(table, clause)
+        upserted_count = 0
+
+        async with self.connection() as conn:
+            try:
+                async with conn.transaction():
+                    for i in range(0, len(data_list), chunk_size):
+                        status = await conn.execute(statement, *self._columnar(table, data_list[i:i + chunk_size]))
+                        upserted_count += self._status_count(status)
+
+                self.logger.info("Total upserted into '%s': %d rows", table_name, upserted_count)
+                return upserted_count
+            except asyncpg.PostgresError as e:
+                self.logger.error(f"Error upserting data into '{table_name}': {e}")
+                raise
+
+    async def stream_data(self, table_name, data_generator, chunk_size=1000):
+        # Accepts both plain and async iterables of row dicts
+        if hasattr(data_generator, "__aiter__"):
+            data_generator = [item async for item in data_generator]
+        data_generator = iter(data_generator)
+
+        if self.copy_threshold:
+            head = list(itertools.islice(data_generator, self.copy_threshold))
+            if len(head) >= self.copy_threshold:
+                return await self.copy_data(table_name, itertools.chain(head, data_generator))
+            return await self.insert_data(table_name, head, chunk_size)
+
+        inserted_count = 0
+        while True:
+            chunk = list(itertools.islice(data_generator, chunk_size))
+            if not chunk:
+                break
+            inserted_count += await self.insert_data(table_name, chunk, chunk_size)
+        self.logger.info("Total streamed and inserted: %d rows", inserted_count)
+        return inserted_count
+
+    @timed("db.copy_data")
+    async def copy_data(self, table_name, rows, ignore_conflicts=True):
+        """Bulk load rows with the binary COPY protocol.
+
+        Like PostgresqlClient.copy_data, tables with a unique key go through a
+        temporary staging table merged with ON CONFLICT DO NOTHING."""
+        table = await self.get_or_create_table(table_name)
+        columns = [(column.name, scalar_default(column)) for column in table.columns]
+        names = [name for name, _ in columns]
+        records = (tuple(row.get(name, default) for name, default in columns) for row in rows)
+
+        async with self.connection() as conn:
+            try:
+                async with conn.transaction():
+                    if ignore_conflicts and has_unique_key(table):
+                        staging = f"{table.name}_staging"
+                        await conn.execute(
+                            f"CREATE TEMP TABLE {self._quote(staging)} "
+                            f"(LIKE {self._table_name(table)} INCLUDING DEFAULTS) ON COMMIT DROP"
+                        )
+                        await conn.copy_records_to_table(staging, records=records, columns=names)
+                        column_list = ", ".join(self._quote(name) for name in names)
+                        status = await conn.execute(
+                            f"INSERT INTO {self._table_name(table)} ({column_list}) "
+                            f"SELECT {column_list} FROM {self._quote(staging)} ON CONFLICT DO NOTHING"
+                        )
+                    else:
+                        status = await conn.copy_records_to_table(
+                            table.name, records=records, columns=names, schema_name=self.db_schema
+                        )
+                inserted_count = self._status_count(status)
+                self.logger.info("Copied into '%s': %d rows", table_name, inserted_count)
+                return inserted_count
+            except asyncpg.PostgresError as e:
+                self.logger.error(f"Error copying data into '{table_name}': {e}")
+                raise
+
+    async def fetch(self, query, *args):
+        await self.connect()
+        async with self.connection() as conn:
+            return await conn.fetch(query, *args)
+
+    async def read_at_time(self, table_name, at, key_columns, where=None):
+        """Reconstruct a delta-persisted snapshot table (see ChangeTracker) as of `at`.
+
+        Starts from the latest keyframe at or before `at` and takes the newest
+        row per key since then. `at` is an ISO timestamp like updated_at and
+        `where` an optional dict of column equality filters."""
+        table = await self.get_or_create_table(table_name)
+        target = self._table_name(table)
+        keys = ", ".join(self._quote(name) for name in key_columns)
+        args = [at]
+        filters = ""
+        for name, value in (where or {}).items():
+            args.append(value)
+            filters += f" AND {self._quote(name)} = ${len(args)}"
+
+        query = (
+            f"SELECT DISTINCT ON ({keys}) * FROM {target} "
+            f"WHERE updated_at <= $1{filters} AND updated_at >= COALESCE("
+            f"(SELECT max(updated_at) FROM {target} WHERE is_keyframe AND updated_at <= $1{filters}), '') "
+            f"ORDER BY {keys}, updated_at DESC"
+        )
+        async with self.connection() as conn:
+            return [dict(record) for record in await conn.fetch(query, *args)]
+
+
+
+
+    def _insert_statement(self, table, conflict_clause):
+        # INSERT ... SELECT FROM unnest() sends a whole chunk as one array per
+        # column, so a chunk is a single round trip with a cached statement.
+        key = (table.name, conflict_clause)
+        if key not in self._statements:
+            columns = ", ".join(self._quote(column.name) for column in table.columns)
+            arrays = ", ".join(
+                f"${i}::{column.type.compile(dialect=self.dialect)}[]"
+                for i, column in enumerate(table.columns, start=1)
+            )
+            self._statements[key] = (
+                f"INSERT INTO {self._table_name(table)} ({columns}) "
+                f"SELECT * FROM unnest({arrays}) {conflict_clause}"
+            )
+        return self._statements[key]
+
+    def _columnar(self, table, rows):
+        return [
+            [row.get(column.name, default) for row in rows]
+            for column, default in ((column, scalar_default(column)) for column in table.columns)
+        ]
+
+    def _table_name(self, table):
+        return f"{self._quote(self.db_schema)}.{self._quote(table.name)}"
+
+    def _quote(self, name):
+        return self.dialect.identifier_preparer.quote(name)
+
+    @staticmethod
+    def _status_count(status):
+        # asyncpg returns the command tag, e.g. "INSERT 0 42" or "COPY 42"
+        try:
+            return int(status.split()[-1])
+        except (AttributeError, ValueError, IndexError):
+            return 0
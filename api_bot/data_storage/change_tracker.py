@@ -0,0 +1,61 @@
+import threading
+import time
+
+
+_MISSING = object()
+
+
+class ChangeTracker:
+    """Lets through only the snapshot rows whose value changed since the last write.
+
+    The last value written per key (the key_fields of the row) is kept in
+    memory. Every keyframe_interval seconds a full snapshot is written with
+    is_keyframe=True, so a point-in-time view never has to look further back
+    than the previous keyframe (see AsyncPostgresqlClient.read_at_time).
+    Values count as written once they are handed to the write buffer; rows
+    lost after that are repaired by the next keyframe."""
+
+    def __init__(self, key_fields, value_field='value', keyframe_interval=3600):
+        self.key_fields = tuple(key_fields)
+        self.value_field = value_field
+        self.keyframe_interval = keyframe_interval
+        self._lock = threading.Lock()
+        self._last_values = {}
+        self._last_keyframe = None
+        self.rows_seen = 0
+        self.rows_written = 0
+
+    def filter(self, rows):
+        return self.filter_changes(rows)[0]
+
+    def filter_changes(self, rows):
+        """(rows to write, changed): changed[i] is False for a row written
+        only because this is a keyframe, its value being the one last written."""
+        now = time.monotonic()
+        written = []
+        changed = []
+        with self._lock:
+            is_keyframe = self._last_keyframe is None or now - self._last_keyframe >= self.keyframe_interval
+            last_values = self._last_values
+            if is_keyframe:
+                self._last_keyframe = now
+                # Keys missing from this snapshot are forgotten
+                self._last_values = {}
+
+            for row in rows:
+                key = tuple(row[field] for field in self.key_fields)
+                value = row[self.value_field]
+                is_changed = last_values.get(key, _MISSING) != value
+                if is_keyframe or is_changed:
+                    self._last_values[key] = value
+                    row['is_keyframe'] = is_keyframe
+                    written.append(row)
+                    changed.append(is_changed)
+
+            self.rows_seen += len(rows)
+            self.rows_written += len(written)
+        return written, changed
+
+    def force_keyframe(self):
+        with self._lock:
+            self._last_keyframe = None
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from data_streaming.ring_buffer import BAR_DTYPE
+from utilsL.instrumentation import timed
+
+
+SECONDS_PER_DAY = 86400
+
+
+def _slug(value):
+    return str(value).replace(' ', '_').replace('/', '-')
+
+
+def _to_epoch(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    return int(value)
+
+
+class ColumnarArchive:
+    """On-disk columnar store for bars (or any fixed NumPy record layout).
+
+    Files are Arrow IPC, uncompressed, laid out hive-style as
+    root/series=<bar size>/symbol=<symbol>/date=<YYYY-MM-DD>/part-NNNNN.arrow.
+    append() only queues a record in memory, so it is cheap enough for the
+    IB reader thread; flush() sorts each day's records by time and writes them
+    as a new part file (temp file + rename, so readers never see half a file).
+
+    Readers memory-map the part files, so columns come back as views on the
+    page cache with no parsing or per-row objects. `time` is epoch seconds,
+    the same as BarRingBuffer. Records that are still queued are not visible
+    to readers until the next flush."""
+
+    def __init__(self, root, dtype=BAR_DTYPE, time_field='time', flush_rows=50000):
+        self.logger = logging.getLogger(__name__)
+        self.root = Path(root)
+        self.dtype = np.dtype(dtype)
+        self.time_field = time_field
+        self.flush_rows = flush_rows
+        self.schema = pa.schema([(name, pa.from_numpy_dtype(self.dtype[name])) for name in self.dtype.names])
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_rows = 0
+        self._flush_lock = threading.Lock()
+        self._wakeup = None
+        self._loop = None
+
+    def append(self, series, symbol, *record):
+        """Queue one record, fields in dtype order (time first for bars)."""
+        day = int(record[0]) // SECONDS_PER_DAY
+        with self._lock:
+            self._pending.setdefault((series, symbol, day), []).append(record)
+            self._pending_rows += 1
+            full = self._pending_rows >= self.flush_rows
+        if full and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def append_array(self, series, symbol, records):
+        """Queue a structured array of records (e.g. from BarRingBuffer)."""
+        for record in np.asarray(records, dtype=self.dtype).tolist():
+            self.append(series, symbol, *record)
+
+    @timed("archive.flush")
+    def flush(self):
+        """Write everything queued so far; returns the number of records written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_rows = 0
+
+        written = 0
+        with self._flush_lock:
+            for (series, symbol, day), records in pending.items():
+                try:
+                    self._write_part(series, symbol, day, records)
+                    written += len(records)
+                except Exception as e:
+                    self.logger.error(f"Failed to archive {len(records)} records for {symbol} {series}: {str(e)}")
+        return written
+
+    async def run(self, interval=60.0):
+        """Flush every `interval` seconds, or sooner once flush_rows are queued."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await asyncio.to_thread(self.flush)
+        finally:
+            self._wakeup = None
+            await asyncio.to_thread(self.flush)
+
+    def _partition(self, series, symbol, day):
+        date = datetime.fromtimestamp(day * SECONDS_PER_DAY, tz=timezone.utc).strftime('%Y-%m-%d')
+        return self.root / f"series={_slug(series)}" / f"symbol={_slug(symbol)}" / f"date={date}"
+
+    def _write_part(self, series, symbol, day, records):
+        array = np.array(records, dtype=self.dtype)
+        array = array[np.argsort(array[self.time_field], kind='stable')]
+        table = pa.Table.from_arrays([pa.array(array[name]) for name in self.dtype.names], schema=self.schema)
+
+        directory = self._partition(series, symbol, day)
+        directory.mkdir(parents=True, exist_ok=True)
+        parts = sorted(directory.glob('part-*.arrow'))
+        number = int(parts[-1].stem.split('-')[1]) + 1 if parts else 0
+        path = directory / f"part-{number:05d}.arrow"
+        temp = directory / f".{path.name}.tmp"
+        with pa.OSFile(str(temp), 'wb') as sink:
+            with pa.ipc.new_file(sink, self.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp, path)
+
+    def compact(self, series, symbol, start, end):
+        """Merge each day's part files into one, so reads open one file per day."""
+        with self._flush_lock:
+            for directory in self._days(series, symbol, _to_epoch(start), _to_epoch(end)):
+                parts = sorted(directory.glob('part-*.arrow'))
+                if len(parts) < 2:
+                    continue
+                table = pa.concat_tables([self._map(part) for part in parts])
+                table = table.take(pa.array(np.argsort(table[self.time_field].to_numpy(), kind='stable')))
+                temp = directory / ".compact.tmp"
+                with pa.OSFile(str(temp), 'wb') as sink:
+                    with pa.ipc.new_file(sink, self.schema) as writer:
+                        writer.write_table(table)
+                os.replace(temp, parts[0])
+                for part in parts[1:]:
+                    part.unlink()
+
+    def export_parquet(self, series, symbol, start, end, path):
+        """Write a symbol/time range as one Parquet file, for sharing or cold storage."""
+        pq.write_table(self.read(series, symbol, start, end), path)
+
+    def _days(self, series, symbol, start, end):
+        first, last = start // SECONDS_PER_DAY, (end - 1) // SECONDS_PER_DAY
+        for day in range(first, last + 1):
+            directory = self._partition(series, symbol, day)
+            if directory.is_dir():
+                yield directory
+
+    @staticmethod
+    def _map(path):
+        with pa.memory_map(str(path), 'r') as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def read(self, series, symbol, start, end, columns=None):
+        """Records with start <= time < end as an Arrow table backed by the mapped files."""
+        start, end = _to_epoch(start), _to_epoch(end)
+        tables = []
+        for directory in self._days(series, symbol, start, end):
+            for part in sorted(directory.glob('part-*.arrow')):
+                table = self._map(part)
+                times = table[self.time_field].to_numpy()
+                # Parts are sorted by time when written, so the range is one slice
+                low, high = np.searchsorted(times, [start, end])
+                if high > low:
+                    tables.append(table.slice(low, high - low))
+
+        table = pa.concat_tables(tables) if tables else self.schema.empty_table()
+        return table.select(columns) if columns else table
+
+    def read_arrays(self, series, symbol, start, end, columns=None):
+        """Dict of column name to NumPy array. Zero-copy when the range lies in one part file."""
+        table = self.read(series, symbol, start, end, columns)
+        return {name: table[name].to_numpy() for name in table.column_names}
+
+    def read_frame(self, series, symbol, start, end, columns=None):
+        """DataFrame indexed by UTC time."""
+        frame = self.read(series, symbol, start, end, columns).to_pandas()
+        if self.time_field in frame:
+            frame.index = pd.to_datetime(frame.pop(self.time_field), unit='s', utc=True)
+        return frame
+
+    def symbols(self, series):
+        directory = self.root / f"series={_slug(series)}"
+        if not directory.is_dir():
+            return []
+        return sorted(path.name.split('=', 1)[1] for path in directory.iterdir() if path.is_dir())
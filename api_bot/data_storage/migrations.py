@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import sys
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+
+# Legacy bar_data.time held str(bar.date): epoch seconds, "YYYYMMDD" for daily
+# bars or "YYYYMMDD  HH:MM:SS" for intraday bars (read as UTC).
+LEGACY_BAR_TIME = """CASE
+    WHEN "time" ~ '^[0-9]{8}$' THEN to_timestamp("time", 'YYYYMMDD')
+    WHEN "time" ~ '^[0-9]+$' THEN to_timestamp("time"::bigint)
+    ELSE to_timestamp(substring(regexp_replace("time", '\\s+', ' ', 'g') from '^[0-9]{8} [0-9:]{8}'), 'YYYYMMDD HH24:MI:SS')
+END"""
+
+
+async def migrate_bar_data(client, bar_size='1 hour', con_ids=None, drop_legacy=False):
+    """
+        Moves rows of the untyped bar_data table into the typed, partitioned one.
+
+        The old table is renamed to bar_data_legacy, the new table and the
+        monthly partitions spanning the legacy rows are created, then the rows
+        are cast and copied over. Legacy rows have no contract id: `con_ids`
+        maps symbol -> conId, unmapped symbols get a negative surrogate id
+        derived from the symbol so they stay distinct until re-keyed.
+
+        Returns the number of migrated rows."""
+    await client.connect()
+    schema = client.db_schema
+    columns = {record['column_name'] for record in await client.fetch(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = $1 AND table_name = 'bar_data'",
+        schema)}
+
+    if not columns or 'con_id' in columns:
+        await client.get_or_create_table('bar_data')
+        logger.info("bar_data already uses the typed schema, nothing to migrate")
+        return 0
+
+    legacy = f'"{schema}"."bar_data_legacy"'
+    await client.pool.execute(f'ALTER TABLE "{schema}"."bar_data" RENAME TO "bar_data_legacy"')
+    client.tables.pop('bar_data', None)
+    await client.get_or_create_table('bar_data')
+
+    bounds = await client.pool.fetchrow(f"SELECT min({LEGACY_BAR_TIME}) AS first, max({LEGACY_BAR_TIME}) AS last FROM {legacy}")
+    if bounds['first'] is not None:
+        await client.ensure_partitions('bar_data', bounds['first'], bounds['last'] + timedelta(days=1))
+
+    async with client.pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SET LOCAL timezone = 'UTC'")
+            await conn.execute("CREATE TEMP TABLE bar_con_ids (symbol varchar PRIMARY KEY, con_id bigint) ON COMMIT DROP")
+            if con_ids:
+                await conn.copy_records_to_table('bar_con_ids', records=list(con_ids.items()))
+            status = await conn.execute(f"""
+                INSERT INTO "{schema}"."bar_data" (con_id, bar_size, "time", symbol, open, high, low, close)
+                SELECT COALESCE(m.con_id, -abs(hashtext(l.name))::bigint), $1, {LEGACY_BAR_TIME.replace('"time"', 'l."time"')},
+                       l.name, l.open::float8, l.high::float8, l.low::float8, l.close::float8
+                FROM {legacy} l LEFT JOIN bar_con_ids m ON m.symbol = l.name
+                WHERE l."time" IS NOT NULL
+                ON CONFLICT DO NOTHING""", bar_size)
+            if drop_legacy:
+                await conn.execute(f"DROP TABLE {legacy}")
+
+    migrated = int(status.split()[-1])
+    logger.info(f"Migrated {migrated} rows into typed bar_data")
+    return migrated
+
+
+async def dedupe_account_trades(client):
+    """
+        Removes repeated ExecIds from account_trades so the unique ExecId index
+        can be built on a table that was filled by CSV imports. The first row
+        stored for an ExecId is kept. Returns the number of deleted rows."""
+    await client.connect()
+    schema = client.db_schema
+    exists = await client.fetch(
+        "SELECT 1 FROM information_schema.tables WHERE table_schema = $1 AND table_name = 'account_trades'", schema)
+    if not exists:
+        return 0
+
+    status = await client.pool.execute(f"""
+        DELETE FROM "{schema}"."account_trades" t
+        USING "{schema}"."account_trades" d
+        WHERE t."ExecId" = d."ExecId" AND t.ctid > d.ctid""")
+    deleted = int(status.split()[-1])
+    logger.info(f"Removed {deleted} duplicate executions from account_trades")
+    return deleted
+
+
+if __name__ == "__main__":
+    sys.path.append('..')
+    from data_storage.async_postgresql_client import AsyncPostgresqlClient
+
+    async def main():
+        client = AsyncPostgresqlClient(db_name='test', db_user='myuser', db_password='kchau99', is_test_mode=False)
+        try:
+            await migrate_bar_data(client)
+            await dedupe_account_trades(client)
+        finally:
+            await client.close()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
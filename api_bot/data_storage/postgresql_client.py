@@ -1,15 +1,76 @@
 import os
+import asyncio
+import collections
+import csv
+import io
+import itertools
 import logging
-from sqlalchemy import create_engine, text, MetaData
-from sqlalchemy.exc import SQLAlchemyError
+import time
+from sqlalchemy import create_engine, event, text, MetaData
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 from sqlalchemy.engine.url import URL
 from google.cloud.sql.connector import Connector, IPTypes
 import pg8000
 from sqlalchemy.dialects.postgresql import insert
-from data_storage.schemas import get_schema
-from datetime import datetime
+from data_storage.schemas import get_schema, is_partitioned, get_partition_statements
+from data_storage.utils import scalar_default, has_unique_key, schema_upgrade_statements, check_upgradable
+from utilsL.instrumentation import metrics, timed
+from datetime import datetime, timedelta, timezone
 from sqlalchemy import inspect  
 
+
+# Row counts at or above which insert_data/stream_data switch to COPY FROM STDIN
+COPY_THRESHOLD = 5000
+COPY_NULL = "\\N"
+
+# Monthly partitions created up front for partitioned tables
+PARTITION_LOOKBEHIND = timedelta(days=31)
+PARTITION_LOOKAHEAD = timedelta(days=92)
+
+
+class CopyRowStream:
+    """Read-only file object rendering row dicts as CSV for COPY FROM STDIN.
+
+    Rows are pulled lazily from the iterable, so generators are streamed to
+    the server without being materialised. Missing keys fall back to the
+    column's scalar default, or NULL."""
+
+    def __init__(self, rows, columns, read_size=65536):
+        self._rows = iter(rows)
+        self._columns = columns
+        self._read_size = read_size
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._pending = ""
+        self.row_count = 0
+
+    def _render(self, row):
+        values = []
+        for name, default in self._columns:
+            value = row.get(name, default)
+            values.append(COPY_NULL if value is None else value)
+        self._writer.writerow(values)
+        self.row_count += 1
+
+    def read(self, size=-1):
+        target = self._read_size if size is None or size < 0 else size
+        while len(self._pending) < target:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._render(row)
+            if self._buffer.tell() >= target:
+                self._pending += self._buffer.getvalue()
+                self._buffer.seek(0)
+                self._buffer.truncate()
+        if self._buffer.tell():
+            self._pending += self._buffer.getvalue()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        chunk, self._pending = self._pending[:target], self._pending[target:]
+        return chunk
+
+
 class Singleton(type):
     _instances = {}
     def __call__(cls, *args, **kwargs):
@@ -17,9 +78,66 @@ class Singleton(type):
             cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
-class PostgresqlClient(metaclass=Singleton):
-    def __init__(self, db_name, db_user, db_password, is_test_mode=False, use_local=True):
+class SharedPool:
+    """Reference-counted lifecycle for a client's connection pool.
+
+    The clients are singletons shared by several components. Each one
+    acquire()s the pool under an owner (usually itself) and release()s it
+    when done; the pool is only closed once no owner holds it, and a
+    release by an owner that holds nothing is ignored. Subclasses provide
+    the _open_pool() and _close_pool() coroutines."""
+
+    def _init_shared_pool(self):
+        self._holders = collections.Counter()
+        self._holders_lock = asyncio.Lock()
+
+    @property
+    def holders(self):
+        return sum(self._holders.values())
+
+    async def acquire(self, owner=None):
+        async with self._holders_lock:
+            await self._open_pool()
+            self._holders[owner] += 1
+        return self
+
+    async def release(self, owner=None):
+        async with self._holders_lock:
+            if not self._holders[owner]:
+                del self._holders[owner]
+                self.logger.warning(f"{type(owner).__name__} released a connection pool it does not hold")
+                return
+            self._holders[owner] -= 1
+            if self.holders:
+                return
+            self._holders.clear()
+            await self._close_pool()
+
+
+class PostgresqlClient(SharedPool, metaclass=Singleton):
+    """Blocking storage backend on a SQLAlchemy engine.
+
+    The engine's QueuePool keeps pool_size connections plus up to
+    max_overflow more under load, waits up to pool_timeout seconds for a
+    free one, replaces connections older than pool_recycle seconds and, with
+    pool_pre_ping, tests each one on checkout. statement_timeout (seconds)
+    is set on every new connection. Pool metrics are reported under
+    METRICS_PREFIX."""
+
+    METRICS_PREFIX = "db.pool.sync"
+
+    def __init__(self, db_name, db_user, db_password, is_test_mode=False, use_local=True, copy_threshold=COPY_THRESHOLD,
+                 pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800, pool_pre_ping=True,
+                 statement_timeout=None):
         self.logger = logging.getLogger(__name__)
+        self.copy_threshold = copy_threshold
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_recycle = pool_recycle
+        self.pool_pre_ping = pool_pre_ping
+        self.statement_timeout = statement_timeout
+        self._init_shared_pool()
         
         self.db_name = db_name
         self.db_user = db_user
@@ -30,10 +148,55 @@ class PostgresqlClient(metaclass=Singleton):
         self.engine = self.connect_with_local() if use_local else self.connect_with_gcp_connector()
         self.metadata = MetaData(schema=self.db_schema)
         self.tables = {}
+        metrics.gauge(f"{self.METRICS_PREFIX}.in_use", lambda: self.engine.pool.checkedout())
+        metrics.gauge(f"{self.METRICS_PREFIX}.utilization",
+                      lambda: self.engine.pool.checkedout() / (self.pool_size + self.max_overflow))
 
+    def _create_engine(self, url, **kwargs):
+        engine = create_engine(
+            url,
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            pool_timeout=self.pool_timeout,
+            pool_recycle=self.pool_recycle,
+            pool_pre_ping=self.pool_pre_ping,
+            **kwargs
+        )
+        if self.statement_timeout:
+            event.listen(engine, "connect", self._set_statement_timeout)
+        return engine.execution_options(schema_translate_map={None: self.db_schema})
+
+    def _set_statement_timeout(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"SET statement_timeout = {int(self.statement_timeout * 1000)}")
+        cursor.close()
+        # Outside autocommit the SET would be rolled back with the first transaction
+        dbapi_connection.commit()
+
+    def _checkout(self, connect):
+        if not self.engine.pool.checkedin():
+            metrics.count(f"{self.METRICS_PREFIX}.checkouts_without_idle")
+        start_time = time.perf_counter()
+        try:
+            connection = connect()
+        except PoolTimeoutError:
+            metrics.count(f"{self.METRICS_PREFIX}.checkout_timeouts")
+            raise
+        metrics.histogram(f"{self.METRICS_PREFIX}.checkout_wait").record(time.perf_counter() - start_time)
+        return connection
 
+    def connection(self):
+        """engine.connect() with the wait for a pooled connection measured."""
+        return self._checkout(self.engine.connect)
 
+    async def _open_pool(self):
+        # The engine's pool opens connections on demand, also after dispose()
+        return self.engine
 
+    async def _close_pool(self):
+        # dispose() closes every pooled connection; keep the socket I/O off the event loop
+        await asyncio.to_thread(self.engine.dispose)
+        self.logger.info("Database connection closed")
 
     def connect_with_local(self):
         try:
@@ -46,8 +209,7 @@ class PostgresqlClient(metaclass=Singleton):
                 database=self.db_name
             )
             self.logger.info(f"Attempting to connect to: {db_url}")
-            engine = create_engine(db_url)
-            engine = engine.execution_options(schema_translate_map={None: self.db_schema})
+            engine = self._create_engine(db_url)
             
             # Test the connection
             with engine.connect() as conn:
@@ -78,11 +240,10 @@ class PostgresqlClient(metaclass=Singleton):
                 ip_type=ip_type,
             )
 
-        engine = create_engine(
+        engine = self._create_engine(
             "postgresql+pg8000://",
             creator=getconn,
         )
-        engine = engine.execution_options(schema_translate_map={None: self.db_schema})
         self.logger.info(f"Connected to db_schema: {self.db_schema}")
         return engine
 
@@ -95,7 +256,7 @@ class PostgresqlClient(metaclass=Singleton):
 
     def create_schema_if_not_exists(self):
         try:
-            with self.engine.connect() as conn:
+            with self.connection() as conn:
                 conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {self.db_schema}"))
                 self.logger.info(f"Schema '{self.db_schema}' created or already exists.")
                 
@@ -123,6 +284,14 @@ class PostgresqlClient(metaclass=Singleton):
                     raise  # Reraise the exception to handle it upstream
             else:
                 self.logger.info(f"Table '{table_name}' already exists in schema '{self.db_schema}'")
+                check_upgradable(table, {column['name'] for column in inspector.get_columns(table_name, schema=self.db_schema)})
+                with self.connection() as conn, conn.begin():
+                    for statement in schema_upgrade_statements(table, self.engine.dialect):
+                        conn.execute(text(statement))
+
+            if is_partitioned(table):
+                now = datetime.now(timezone.utc)
+                self._create_partitions(table, now - PARTITION_LOOKBEHIND, now + PARTITION_LOOKAHEAD)
             
             self.tables[table_name] = table
         
@@ -134,12 +303,49 @@ class PostgresqlClient(metaclass=Singleton):
 
 
 
-    def insert_data(self, table_name, data_list, chunk_size=1000):
+    def ensure_partitions(self, table_name, start, end):
+        """Create the monthly partitions of a partitioned table covering [start, end)."""
         table = self.get_or_create_table(table_name)
+        self._create_partitions(table, start, end)
+
+    async def maintain_partitions(self, interval=86400):
+        """Every `interval` seconds, extend each open partitioned table's monthly
+        partitions to PARTITION_LOOKAHEAD ahead, so new rows never land in the
+        default partition (which would block creating their month later)."""
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self._extend_partitions)
+
+    def _extend_partitions(self):
+        now = datetime.now(timezone.utc)
+        for table in list(self.tables.values()):
+            if is_partitioned(table):
+                self._create_partitions(table, now, now + PARTITION_LOOKAHEAD)
+
+    def _create_partitions(self, table, start, end):
+        for statement in get_partition_statements(table, start, end):
+            try:
+                with self.connection() as conn, conn.begin():
+                    conn.execute(text(statement))
+            except SQLAlchemyError as e:
+                self.logger.warning(f"Could not create partition of '{table.name}': {e}")
+
+
+
+
+
+
+
+    @timed("db.insert_data")
+    def insert_data(self, table_name, data_list, chunk_size=1000):
         total_length = len(data_list)
+        if self.copy_threshold and total_length >= self.copy_threshold:
+            return self.copy_data(table_name, data_list)
+
+        table = self.get_or_create_table(table_name)
         inserted_count = 0
         
-        with self.engine.connect() as conn:
+        with self.connection() as conn:
             try:
                 for i in range(0, total_length, chunk_size):
                     chunk = data_list[i:i + chunk_size]
@@ -147,9 +353,10 @@ class PostgresqlClient(metaclass=Singleton):
                     result = conn.execute(stmt)
                     inserted_count += result.rowcount
                     conn.commit()
-                    self.logger.info(f"Inserted chunk {i // chunk_size + 1}/{(total_length - 1) // chunk_size + 1}: {result.rowcount} rows")
+                    self.logger.debug("Inserted chunk %d/%d: %d rows", i // chunk_size + 1, (total_length - 1) // chunk_size + 1,
+                                      result.rowcount)
                 
-                self.logger.info(f"Total inserted: {inserted_count} rows")
+                self.logger.info("Total inserted into '%s': %d rows", table_name, inserted_count)
                 return inserted_count
             
             
@@ -161,11 +368,19 @@ class PostgresqlClient(metaclass=Singleton):
 
 
     def stream_data(self, table_name, data_generator, chunk_size=1000):
+        # Peek far enough into the generator to know whether COPY pays off
+        data_generator = iter(data_generator)
+        if self.copy_threshold:
+            head = list(itertools.islice(data_generator, self.copy_threshold))
+            if len(head) >= self.copy_threshold:
+                return self.copy_data(table_name, itertools.chain(head, data_generator))
+            data_generator = iter(head)
+
         table = self.get_or_create_table(table_name)
         inserted_count = 0
         chunk = []
 
-        with self.engine.connect() as conn:
+        with self.connection() as conn:
             try:
                 for item in data_generator:
                     chunk.append(item)
@@ -174,7 +389,7 @@ class PostgresqlClient(metaclass=Singleton):
                         result = conn.execute(stmt)
                         inserted_count += result.rowcount
                         conn.commit()
-                        self.logger.info(f"Streamed and inserted {inserted_count} rows so far")
+                        self.logger.debug("Streamed and inserted %d rows so far", inserted_count)
                         chunk = []
 
                 # Insert any remaining data
@@ -184,7 +399,7 @@ class PostgresqlClient(metaclass=Singleton):
                     inserted_count += result.rowcount
                     conn.commit()
 
-                self.logger.info(f"Total streamed and inserted: {inserted_count} rows")
+                self.logger.info("Total streamed and inserted: %d rows", inserted_count)
                 return inserted_count
             except SQLAlchemyError as e:
                 conn.rollback()
@@ -193,12 +408,62 @@ class PostgresqlClient(metaclass=Singleton):
 
 
 
+    @timed("db.copy_data")
+    def copy_data(self, table_name, rows, ignore_conflicts=True):
+        """Bulk load rows (list or generator of dicts) with COPY FROM STDIN.
+
+        Tables with a primary key or unique constraint are loaded through a
+        temporary staging table and merged with ON CONFLICT DO NOTHING, the
+        same semantics as insert_data. Everything runs in one transaction."""
+        table = self.get_or_create_table(table_name)
+        preparer = self.engine.dialect.identifier_preparer
+        target = preparer.format_table(table)
+        columns = [(column.name, scalar_default(column)) for column in table.columns]
+        column_list = ", ".join(preparer.quote(name) for name, _ in columns)
+        stream = CopyRowStream(rows, columns)
+
+        raw_conn = self._checkout(self.engine.raw_connection)
+        try:
+            cursor = raw_conn.cursor()
+            if ignore_conflicts and has_unique_key(table):
+                staging = preparer.quote(f"{table.name}_staging")
+                cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP")
+                self._copy_from(cursor, staging, column_list, stream)
+                cursor.execute(
+                    f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING"
+                )
+                inserted_count = cursor.rowcount
+            else:
+                self._copy_from(cursor, target, column_list, stream)
+                inserted_count = stream.row_count
+            raw_conn.commit()
+            self.logger.info("Copied %d rows into '%s', inserted %d", stream.row_count, table_name, inserted_count)
+            return inserted_count
+        except Exception as e:
+            raw_conn.rollback()
+            self.logger.error(f"Error copying data into '{table_name}': {e}")
+            raise
+        finally:
+            raw_conn.close()
+
+    def _copy_from(self, cursor, target, column_list, stream):
+        sql = f"COPY {target} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+        if self.engine.dialect.driver == "pg8000":
+            cursor.execute(sql, stream=stream)
+        else:
+            cursor.copy_expert(sql, stream)
+
+
+
 
 
     async def close(self):
+        """Dispose of the pool now, whoever still holds it. Components use release()."""
+        if self.holders:
+            self.logger.warning(f"Closing connection pool still held by {self.holders} owner(s)")
+        self._holders.clear()
         if self.engine:
-            self.engine.dispose()
-            self.logger.info("Database connection closed")
+            await self._close_pool()
 
 
 
@@ -208,11 +473,14 @@ class PostgresqlClient(metaclass=Singleton):
 
 
     async def store_account_summary(self, storage_data):
+        await asyncio.to_thread(self._store_account_summary, storage_data)
+
+    def _store_account_summary(self, storage_data):
         self.logger.info(f"Storing batch of {len(storage_data)} records")
         table = self.get_or_create_table("account_summary")
         current_time = datetime.now().isoformat()
 
-        with self.engine.connect() as conn:
+        with self.connection() as conn:
             if storage_data[0][-1]:  # Check if is_new_day for the first record
                 # Log the values being used in the update statement
                 account, currency, metric = storage_data[0][0], storage_data[0][1], storage_data[0][2]
@@ -249,10 +517,13 @@ class PostgresqlClient(metaclass=Singleton):
             conn.commit()
 
     async def store_portfolio(self, account, contract, position_data, is_new_day):
+        await asyncio.to_thread(self._store_portfolio, account, contract, position_data, is_new_day)
+
+    def _store_portfolio(self, account, contract, position_data, is_new_day):
         table = self.get_or_create_table("account_portfolio")
         current_time = datetime.now().isoformat()
 
-        with self.engine.connect() as conn:
+        with self.connection() as conn:
             if is_new_day:
                 # Insert a new row
                 stmt = insert(table).values(
@@ -1,5 +1,5 @@
-from sqlalchemy import Index, Column, String, MetaData, Table, BigInteger, Integer, Boolean, Date, ARRAY, Float, UniqueConstraint, JSON
-from datetime import datetime
+from sqlalchemy import Index, Column, String, MetaData, Table, BigInteger, Integer, Boolean, Date, DateTime, ARRAY, Float, UniqueConstraint, PrimaryKeyConstraint, JSON
+from datetime import datetime, timezone
 from sqlalchemy import JSON
 
 
@@ -15,13 +15,21 @@ def get_schema(table_name):
     metadata = MetaData()
                                                                         
     if table_name == "bar_data":
+        # One row per contract, bar size and bar start; range partitioned by month on time
         table = Table(table_name, metadata,
-                      Column('name', String),
-                      Column('time', String),
-                      Column('open', String),
-                      Column('high', String),
-                      Column('low', String),
-                      Column('close', String)
+                      Column('con_id', BigInteger, nullable=False),
+                      Column('bar_size', String, nullable=False),
+                      Column('time', DateTime(timezone=True), nullable=False),
+                      Column('symbol', String),
+                      Column('open', Float),
+                      Column('high', Float),
+                      Column('low', Float),
+                      Column('close', Float),
+                      Column('volume', Float),
+                      Column('wap', Float),
+                      Column('bar_count', Integer),
+                      PrimaryKeyConstraint('con_id', 'bar_size', 'time'),
+                      postgresql_partition_by='RANGE (time)'
                       ,)
 
 
@@ -32,7 +40,9 @@ def get_schema(table_name):
                     Column("metric", String),
                     Column("value", Float),
                     Column("is_latest", Boolean, default=True),  
-                    Column('updated_at', String))
+                    Column('updated_at', String),
+                    Column('is_keyframe', Boolean, default=False),  # full snapshot, see ChangeTracker
+                    Index('ix_account_summary_key_time', 'account', 'currency', 'metric', 'updated_at'))
     
     elif table_name == "account_values":
         table = Table(table_name, metadata,
@@ -40,7 +50,9 @@ def get_schema(table_name):
                       Column('currency', String),
                       Column('key', String),
                       Column('value', String),
-                      Column('updated_at', String))  # Add any additional fields as necessary
+                      Column('updated_at', String),  # Add any additional fields as necessary
+                      Column('is_keyframe', Boolean, default=False),  # full snapshot, see ChangeTracker
+                      Index('ix_account_values_key_time', 'account', 'currency', 'key', 'updated_at'))
 
     elif table_name == "account_portfolio":
         table = Table(table_name, metadata,
@@ -103,12 +115,77 @@ def get_schema(table_name):
                 Column('LastLiquidity', Integer),
                 Column('RealizedPNL', Float),
                 Column('Yield', Float),
-                Column('YieldRedemptionDate', String)
+                Column('YieldRedemptionDate', String),
+                # One row per execution; live capture and reqExecutions backfill both rely on it
+                Index('ux_account_trades_exec_id', 'ExecId', unique=True)
                 ,)
 
+    elif table_name == "contract_details":
+        # Resolved ContractDetails per conId; `details` holds the full object for ContractRegistry
+        table = Table(table_name, metadata,
+                      Column('con_id', BigInteger, primary_key=True),
+                      Column('spec_key', String, nullable=False),
+                      Column('symbol', String),
+                      Column('sec_type', String),
+                      Column('exchange', String),
+                      Column('currency', String),
+                      Column('local_symbol', String),
+                      Column('details', JSON),
+                      Column('fetched_at', DateTime(timezone=True)),
+                      Column('expires_at', DateTime(timezone=True)),
+                      Index('ix_contract_details_spec_key', 'spec_key')
+                      ,)
+
+    elif table_name == "backfill_checkpoints":
+        # Progress of one historical backfill job, which walks back from range_end
+        table = Table(table_name, metadata,
+                      Column('con_id', BigInteger, nullable=False),
+                      Column('bar_size', String, nullable=False),
+                      Column('what_to_show', String, nullable=False),
+                      Column('range_start', DateTime(timezone=True), nullable=False),
+                      Column('range_end', DateTime(timezone=True), nullable=False),
+                      Column('covered_from', DateTime(timezone=True)),  # earliest time fetched so far
+                      Column('completed', Boolean, default=False),
+                      Column('bars_written', BigInteger, default=0),
+                      Column('updated_at', DateTime(timezone=True)),
+                      PrimaryKeyConstraint('con_id', 'bar_size', 'what_to_show', 'range_start', 'range_end')
+                      ,)
+
     return table
     
 
+def is_partitioned(table):
+    return bool(table.dialect_options['postgresql'].get('partition_by'))
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def next_month(moment):
+    return datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def get_partition_statements(table, start, end):
+    """
+        Returns idempotent DDL creating the monthly partitions of a time range
+        partitioned table that cover [start, end), plus its default partition
+        which catches rows outside every monthly partition."""
+    parent = f'"{table.schema}"."{table.name}"' if table.schema else f'"{table.name}"'
+    prefix = f'"{table.schema}".' if table.schema else ''
+    statements = [f'CREATE TABLE IF NOT EXISTS {prefix}"{table.name}_default" PARTITION OF {parent} DEFAULT']
+
+    current = month_start(start)
+    while current < end:
+        following = next_month(current)
+        statements.append(
+            f'CREATE TABLE IF NOT EXISTS {prefix}"{table.name}_{current:%Y_%m}" PARTITION OF {parent} '
+            f"FOR VALUES FROM ('{current.isoformat()}') TO ('{following.isoformat()}')"
+        )
+        current = following
+    return statements
+
+
 def get_json_to_sql_column_mapping(table_name):
                                                     
     if table_name == "leeway_exchanges":
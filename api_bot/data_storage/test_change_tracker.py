@@ -0,0 +1,55 @@
+from data_storage.change_tracker import ChangeTracker
+
+
+def snapshot(**values):
+    return [{'account': 'DU1', 'currency': 'USD', 'key': key, 'value': value} for key, value in values.items()]
+
+
+def keys(rows):
+    return [row['key'] for row in rows]
+
+
+def test_first_snapshot_is_a_keyframe():
+    tracker = ChangeTracker(('account', 'currency', 'key'))
+    rows = tracker.filter(snapshot(NetLiquidation='100', Cash='50'))
+    assert keys(rows) == ['NetLiquidation', 'Cash']
+    assert all(row['is_keyframe'] for row in rows)
+
+
+def test_only_changed_values_pass_between_keyframes():
+    tracker = ChangeTracker(('account', 'currency', 'key'))
+    tracker.filter(snapshot(NetLiquidation='100', Cash='50'))
+
+    rows = tracker.filter(snapshot(NetLiquidation='101', Cash='50', BuyingPower='200'))
+    assert keys(rows) == ['NetLiquidation', 'BuyingPower']
+    assert not any(row['is_keyframe'] for row in rows)
+    assert tracker.filter(snapshot(NetLiquidation='101', Cash='50', BuyingPower='200')) == []
+    assert (tracker.rows_seen, tracker.rows_written) == (8, 4)
+
+
+def test_keyframe_writes_everything_and_reports_what_changed():
+    tracker = ChangeTracker(('account', 'currency', 'key'), keyframe_interval=0)
+    tracker.filter(snapshot(NetLiquidation='100', Cash='50'))
+
+    rows, changed = tracker.filter_changes(snapshot(NetLiquidation='100', Cash='60'))
+    assert keys(rows) == ['NetLiquidation', 'Cash']
+    assert all(row['is_keyframe'] for row in rows)
+    assert changed == [False, True]
+
+
+def test_force_keyframe():
+    tracker = ChangeTracker(('account', 'currency', 'key'))
+    tracker.filter(snapshot(Cash='50'))
+    tracker.force_keyframe()
+    rows, changed = tracker.filter_changes(snapshot(Cash='50'))
+    assert keys(rows) == ['Cash'] and rows[0]['is_keyframe']
+    assert changed == [False]
+
+
+def test_keyframe_forgets_keys_no_longer_reported():
+    tracker = ChangeTracker(('account', 'currency', 'key'), keyframe_interval=0)
+    tracker.filter(snapshot(Cash='50', Margin='10'))
+    tracker.filter(snapshot(Cash='50'))
+    tracker.keyframe_interval = 3600
+    # Margin reappearing with its old value is a change again
+    assert keys(tracker.filter(snapshot(Cash='50', Margin='10'))) == ['Margin']
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from data_storage.postgresql_client import SharedPool
+
+
+class CountingPool(SharedPool):
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.opened = 0
+        self.closed = 0
+        self._init_shared_pool()
+
+    async def _open_pool(self):
+        self.opened += 1
+
+    async def _close_pool(self):
+        self.closed += 1
+
+
+def test_pool_closes_when_the_last_holder_releases():
+    async def main():
+        pool = CountingPool()
+        first, second = object(), object()
+        await pool.acquire(first)
+        await pool.acquire(second)
+        await pool.acquire(second)
+        assert pool.holders == 3
+
+        await pool.release(second)
+        await pool.release(first)
+        assert pool.closed == 0
+        await pool.release(second)
+        assert (pool.holders, pool.closed) == (0, 1)
+    asyncio.run(main())
+
+
+def test_release_without_acquire_is_ignored(caplog):
+    async def main():
+        pool = CountingPool()
+        owner = object()
+        await pool.acquire(owner)
+        with caplog.at_level(logging.WARNING):
+            await pool.release(object())
+        assert (pool.holders, pool.closed) == (1, 0)
+        assert "does not hold" in caplog.text
+        await pool.release(owner)
+        await pool.release(owner)
+        assert pool.closed == 1
+    asyncio.run(main())
+
+
+def test_pool_reopens_after_closing():
+    async def main():
+        pool = CountingPool()
+        await pool.acquire('stats')
+        await pool.release('stats')
+        await pool.acquire('portfolio')
+        assert (pool.opened, pool.closed, pool.holders) == (2, 1, 1)
+    asyncio.run(main())
@@ -0,0 +1,17 @@
+import pytest
+from data_storage.schemas import get_schema
+from data_storage.utils import check_upgradable
+
+
+def test_new_or_current_tables_pass():
+    table = get_schema('bar_data')
+    check_upgradable(table, set())
+    check_upgradable(table, {column.name for column in table.columns})
+    # Nullable columns are added in place
+    check_upgradable(table, {'con_id', 'bar_size', 'time', 'open', 'high', 'low', 'close'})
+
+
+def test_legacy_bar_data_asks_for_the_migration():
+    table = get_schema('bar_data')
+    with pytest.raises(RuntimeError, match="migrate_bar_data"):
+        check_upgradable(table, {'name', 'time', 'open', 'high', 'low', 'close'})
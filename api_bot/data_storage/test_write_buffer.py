@@ -0,0 +1,91 @@
+import asyncio
+from data_storage.write_buffer import WriteBehindBuffer
+from utilsL.tracing import SpanTracer
+
+
+class RecordingStorage:
+    """insert_data/upsert_data stand-in; the first `slow_calls` inserts take `delay` seconds."""
+
+    def __init__(self, delay=0.0, slow_calls=0, fail_calls=0):
+        self.delay = delay
+        self.slow_calls = slow_calls
+        self.fail_calls = fail_calls
+        self.inserted = []
+        self.batches = []
+        self.upserted = []
+
+    async def insert_data(self, table_name, rows):
+        if self.slow_calls:
+            self.slow_calls -= 1
+            await asyncio.sleep(self.delay)
+        if self.fail_calls:
+            self.fail_calls -= 1
+            raise RuntimeError("database down")
+        self.batches.append(len(rows))
+        self.inserted.extend(rows)
+
+    async def upsert_data(self, table_name, rows, conflict_columns):
+        self.upserted.append((rows, conflict_columns))
+
+
+def rows(start, count):
+    return [{'i': i} for i in range(start, start + count)]
+
+
+def test_batches_are_capped_at_flush_rows():
+    storage = RecordingStorage()
+    buffer = WriteBehindBuffer(storage, flush_rows=4, tracer=SpanTracer())
+    buffer.put('t', rows(0, 3))
+    buffer.put('t', rows(3, 7))
+    asyncio.run(buffer.flush(force=True))
+    assert storage.batches == [4, 4, 2]
+    assert storage.inserted == rows(0, 10)
+    assert buffer.stats()['t']['flush_count'] == 3
+
+
+def test_failed_flush_is_requeued_in_order():
+    storage = RecordingStorage(fail_calls=1)
+    buffer = WriteBehindBuffer(storage, flush_rows=4, tracer=None)
+    buffer.put('t', rows(0, 6))
+
+    async def main():
+        await buffer.flush(force=True)
+        assert buffer.stats()['t']['queue_depth'] == 6
+        await buffer.flush(force=True)
+    asyncio.run(main())
+    assert storage.inserted == rows(0, 6)
+    assert buffer.stats()['t']['failed_flushes'] == 1
+
+
+def test_full_table_drops_without_put_timeout():
+    buffer = WriteBehindBuffer(RecordingStorage(), max_rows=5, tracer=None)
+    assert buffer.put('t', rows(0, 3)) == 3
+    assert buffer.put('t', rows(3, 3)) == 2
+    assert buffer.stats()['t']['dropped_rows'] == 1
+
+
+def test_upserts_keep_the_last_row_per_key():
+    storage = RecordingStorage()
+    buffer = WriteBehindBuffer(storage, tracer=None)
+    buffer.put('t', [{'k': 1, 'v': 'a'}, {'k': 2, 'v': 'b'}, {'k': 1, 'v': 'c'}], upsert_on=('k',))
+    asyncio.run(buffer.flush(force=True))
+    assert storage.upserted == [([{'k': 1, 'v': 'c'}, {'k': 2, 'v': 'b'}], ['k'])]
+
+
+def test_cancel_during_slow_insert_loses_no_rows():
+    storage = RecordingStorage(delay=10, slow_calls=1)
+    buffer = WriteBehindBuffer(storage, flush_rows=5, tracer=SpanTracer())
+
+    async def main():
+        runner = asyncio.create_task(buffer.run())
+        await asyncio.sleep(0)
+        buffer.put('t', rows(0, 8))
+        while storage.slow_calls:
+            await asyncio.sleep(0.01)
+        # run() is now awaiting the first insert; shut it down as main.cleanup does
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+
+    asyncio.run(main())
+    assert storage.inserted == rows(0, 8)
+    assert buffer.stats()['t']['queue_depth'] == 0
@@ -1 +1,56 @@
+from sqlalchemy import UniqueConstraint
+from sqlalchemy.schema import CreateIndex
 
+
+def scalar_default(column):
+    """Client side default of a column, as bulk loaders bypass SQLAlchemy defaults."""
+    if column.default is not None and column.default.is_scalar:
+        return column.default.arg
+    return None
+
+
+def has_unique_key(table):
+    """True when ON CONFLICT DO NOTHING can actually reject rows for the table."""
+    if table.primary_key.columns:
+        return True
+    if any(isinstance(constraint, UniqueConstraint) for constraint in table.constraints):
+        return True
+    return any(index.unique for index in table.indexes)
+
+
+# Old table layouts that additive DDL can't bring up to date, and the migration converting each
+TABLE_MIGRATIONS = {
+    'bar_data': 'data_storage.migrations.migrate_bar_data',
+}
+
+
+def check_upgradable(table, existing_columns):
+    """Raise RuntimeError if an existing table lacks a required (NOT NULL or key) column.
+
+    schema_upgrade_statements only adds nullable columns, so such a table has
+    an older layout that must be migrated rather than altered in place."""
+    if not existing_columns:
+        return
+    missing = [column.name for column in table.columns
+               if (column.primary_key or not column.nullable) and column.name not in existing_columns]
+    if missing:
+        migration = TABLE_MIGRATIONS.get(table.name)
+        action = f"run {migration}() to convert it" if migration else "migrate it by hand"
+        raise RuntimeError(f"Table '{table.schema}.{table.name}' has an old layout (no {', '.join(missing)}); "
+                           f"{action} before starting the app")
+
+
+def schema_upgrade_statements(table, dialect):
+    """Additive DDL bringing an existing table up to its schema definition.
+
+    Adds nullable columns and indexes that were introduced after the table was
+    first created. Every statement is idempotent, so it can run on each start."""
+    preparer = dialect.identifier_preparer
+    target = preparer.format_table(table)
+    statements = [
+        f"ALTER TABLE {target} ADD COLUMN IF NOT EXISTS {preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+        for column in table.columns
+        if column.nullable and not column.primary_key
+    ]
+    statements += [str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect)) for index in table.indexes]
+    return statements
@@ -0,0 +1,265 @@
+import asyncio
+import collections
+import logging
+import threading
+import time
+from utilsL.instrumentation import metrics
+from utilsL.tracing import Span, tracer
+
+
+class TableBuffer:
+    def __init__(self, table_name, upsert_on=None):
+        self.table_name = table_name
+        # Conflict columns for buffers flushed with upsert_data instead of insert_data
+        self.upsert_on = upsert_on
+        self.name = f"{table_name} (upsert on {', '.join(upsert_on)})" if upsert_on else table_name
+        self.rows = collections.deque()
+        # One Span per put(), in row order, for callback-to-commit tracing
+        self.spans = collections.deque()
+        self.oldest = None
+        self.overflowing = False
+        self.dropped_rows = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.flush_count = 0
+        self.last_flush_latency = None
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def stats(self):
+        return {
+            'queue_depth': len(self.rows),
+            'oldest_age': time.monotonic() - self.oldest if self.oldest is not None else 0.0,
+            'dropped_rows': self.dropped_rows,
+            'flushed_rows': self.flushed_rows,
+            'failed_flushes': self.failed_flushes,
+            'flush_count': self.flush_count,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+            'avg_flush_latency': self.total_flush_latency / self.flush_count if self.flush_count else None,
+        }
+
+
+class WriteBehindBuffer:
+    """Per-table write-behind queue between IB callbacks and the database.
+
+    put() is thread-safe and only touches memory, so IB reader threads never
+    wait on Postgres. The run() task flushes a table once it holds
+    flush_rows rows or its oldest row is flush_interval seconds old, in
+    insert_data calls of at most flush_rows rows. Each table holds at most
+    max_rows rows: producers wait up to put_timeout seconds for room (never
+    on the event loop thread) and the overflow is dropped and counted. With
+    the default put_timeout of 0 a full table drops rows straight away, so
+    a slow database never stalls the IB reader thread; a positive timeout
+    trades that for fewer dropped rows.
+
+    Rows put with upsert_on=(conflict columns) are kept in a separate queue
+    per table and flushed with upsert_data, the last row per key winning
+    within a batch. They must be complete rows, so that an upsert committed
+    before the plain insert of the same key still writes the whole row.
+
+    Each committed batch is reported to `tracer` (utilsL.tracing) with the
+    time its rows were queued, flushed and committed, and, when producers
+    pass them to put(), the times their callbacks were received."""
+
+    def __init__(self, storage_manager, flush_rows=1000, flush_interval=1.0, max_rows=100000, put_timeout=0.0,
+                 tracer=tracer):
+        self.logger = logging.getLogger(__name__)
+        self.storage_manager = storage_manager
+        self.tracer = tracer
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.put_timeout = put_timeout
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._tables = {}
+        self._loop = None
+        self._loop_thread = None
+        self._wakeup = None
+
+    def put(self, table_name, rows, received=None, upsert_on=None):
+        """Queue rows for table_name. Returns the number of rows accepted.
+
+        `received` optionally gives, per row, the time.monotonic() at which
+        the callback carrying its value arrived (None where unknown).
+        `upsert_on` names the conflict columns for rows that update rows
+        already written."""
+        if not rows:
+            return 0
+
+        key = (table_name, tuple(upsert_on)) if upsert_on else table_name
+        with self._lock:
+            buffer = self._tables.get(key)
+            if buffer is None:
+                buffer = self._tables[key] = TableBuffer(table_name, tuple(upsert_on) if upsert_on else None)
+
+            if len(buffer.rows) + len(rows) > self.max_rows and self.put_timeout > 0 \
+                    and threading.get_ident() != self._loop_thread:
+                deadline = time.monotonic() + self.put_timeout
+                while len(buffer.rows) + len(rows) > self.max_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._not_full.wait(remaining):
+                        break
+
+            free = self.max_rows - len(buffer.rows)
+            accepted = rows if len(rows) <= free else rows[:max(free, 0)]
+            if len(accepted) < len(rows):
+                # Warn once per overflow episode rather than on every callback
+                if not buffer.overflowing:
+                    self.logger.warning("Write buffer for '%s' full, dropping rows", table_name)
+                buffer.overflowing = True
+                buffer.dropped_rows += len(rows) - len(accepted)
+
+            if accepted:
+                buffer.rows.extend(accepted)
+                if received is not None and len(accepted) < len(rows):
+                    received = received[:len(accepted)]
+                buffer.spans.append(Span(len(accepted), time.monotonic(), received))
+                if buffer.oldest is None:
+                    buffer.oldest = time.monotonic()
+            ready = len(buffer.rows) >= self.flush_rows
+
+        if ready:
+            self._signal()
+        return len(accepted)
+
+    def _signal(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._wakeup.set()
+        else:
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_deadline())
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush(force=False)
+        finally:
+            # Drain whatever is left on shutdown
+            await self.flush(force=True)
+            self._loop = None
+
+    def _next_deadline(self):
+        with self._lock:
+            oldest = [buffer.oldest for buffer in self._tables.values() if buffer.oldest is not None]
+        if not oldest:
+            return self.flush_interval
+        return max(0.0, min(oldest) + self.flush_interval - time.monotonic())
+
+    def _take_batch(self, buffer, force):
+        with self._lock:
+            if not buffer.rows:
+                return None
+            age = time.monotonic() - buffer.oldest
+            if not force and len(buffer.rows) < self.flush_rows and age < self.flush_interval:
+                return None
+            count = min(len(buffer.rows), self.flush_rows)
+            batch = [buffer.rows.popleft() for _ in range(count)]
+            spans = []
+            while count:
+                span = buffer.spans[0]
+                if span.count > count:
+                    # The put straddles the batch; its later rows stay queued
+                    head = Span(count, span.enqueued, span.received[:count] if span.received is not None else None)
+                    span.trim(span.count - count)
+                    spans.append(head)
+                    break
+                spans.append(buffer.spans.popleft())
+                count -= span.count
+            if buffer.rows:
+                buffer.oldest = buffer.spans[0].enqueued
+            else:
+                buffer.oldest = None
+                buffer.overflowing = False
+            self._not_full.notify_all()
+            return batch, spans
+
+    def _requeue(self, buffer, batch, spans):
+        with self._lock:
+            free = self.max_rows - len(buffer.rows)
+            keep = batch[-free:] if free > 0 else []
+            buffer.dropped_rows += len(batch) - len(keep)
+            buffer.rows.extendleft(reversed(keep))
+            # The oldest rows are the ones dropped; drop their spans with them
+            kept_spans = []
+            remaining = len(keep)
+            for span in reversed(spans):
+                if remaining <= 0:
+                    break
+                if span.count > remaining:
+                    span.trim(remaining)
+                kept_spans.append(span)
+                remaining -= span.count
+            buffer.spans.extendleft(kept_spans)
+            if buffer.rows:
+                buffer.oldest = time.monotonic()
+
+    async def flush(self, force=True):
+        with self._lock:
+            buffers = list(self._tables.values())
+
+        for buffer in buffers:
+            while await self._flush_batch(buffer, force):
+                pass
+
+    async def _flush_batch(self, buffer, force):
+        """Write one batch of buffer; False once there is nothing (more) to write."""
+        taken = self._take_batch(buffer, force)
+        if not taken:
+            return False
+        batch, spans = taken
+
+        flushed = time.monotonic()
+        start_time = time.perf_counter()
+        try:
+            if buffer.upsert_on:
+                await self.storage_manager.upsert_data(buffer.table_name, self._last_per_key(buffer, batch),
+                                                       list(buffer.upsert_on))
+            else:
+                await self.storage_manager.insert_data(buffer.table_name, batch)
+        except asyncio.CancelledError:
+            # Shutdown cancelled run() mid-write: put the batch back for the final drain. It may
+            # have committed already, so a cancelled batch can be written twice, never lost.
+            self._requeue(buffer, batch, spans)
+            raise
+        except Exception as e:
+            with self._lock:
+                buffer.failed_flushes += 1
+            self.logger.error(f"Failed to flush {len(batch)} rows into '{buffer.table_name}': {str(e)}")
+            self._requeue(buffer, batch, spans)
+            return False
+
+        latency = time.perf_counter() - start_time
+        if self.tracer is not None:
+            self.tracer.record(buffer.table_name, spans, flushed, time.monotonic())
+        metrics.histogram(f"write_buffer.flush.{buffer.table_name}").record(latency)
+        with self._lock:
+            buffer.flush_count += 1
+            buffer.flushed_rows += len(batch)
+            buffer.last_flush_latency = latency
+            buffer.total_flush_latency += latency
+            buffer.max_flush_latency = max(buffer.max_flush_latency, latency)
+        return True
+
+    @staticmethod
+    def _last_per_key(buffer, batch):
+        # ON CONFLICT DO UPDATE rejects a statement touching the same row twice
+        latest = {}
+        for row in batch:
+            latest[tuple(row.get(column) for column in buffer.upsert_on)] = row
+        return list(latest.values())
+
+    def stats(self):
+        with self._lock:
+            return {buffer.name: buffer.stats() for buffer in self._tables.values()}
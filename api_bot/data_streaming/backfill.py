@@ -0,0 +1,292 @@
+import asyncio
+import collections
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from connection.async_bridge import PendingRequests, IBRequestError
+from data_streaming.real_time_data import contract_key
+
+
+def parse_bar_time(value):
+    """Bar timestamps arrive as epoch seconds (formatDate=2) or as
+    "YYYYMMDD" / "YYYYMMDD  HH:MM:SS" strings; all are returned as UTC datetimes."""
+    text = str(value).strip()
+    if text.isdigit() and len(text) != 8:
+        return datetime.fromtimestamp(int(text), tz=timezone.utc)
+    if len(text) == 8:
+        return datetime.strptime(text, "%Y%m%d").replace(tzinfo=timezone.utc)
+    return datetime.strptime(" ".join(text.split()[:2]), "%Y%m%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+# Longest duration IB serves per request for each bar size: (chunk, durationStr)
+MAX_REQUEST_DURATION = {
+    '1 secs': (timedelta(seconds=1800), '1800 S'),
+    '5 secs': (timedelta(seconds=7200), '7200 S'),
+    '15 secs': (timedelta(seconds=14400), '14400 S'),
+    '30 secs': (timedelta(seconds=28800), '28800 S'),
+    '1 min': (timedelta(days=1), '1 D'),
+    '2 mins': (timedelta(days=2), '2 D'),
+    '3 mins': (timedelta(days=7), '1 W'),
+    '5 mins': (timedelta(days=7), '1 W'),
+    '15 mins': (timedelta(days=14), '2 W'),
+    '30 mins': (timedelta(days=28), '4 W'),
+    '1 hour': (timedelta(days=28), '4 W'),
+    '1 day': (timedelta(days=365), '1 Y'),
+}
+
+# "HMDS query returned no data" also comes back as 162 but is not an error
+NO_DATA_ERROR = 162
+
+
+def plan_chunks(start, end, bar_size):
+    """Request end times walking back from `end` until `start` is covered."""
+    chunk, duration = MAX_REQUEST_DURATION[bar_size]
+    chunks = []
+    current = end
+    while current > start:
+        chunks.append((current, duration))
+        current -= chunk
+    return chunks
+
+
+class PacingBudget:
+    """IB historical data pacing rules, enforced before each request is sent.
+
+    - at most `max_requests` requests in any `window` seconds (60 per 10 min),
+    - no identical request within `identical_interval` seconds (15 s),
+    - at most `burst_requests` requests for the same contract and data type
+      within `burst_interval` seconds (6 per 2 s)."""
+
+    def __init__(self, max_requests=60, window=600, identical_interval=15, burst_requests=6, burst_interval=2):
+        self.max_requests = max_requests
+        self.window = window
+        self.identical_interval = identical_interval
+        self.burst_requests = burst_requests
+        self.burst_interval = burst_interval
+        self.sent = collections.deque()
+        self.by_contract = collections.defaultdict(collections.deque)
+        self.identical = {}
+        self.waited = 0.0
+
+    def delay(self, contract_id, identity, now):
+        delays = [0.0]
+        while self.sent and now - self.sent[0] >= self.window:
+            self.sent.popleft()
+        if len(self.sent) >= self.max_requests:
+            delays.append(self.sent[0] + self.window - now)
+
+        recent = self.by_contract[contract_id]
+        while recent and now - recent[0] >= self.burst_interval:
+            recent.popleft()
+        if len(recent) >= self.burst_requests:
+            delays.append(recent[0] + self.burst_interval - now)
+
+        last = self.identical.get(identity)
+        if last is not None and now - last < self.identical_interval:
+            delays.append(last + self.identical_interval - now)
+        return max(delays)
+
+    async def acquire(self, contract_id, identity):
+        # Runs on the event loop only, so check-and-record needs no lock
+        while True:
+            wait = self.delay(contract_id, identity, time.monotonic())
+            if wait <= 0:
+                break
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+        now = time.monotonic()
+        self.sent.append(now)
+        self.by_contract[contract_id].append(now)
+        self.identical[identity] = now
+
+
+class HistoricalBackfill:
+    """Loads long bar histories for a universe of contracts within IB pacing.
+
+    Each contract's range is split into the largest legal chunks and fetched
+    newest first; contracts run concurrently, all drawing from one
+    PacingBudget. After every chunk the bars are written to bar_data and
+    the contract's checkpoint in backfill_checkpoints is advanced in the
+    same step, so a restarted backfill resumes from the oldest stored chunk.
+    Without an explicit end a job is identified by its start: a rerun picks
+    up the unfinished job for that start, with the end it was given then,
+    and fetches only bars after the end of the last completed job from it."""
+
+    def __init__(self, connection, storage_manager, what_to_show='MIDPOINT', use_rth=True,
+                 concurrency=6, request_timeout=120, pacing=None, max_retries=3):
+        self.logger = logging.getLogger(__name__)
+        self.connection = connection
+        self.storage_manager = storage_manager
+        self.what_to_show = what_to_show
+        self.use_rth = use_rth
+        self.concurrency = concurrency
+        self.request_timeout = request_timeout
+        self.pacing = pacing or PacingBudget()
+        self.max_retries = max_retries
+        self.pending = PendingRequests()
+        self.bars = {}
+
+    async def backfill(self, contracts, bar_size, start, end=None):
+        """Backfill [start, end) for every contract. Returns bars written per conId.
+
+        start and end must be timezone-aware. end defaults to now, or to the
+        end of an unfinished backfill from the same start."""
+        for value in (start, end):
+            if value is not None and value.utcoffset() is None:
+                raise ValueError(f"Backfill range bounds must be timezone-aware, got {value}")
+        resume = end is None
+        end = end or datetime.now(timezone.utc)
+        await self.storage_manager.ensure_partitions('bar_data', start, end)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(contract):
+            async with semaphore:
+                return await self._backfill_contract(contract, bar_size, start, end, resume)
+
+        results = await asyncio.gather(*(run(contract) for contract in contracts), return_exceptions=True)
+        written = {}
+        for contract, result in zip(contracts, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Backfill of {contract.symbol} failed: {str(result)}")
+            else:
+                written[contract_key(contract)] = result
+        return written
+
+    async def _backfill_contract(self, contract, bar_size, start, end, resume=False):
+        con_id = contract_key(contract)
+        checkpoint = await self._load_open_checkpoint(con_id, bar_size, start) if resume else None
+        if checkpoint:
+            end = checkpoint['range_end']
+            self.logger.info(f"Resuming backfill of {contract.symbol} {bar_size} up to {end}")
+        else:
+            checkpoint = await self._load_checkpoint(con_id, bar_size, start, end)
+        if checkpoint and checkpoint['completed']:
+            self.logger.info(f"Backfill of {contract.symbol} {bar_size} already complete")
+            return checkpoint['bars_written']
+
+        # [start, fetch_from) is already stored by an earlier completed job from the same start
+        fetch_from = start
+        if resume:
+            fetch_from = max(start, await self._load_completed_end(con_id, bar_size, start, end) or start)
+        covered_from = checkpoint['covered_from'] if checkpoint and checkpoint['covered_from'] else end
+        bars_written = checkpoint['bars_written'] if checkpoint else 0
+
+        for chunk_end, duration in plan_chunks(fetch_from, covered_from, bar_size):
+            bars = await self._request_with_retry(contract, chunk_end, duration, bar_size)
+            rows = [self._bar_row(con_id, contract, bar_size, bar) for bar in bars]
+            rows = [row for row in rows if fetch_from <= row['time'] < end]
+            if rows:
+                bars_written += await self.storage_manager.insert_data('bar_data', rows)
+
+            covered_from = chunk_end - MAX_REQUEST_DURATION[bar_size][0]
+            await self._save_checkpoint(con_id, bar_size, start, end, max(covered_from, fetch_from), False, bars_written)
+
+        await self._save_checkpoint(con_id, bar_size, start, end, start, True, bars_written)
+        self.logger.info(f"Backfilled {bars_written} {bar_size} bars for {contract.symbol}")
+        return bars_written
+
+    async def _request_with_retry(self, contract, chunk_end, duration, bar_size):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                return await self._request(contract, chunk_end, duration, bar_size)
+            except (IBRequestError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise
+                backoff = 15 * attempt
+                self.logger.warning(f"Historical request for {contract.symbol} failed ({str(e) or 'timeout'}), retrying in {backoff}s")
+                await asyncio.sleep(backoff)
+
+    async def _request(self, contract, chunk_end, duration, bar_size):
+        end_text = chunk_end.astimezone(timezone.utc).strftime("%Y%m%d %H:%M:%S") + " GMT"
+        identity = (contract_key(contract), end_text, duration, bar_size, self.what_to_show)
+        await self.pacing.acquire((contract_key(contract), self.what_to_show), identity)
+
+        req_id = self.connection.register_request(self)
+        self.bars[req_id] = []
+        completed = self.pending.create(req_id)
+        try:
+            self.connection.client.reqHistoricalData(req_id, contract, end_text, duration, bar_size,
+                                                     self.what_to_show, int(self.use_rth), 2, False, [])
+            return await asyncio.wait_for(completed, timeout=self.request_timeout)
+        finally:
+            # Timed out (wait_for cancels the future) or cancelled: the request is still open at the gateway
+            if not completed.done() or completed.cancelled():
+                self.connection.client.cancelHistoricalData(req_id)
+            self.pending.discard(req_id)
+            self.bars.pop(req_id, None)
+            self.connection.unregister_request(req_id)
+
+    @staticmethod
+    def _bar_row(con_id, contract, bar_size, bar):
+        return {
+            'con_id': con_id,
+            'bar_size': bar_size,
+            'time': parse_bar_time(bar.date),
+            'symbol': contract.symbol,
+            'open': bar.open,
+            'high': bar.high,
+            'low': bar.low,
+            'close': bar.close,
+            'volume': float(max(bar.volume, 0)),
+            'wap': bar.average,
+            'bar_count': bar.barCount
+        }
+
+    async def _load_checkpoint(self, con_id, bar_size, start, end):
+        table = await self.storage_manager.get_or_create_table('backfill_checkpoints')
+        records = await self.storage_manager.fetch(
+            f'SELECT covered_from, completed, bars_written FROM "{table.schema}"."{table.name}" '
+            'WHERE con_id = $1 AND bar_size = $2 AND what_to_show = $3 AND range_start = $4 AND range_end = $5',
+            con_id, bar_size, self.what_to_show, start, end)
+        return dict(records[0]) if records else None
+
+    async def _load_open_checkpoint(self, con_id, bar_size, start):
+        """The latest unfinished job from `start`, whatever end it was started with."""
+        table = await self.storage_manager.get_or_create_table('backfill_checkpoints')
+        records = await self.storage_manager.fetch(
+            f'SELECT range_end, covered_from, completed, bars_written FROM "{table.schema}"."{table.name}" '
+            'WHERE con_id = $1 AND bar_size = $2 AND what_to_show = $3 AND range_start = $4 AND NOT completed '
+            'ORDER BY updated_at DESC LIMIT 1',
+            con_id, bar_size, self.what_to_show, start)
+        return dict(records[0]) if records else None
+
+    async def _load_completed_end(self, con_id, bar_size, start, end):
+        """End of the latest completed job from `start` ending no later than `end`, or None."""
+        table = await self.storage_manager.get_or_create_table('backfill_checkpoints')
+        records = await self.storage_manager.fetch(
+            f'SELECT max(range_end) AS range_end FROM "{table.schema}"."{table.name}" '
+            'WHERE con_id = $1 AND bar_size = $2 AND what_to_show = $3 AND range_start = $4 AND completed '
+            'AND range_end <= $5',
+            con_id, bar_size, self.what_to_show, start, end)
+        return records[0]['range_end'] if records else None
+
+    async def _save_checkpoint(self, con_id, bar_size, start, end, covered_from, completed, bars_written):
+        await self.storage_manager.upsert_data('backfill_checkpoints', [{
+            'con_id': con_id,
+            'bar_size': bar_size,
+            'what_to_show': self.what_to_show,
+            'range_start': start,
+            'range_end': end,
+            'covered_from': covered_from,
+            'completed': completed,
+            'bars_written': bars_written,
+            'updated_at': datetime.now(timezone.utc),
+        }], conflict_columns=['con_id', 'bar_size', 'what_to_show', 'range_start', 'range_end'])
+
+
+
+    def historicalData(self, reqId, bar):
+        bars = self.bars.get(reqId)
+        if bars is not None:
+            bars.append(bar)
+
+    def historicalDataEnd(self, reqId, start, end):
+        self.pending.resolve(reqId, self.bars.get(reqId, []))
+
+    def error(self, reqId, errorCode, errorString):
+        if errorCode == NO_DATA_ERROR and "pacing violation" not in errorString.lower():
+            # Weekends, holidays and ranges before the contract listed
+            self.pending.resolve(reqId, [])
+        else:
+            self.pending.reject(reqId, IBRequestError(reqId, errorCode, errorString))
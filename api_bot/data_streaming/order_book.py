@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import threading
+import time
+import numpy as np
+from data_streaming.real_time_data import contract_key
+
+
+ASK, BID = 0, 1
+INSERT, UPDATE, DELETE = 0, 1, 2
+
+# "Market depth data has been RESET. Please empty deep book contents before applying any new entries."
+DEPTH_RESET = 317
+
+
+def book_dtype(depth):
+    """Record layout of a book snapshot, as stored in a ColumnarArchive."""
+    fields = [('time', 'f8')]
+    for side in ('bid', 'ask'):
+        fields += [(f'{side}_price_{level}', 'f8') for level in range(depth)]
+        fields += [(f'{side}_size_{level}', 'f8') for level in range(depth)]
+    return np.dtype(fields)
+
+
+class OrderBook:
+    """Depth of market for one contract in fixed-size NumPy arrays.
+
+    prices[side] and sizes[side] hold `depth` levels per side (ASK = 0,
+    BID = 1, the side numbers updateMktDepth uses), best level first. An
+    update is a single in-place store; insert and delete shift at most
+    `depth` entries through preallocated scratch rows (overlapping slice
+    assignment would make NumPy copy through a temporary), so applying an
+    update allocates no array memory. Empty levels hold NaN price and zero
+    size; an insert or update past the last level extends the book with
+    empty levels in between."""
+
+    def __init__(self, depth=10):
+        self.depth = depth
+        self.prices = np.full((2, depth), np.nan)
+        self.sizes = np.zeros((2, depth))
+        self.market_makers = np.full((2, depth), None, dtype=object)
+        self._scratch = np.empty(depth)
+        self._scratch_makers = np.empty(depth, dtype=object)
+        self.levels = [0, 0]
+        self.updates = 0
+        self.updated_at = 0.0
+        self._lock = threading.Lock()
+
+    def _shift(self, prices, sizes, makers, src, dst, n):
+        """Move n levels from src to dst within one side."""
+        scratch, scratch_makers = self._scratch[:n], self._scratch_makers[:n]
+        for array, buffer in ((prices, scratch), (sizes, scratch), (makers, scratch_makers)):
+            buffer[:] = array[src:src + n]
+            array[dst:dst + n] = buffer
+
+    def apply(self, position, operation, side, price, size, market_maker=None):
+        if position >= self.depth:
+            return
+        with self._lock:
+            prices, sizes, makers = self.prices[side], self.sizes[side], self.market_makers[side]
+            count = self.levels[side]
+            if operation == DELETE:
+                if position >= count:
+                    return
+                self._shift(prices, sizes, makers, position + 1, position, count - 1 - position)
+                prices[count - 1] = np.nan
+                sizes[count - 1] = 0.0
+                makers[count - 1] = None
+                self.levels[side] = count - 1
+                self.updates += 1
+                self.updated_at = time.time()
+                return
+            if operation == INSERT and position < count:
+                end = min(count, self.depth - 1)
+                self._shift(prices, sizes, makers, position, position + 1, end - position)
+                self.levels[side] = min(count + 1, self.depth)
+            elif position >= count:
+                # An insert or update past the last level extends the book
+                self.levels[side] = position + 1
+            prices[position] = price
+            sizes[position] = size
+            makers[position] = market_maker
+            self.updates += 1
+            self.updated_at = time.time()
+
+    def clear(self):
+        with self._lock:
+            self.prices.fill(np.nan)
+            self.sizes.fill(0.0)
+            self.market_makers.fill(None)
+            self.levels = [0, 0]
+
+    def top(self, n=None):
+        """(bid prices, bid sizes, ask prices, ask sizes) of the best n levels, as copies."""
+        n = min(n or self.depth, self.depth)
+        with self._lock:
+            return (self.prices[BID, :n].copy(), self.sizes[BID, :n].copy(),
+                    self.prices[ASK, :n].copy(), self.sizes[ASK, :n].copy())
+
+    def best(self):
+        with self._lock:
+            return self.prices[BID, 0], self.sizes[BID, 0], self.prices[ASK, 0], self.sizes[ASK, 0]
+
+    def mid(self):
+        bid, _, ask, _ = self.best()
+        return (bid + ask) / 2
+
+    def spread(self):
+        bid, _, ask, _ = self.best()
+        return ask - bid
+
+    def imbalance(self, n=None):
+        """(bid size - ask size) / (bid size + ask size) over the best n levels, in [-1, 1]."""
+        n = min(n or self.depth, self.depth)
+        with self._lock:
+            bid = self.sizes[BID, :n].sum()
+            ask = self.sizes[ASK, :n].sum()
+        total = bid + ask
+        return (bid - ask) / total if total else np.nan
+
+    def microprice(self):
+        """Top-of-book price weighted towards the side with less size."""
+        bid, bid_size, ask, ask_size = self.best()
+        total = bid_size + ask_size
+        return (bid * ask_size + ask * bid_size) / total if total else np.nan
+
+    def snapshot(self, out):
+        """Fill a book_dtype record in place."""
+        with self._lock:
+            out['time'] = self.updated_at
+            for level in range(self.depth):
+                out[f'bid_price_{level}'] = self.prices[BID, level]
+                out[f'bid_size_{level}'] = self.sizes[BID, level]
+                out[f'ask_price_{level}'] = self.prices[ASK, level]
+                out[f'ask_size_{level}'] = self.sizes[ASK, level]
+        return out
+
+
+class OrderBookManager:
+    """Maintains an OrderBook per contract from reqMktDepth streams.
+
+    Depth callbacks are routed here by request id and applied on the reader
+    thread. With an archive (a ColumnarArchive built with book_dtype(depth)),
+    run() persists conflated snapshots: at most one per book per
+    `conflate_interval`, and only for books that changed."""
+
+    def __init__(self, connection, depth=10, is_smart_depth=False, archive=None, conflate_interval=1.0):
+        self.logger = logging.getLogger(__name__)
+        self.connection = connection
+        self.depth = depth
+        self.is_smart_depth = is_smart_depth
+        if archive is not None and archive.dtype != book_dtype(depth):
+            raise ValueError(f"Order book archive must use book_dtype({depth})")
+        self.archive = archive
+        self.conflate_interval = conflate_interval
+        self.books = {}
+        self.by_req_id = {}
+        self._persisted = {}
+        self._record = np.zeros(1, dtype=book_dtype(depth))[0]
+
+    def subscribe(self, contract):
+        key = contract_key(contract)
+        if key in self.books:
+            return self.books[key]
+        book = OrderBook(self.depth)
+        req_id = self.connection.register_request(self)
+        self.books[key] = book
+        self.by_req_id[req_id] = (contract, book)
+        self.connection.client.reqMktDepth(req_id, contract, self.depth, self.is_smart_depth, [])
+        self.logger.info(f"Requested market depth for {contract.symbol} (reqId {req_id})")
+        return book
+
+    def unsubscribe(self, contract):
+        key = contract_key(contract)
+        for req_id, (subscribed, book) in list(self.by_req_id.items()):
+            if contract_key(subscribed) == key:
+                self.connection.client.cancelMktDepth(req_id, self.is_smart_depth)
+                self.connection.unregister_request(req_id)
+                del self.by_req_id[req_id]
+                self.books.pop(key, None)
+                self._persisted.pop(key, None)
+
+    def book(self, key):
+        """Book of a contract, by contract_key() (the conId for resolved contracts)."""
+        return self.books.get(key)
+
+    def persist(self):
+        """Archive one snapshot of every book that changed since the last call."""
+        written = 0
+        for contract, book in list(self.by_req_id.values()):
+            key = contract_key(contract)
+            if self._persisted.get(key) == book.updates:
+                continue
+            self._persisted[key] = book.updates
+            self.archive.append('book', contract.symbol, *book.snapshot(self._record).tolist())
+            written += 1
+        return written
+
+    async def run(self):
+        if self.archive is None:
+            return
+        try:
+            while True:
+                await asyncio.sleep(self.conflate_interval)
+                self.persist()
+        finally:
+            for contract, _ in list(self.by_req_id.values()):
+                self.unsubscribe(contract)
+
+
+
+    def updateMktDepth(self, reqId, position, operation, side, price, size):
+        entry = self.by_req_id.get(reqId)
+        if entry is not None:
+            entry[1].apply(position, operation, side, price, size)
+
+    def updateMktDepthL2(self, reqId, position, marketMaker, operation, side, price, size, isSmartDepth):
+        entry = self.by_req_id.get(reqId)
+        if entry is not None:
+            entry[1].apply(position, operation, side, price, size, marketMaker)
+
+    def error(self, reqId, errorCode, errorString):
+        entry = self.by_req_id.get(reqId)
+        if entry is None:
+            return
+        if errorCode == DEPTH_RESET:
+            entry[1].clear()
+        else:
+            self.logger.error(f"Market depth for {entry[0].symbol} error {errorCode}: {errorString}")
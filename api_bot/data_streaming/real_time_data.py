@@ -1,39 +1,150 @@
 import asyncio
 import logging
-from ibapi.common import TickerId, BarData
+import zlib
+from datetime import datetime, timezone
+from data_streaming.ring_buffer import BarRingBuffer
+from data_streaming.resampler import BarResampler, TIMEFRAMES
+
+
+def contract_key(contract):
+    """conId of a resolved contract, else a stable negative surrogate for the spec."""
+    if contract.conId:
+        return contract.conId
+    spec = f"{contract.symbol}.{contract.secType}.{contract.currency}.{contract.exchange}"
+    return -zlib.crc32(spec.encode())
+
+
+class ContractStream:
+    def __init__(self, req_id, contract, capacity):
+        self.req_id = req_id
+        self.contract = contract
+        self.con_id = contract_key(contract)
+        self.bars = BarRingBuffer(capacity)
+
 
 class RealTimeDataStream:
-    def __init__(self, app):
-        self.app = app
+    """5-second real-time bars for many contracts over the shared connection.
+
+    Each contract gets its own request id routed to this object and a
+    preallocated ring buffer; every bar is appended there and queued for
+    bar_data in the write buffer straight from the callback, so nothing polls
+    and no bar is overwritten before it is stored. The same bars feed a
+    resampler that stores the larger timeframes as they close, so one
+    subscription per contract serves every bar size. With an archive, every
+    bar is also queued for the local columnar store.
+
+    Given a MarketDataSubscriptionManager, subscriptions go through it and
+    are shared with other components; callbacks then carry the conId, which
+    keys `streams` in place of the request id."""
+
+    BAR_SIZE = '5 secs'
+
+    def __init__(self, connection, write_buffer, capacity=4096, what_to_show="MIDPOINT", timeframes=TIMEFRAMES,
+                 archive=None, subscriptions=None):
+        self.connection = connection
+        self.write_buffer = write_buffer
+        self.archive = archive
+        self.subscriptions = subscriptions
         self.logger = logging.getLogger(__name__)
-        self.latest_bar = None
+        self.capacity = capacity
+        self.what_to_show = what_to_show
+        self.streams = {}
+        self.by_con_id = {}
+        self.resampler = BarResampler(self.store_resampled_bar, base_seconds=5, timeframes=timeframes)
 
-    async def stream_real_time_data(self, contract):
-        try:
-            #self.latest_bar = self.app.reqRealTimeBars(contract, 5, "MIDPOINT", True, [])
-            self.latest_bar  = self.app.reqHistoricalData(contract, endDateTime='', durationStr='30 D',barSizeSetting='1 hour', whatToShow='MIDPOINT', useRTH=True, keepUpToDate=True)
-            self.logger.info(f"Requested real-time data for {contract.symbol}")
+    def subscribe(self, contract):
+        con_id = contract_key(contract)
+        if con_id in self.by_con_id:
+            return self.by_con_id[con_id].req_id
+
+        if self.subscriptions is not None:
+            stream = ContractStream(con_id, contract, self.capacity)
+            self.streams[con_id] = stream
+            self.by_con_id[con_id] = stream
+            self.subscriptions.subscribe(contract, self.subscriptions.BARS, self, self.what_to_show)
+            return con_id
+
+        req_id = self.connection.register_request(self)
+        stream = ContractStream(req_id, contract, self.capacity)
+        self.streams[req_id] = stream
+        self.by_con_id[con_id] = stream
+        self.connection.client.reqRealTimeBars(req_id, contract, 5, self.what_to_show, True, [])
+        self.logger.info(f"Requested real-time bars for {contract.symbol} (reqId {req_id})")
+        return req_id
 
-            while True:
-                await asyncio.sleep(1)  # Wait for new data
+    def unsubscribe(self, contract):
+        stream = self.by_con_id.pop(contract_key(contract), None)
+        if stream is None:
+            return
+        if self.subscriptions is not None:
+            self.subscriptions.unsubscribe(contract, self.subscriptions.BARS, self, self.what_to_show)
+        else:
+            self.connection.client.cancelRealTimeBars(stream.req_id)
+            self.connection.unregister_request(stream.req_id)
+        self.streams.pop(stream.req_id, None)
 
-                if self.latest_bar:
-                    await self.app.storage_manager.store_bar_data(self.latest_bar)
-                    self.latest_bar = None
-                    
+    def bars(self, contract, n=None):
+        stream = self.by_con_id.get(contract_key(contract))
+        return stream.bars.latest(n) if stream is not None else None
+
+    async def stream_real_time_data(self, contracts):
+        try:
+            for contract in contracts:
+                self.subscribe(contract)
+            # Bars are pushed from the callbacks; this task only owns the subscriptions
+            await asyncio.Event().wait()
         except Exception as e:
             self.logger.error(f"Failed to stream real-time data: {str(e)}")
-
+        finally:
+            await self.stop()
 
     async def stop(self):
-        self.app.sleep(30)
-        self.app.cancelRealTimeBars(self.latest_bar)
+        for stream in list(self.streams.values()):
+            self.unsubscribe(stream.contract)
+
 
 
+    def realtimeBar(self, reqId, time, open_, high, low, close, volume, wap, count):
+        stream = self.streams.get(reqId)
+        if stream is None:
+            return
+        stream.bars.append(time, open_, high, low, close, volume, wap, count)
+        self.write_buffer.put("bar_data", [
+            self.bar_row(stream, self.BAR_SIZE, time, open_, high, low, close, volume, wap, count)
+        ])
+        if self.archive is not None:
+            self.archive.append(self.BAR_SIZE, stream.contract.symbol, time, open_, high, low, close, volume, wap, count)
+        self.resampler.update(stream.con_id, time, open_, high, low, close, volume, wap, count)
 
+    def store_resampled_bar(self, con_id, bar_size, bar):
+        stream = self.by_con_id.get(con_id)
+        if stream is None:
+            return
+        self.write_buffer.put("bar_data", [
+            self.bar_row(stream, bar_size, bar.start, bar.open, bar.high, bar.low, bar.close,
+                         bar.volume, bar.wap, bar.count)
+        ])
+        if self.archive is not None:
+            self.archive.append(bar_size, stream.contract.symbol, bar.start, bar.open, bar.high, bar.low,
+                                bar.close, bar.volume, bar.wap, bar.count)
 
+    @staticmethod
+    def bar_row(stream, bar_size, time, open_, high, low, close, volume, wap, count):
+        return {
+            'con_id': stream.con_id,
+            'bar_size': bar_size,
+            'time': datetime.fromtimestamp(time, tz=timezone.utc),
+            'symbol': stream.contract.symbol,
+            'open': open_,
+            'high': high,
+            'low': low,
+            'close': close,
+            'volume': float(volume),
+            'wap': wap,
+            'bar_count': count
+        }
 
-    def realtimeBar(self, reqId: TickerId, time: int, open_: float, high: float, low: float, close: float,
-                    volume: int, wap: float, count: int):
-        self.latest_bar = BarData(time, -1, open_, high, low, close, volume, count, wap)
-        self.logger.info(f"Received real-time bar: {self.latest_bar}")
\ No newline at end of file
+    def error(self, reqId, errorCode, errorString):
+        stream = self.streams.get(reqId)
+        symbol = stream.contract.symbol if stream is not None else "?"
+        self.logger.error(f"Real-time bars for {symbol} (reqId {reqId}) error {errorCode}: {errorString}")
@@ -0,0 +1,93 @@
+import logging
+
+
+# IB bar size labels (as stored in bar_data.bar_size) and their length in seconds
+TIMEFRAMES = {
+    '1 min': 60,
+    '5 mins': 300,
+    '15 mins': 900,
+    '1 hour': 3600,
+    '1 day': 86400,
+}
+
+
+class OpenBar:
+    __slots__ = ('start', 'end', 'open', 'high', 'low', 'close', 'volume', 'wap_value', 'count')
+
+    def __init__(self, start, seconds, open_, high, low, close, volume, wap, count):
+        self.start = start
+        self.end = start + seconds
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.wap_value = wap * volume
+        self.count = count
+
+    def update(self, high, low, close, volume, wap, count):
+        if high > self.high:
+            self.high = high
+        if low < self.low:
+            self.low = low
+        self.close = close
+        self.volume += volume
+        self.wap_value += wap * volume
+        self.count += count
+
+    @property
+    def wap(self):
+        return self.wap_value / self.volume if self.volume > 0 else self.close
+
+
+class BarResampler:
+    """Aggregates base bars (e.g. 5-second real-time bars) into larger timeframes.
+
+    Each (contract, timeframe) keeps one open bar that is updated in place, so
+    a base bar costs O(1) per timeframe. A bar is emitted through on_bar as
+    soon as the base bar that ends its interval arrives, or when the first base
+    bar of a later interval shows up after a gap. Buckets are aligned to UTC
+    epoch multiples, so daily bars run midnight to midnight UTC.
+
+    on_bar(key, bar_size, bar) is called on the thread that feeds update()."""
+
+    def __init__(self, on_bar, base_seconds=5, timeframes=TIMEFRAMES):
+        self.logger = logging.getLogger(__name__)
+        self.on_bar = on_bar
+        self.base_seconds = base_seconds
+        self.timeframes = [(label, seconds) for label, seconds in timeframes.items() if seconds > base_seconds]
+        self.open_bars = {}
+
+    def update(self, key, time, open_, high, low, close, volume, wap, count):
+        volume = max(volume, 0)  # MIDPOINT/BID/ASK bars report volume -1
+        base_end = time + self.base_seconds
+
+        for label, seconds in self.timeframes:
+            start = time - time % seconds
+            slot = (key, label)
+            bar = self.open_bars.get(slot)
+
+            if bar is not None and bar.start != start:
+                # A gap in the base bars: the open bar never saw its closing bar
+                self._emit(key, label, bar)
+                bar = None
+
+            if bar is None:
+                bar = OpenBar(start, seconds, open_, high, low, close, volume, wap, count)
+                self.open_bars[slot] = bar
+            else:
+                bar.update(high, low, close, volume, wap, count)
+
+            if base_end >= bar.end:
+                self._emit(key, label, bar)
+                del self.open_bars[slot]
+
+    def current(self, key, label):
+        """The still-open bar of a timeframe, or None."""
+        return self.open_bars.get((key, label))
+
+    def _emit(self, key, label, bar):
+        try:
+            self.on_bar(key, label, bar)
+        except Exception as e:
+            self.logger.error(f"Failed to emit {label} bar for {key}: {str(e)}")
@@ -0,0 +1,60 @@
+import threading
+import numpy as np
+
+
+BAR_DTYPE = np.dtype([
+    ('time', 'i8'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('volume', 'f8'),
+    ('wap', 'f8'),
+    ('count', 'i8'),
+])
+
+
+class BarRingBuffer:
+    """Fixed-capacity ring of bars in one preallocated structured NumPy array.
+
+    append() writes the fields in place, so steady-state streaming allocates
+    nothing per bar. Every bar gets a sequence number; readers ask for the
+    bars after the last sequence they saw. The oldest bars are overwritten
+    once more than `capacity` bars have been appended."""
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.bars = np.zeros(capacity, dtype=BAR_DTYPE)
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, time, open_, high, low, close, volume, wap, count):
+        with self._lock:
+            self.bars[self.total % self.capacity] = (time, open_, high, low, close, volume, wap, count)
+            self.total += 1
+
+    def latest(self, n=None):
+        """The newest n bars (all held bars by default), oldest first, as a copy."""
+        with self._lock:
+            count = len(self) if n is None else max(0, min(n, len(self)))
+            return self._slice(self.total - count, self.total)
+
+    def since(self, sequence):
+        """Bars appended after `sequence` and the sequence to pass next time.
+
+        Bars already overwritten are skipped, so a slow reader loses the
+        oldest bars rather than blocking the writer."""
+        with self._lock:
+            start = max(sequence, self.total - self.capacity)
+            return self._slice(start, self.total), self.total
+
+    def _slice(self, start, end):
+        if start >= end:
+            return self.bars[:0].copy()
+        first, last = start % self.capacity, end % self.capacity
+        if first < last:
+            return self.bars[first:last].copy()
+        return np.concatenate((self.bars[first:], self.bars[:last]))
@@ -0,0 +1,212 @@
+import asyncio
+import collections
+import logging
+import threading
+import time
+from data_streaming.real_time_data import contract_key
+
+
+TICKS = 'ticks'
+BARS = 'bars'
+
+
+class LineBudgetExceeded(Exception):
+    pass
+
+
+class Subscription:
+    __slots__ = ('key', 'req_id', 'contract', 'con_id', 'data_type', 'option', 'lines', 'subscribers', 'released_at')
+
+    def __init__(self, key, req_id, contract, data_type, option, lines):
+        self.key = key
+        self.req_id = req_id
+        self.contract = contract
+        self.con_id = key[0]
+        self.data_type = data_type
+        self.option = option
+        self.lines = lines
+        self.subscribers = ()
+        self.released_at = None
+
+
+class MarketDataSubscriptionManager:
+    """One gateway subscription per (conId, data type, option), shared by reference count.
+
+    Components subscribe with a handler object implementing the callbacks
+    they want (tickPrice, tickSize, ... for TICKS, realtimeBar for BARS);
+    each callback is fanned out to every handler of the subscription with the
+    conId as its first argument. The option is the generic tick list for
+    TICKS and whatToShow for BARS.
+
+    When the last handler leaves, the subscription stays open as idle, so
+    the next subscriber gets it without a round trip. Lines are budgeted:
+    opening a subscription beyond `line_budget` cancels the least recently
+    released idle one, and raises LineBudgetExceeded if none is idle. Idle
+    subscriptions are also cancelled after `idle_timeout` seconds by run()."""
+
+    TICKS = TICKS
+    BARS = BARS
+
+    def __init__(self, connection, line_budget=100, idle_timeout=300, line_costs=None):
+        self.logger = logging.getLogger(__name__)
+        self.connection = connection
+        self.line_budget = line_budget
+        self.idle_timeout = idle_timeout
+        self.line_costs = line_costs or {TICKS: 1, BARS: 1}
+        self._lock = threading.Lock()
+        self.subscriptions = {}
+        self.by_req_id = {}
+        self.idle = collections.OrderedDict()
+        self.used_lines = 0
+        self.evictions = 0
+
+    def subscribe(self, contract, data_type, handler, option=None):
+        """Add handler to the subscription, opening it if needed. Returns the conId callbacks carry."""
+        key = (contract_key(contract), data_type, option)
+        evicted = []
+        with self._lock:
+            subscription = self.subscriptions.get(key)
+            if subscription is not None:
+                if handler not in subscription.subscribers:
+                    subscription.subscribers = subscription.subscribers + (handler,)
+                self.idle.pop(key, None)
+                subscription.released_at = None
+                return subscription.con_id
+
+            lines = self.line_costs[data_type]
+            # Check before evicting anything, so a failed subscribe leaves idle subscriptions open and tracked
+            idle_lines = sum(idle.lines for idle in self.idle.values())
+            if self.used_lines - idle_lines + lines > self.line_budget:
+                raise LineBudgetExceeded(
+                    f"{self.used_lines}/{self.line_budget} market data lines in use, {idle_lines} idle")
+            while self.used_lines + lines > self.line_budget:
+                evicted.append(self._remove(self.idle.popitem(last=False)[1]))
+                self.evictions += 1
+
+            subscription = Subscription(key, self.connection.register_request(self), contract, data_type, option, lines)
+            subscription.subscribers = (handler,)
+            self.subscriptions[key] = subscription
+            self.by_req_id[subscription.req_id] = subscription
+            self.used_lines += lines
+
+        for old in evicted:
+            self.logger.info(f"Evicting idle {old.data_type} subscription for {old.contract.symbol} to free a line")
+            self._cancel(old)
+        self._request(subscription)
+        return subscription.con_id
+
+    def unsubscribe(self, contract, data_type, handler, option=None):
+        key = (contract_key(contract), data_type, option)
+        with self._lock:
+            subscription = self.subscriptions.get(key)
+            if subscription is None:
+                return
+            subscription.subscribers = tuple(h for h in subscription.subscribers if h is not handler)
+            if subscription.subscribers:
+                return
+            subscription.released_at = time.monotonic()
+            self.idle[key] = subscription
+            if self.idle_timeout != 0:
+                return
+            self._remove(self.idle.pop(key))
+        self._cancel(subscription)
+
+    def expire_idle(self):
+        """Cancel idle subscriptions released more than idle_timeout seconds ago."""
+        deadline = time.monotonic() - self.idle_timeout
+        expired = []
+        with self._lock:
+            while self.idle:
+                subscription = next(iter(self.idle.values()))
+                if subscription.released_at > deadline:
+                    break
+                expired.append(self._remove(self.idle.popitem(last=False)[1]))
+        for subscription in expired:
+            self._cancel(subscription)
+        return len(expired)
+
+    async def run(self, interval=30):
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.expire_idle()
+        finally:
+            self.stop()
+
+    def stop(self):
+        with self._lock:
+            subscriptions = [self._remove(subscription) for subscription in list(self.subscriptions.values())]
+            self.idle.clear()
+        for subscription in subscriptions:
+            self._cancel(subscription)
+
+    def line_usage(self):
+        with self._lock:
+            by_type = collections.Counter()
+            for subscription in self.subscriptions.values():
+                by_type[subscription.data_type] += subscription.lines
+            return {
+                'budget': self.line_budget,
+                'used': self.used_lines,
+                'active': len(self.subscriptions) - len(self.idle),
+                'idle': len(self.idle),
+                'subscribers': sum(len(s.subscribers) for s in self.subscriptions.values()),
+                'evictions': self.evictions,
+                'by_type': dict(by_type),
+            }
+
+    def _remove(self, subscription):
+        # Caller holds the lock
+        self.subscriptions.pop(subscription.key, None)
+        self.by_req_id.pop(subscription.req_id, None)
+        self.used_lines -= subscription.lines
+        return subscription
+
+    def _request(self, subscription):
+        client = self.connection.client
+        if subscription.data_type == TICKS:
+            client.reqMktData(subscription.req_id, subscription.contract, subscription.option or "", False, False, [])
+        else:
+            client.reqRealTimeBars(subscription.req_id, subscription.contract, 5, subscription.option or "MIDPOINT", True, [])
+        self.logger.info(f"Subscribed {subscription.data_type} for {subscription.contract.symbol} (reqId {subscription.req_id})")
+
+    def _cancel(self, subscription):
+        client = self.connection.client
+        if subscription.data_type == TICKS:
+            client.cancelMktData(subscription.req_id)
+        else:
+            client.cancelRealTimeBars(subscription.req_id)
+        self.connection.unregister_request(subscription.req_id)
+
+    def _fan_out(self, name, req_id, args):
+        subscription = self.by_req_id.get(req_id)
+        if subscription is None:
+            return
+        for handler in subscription.subscribers:
+            callback = getattr(handler, name, None)
+            if callback is None:
+                continue
+            try:
+                callback(subscription.con_id, *args)
+            except Exception as e:
+                self.logger.error(f"Subscriber {type(handler).__name__}.{name} failed: {str(e)}")
+
+
+
+    def tickPrice(self, reqId, tickType, price, attrib):
+        self._fan_out("tickPrice", reqId, (tickType, price, attrib))
+
+    def tickSize(self, reqId, tickType, size):
+        self._fan_out("tickSize", reqId, (tickType, size))
+
+    def tickString(self, reqId, tickType, value):
+        self._fan_out("tickString", reqId, (tickType, value))
+
+    def tickGeneric(self, reqId, tickType, value):
+        self._fan_out("tickGeneric", reqId, (tickType, value))
+
+    def realtimeBar(self, reqId, time, open_, high, low, close, volume, wap, count):
+        self._fan_out("realtimeBar", reqId, (time, open_, high, low, close, volume, wap, count))
+
+    def error(self, reqId, errorCode, errorString):
+        self._fan_out("error", reqId, (errorCode, errorString))
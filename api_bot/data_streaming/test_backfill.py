@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from ibapi.common import BarData
+from ibapi.contract import Contract
+from data_streaming.backfill import HistoricalBackfill, PacingBudget, plan_chunks
+
+UTC = timezone.utc
+
+
+def test_plan_chunks_walks_back_from_end():
+    start = datetime(2024, 1, 1, tzinfo=UTC)
+    assert plan_chunks(start, start + timedelta(days=3), '1 min') == [
+        (start + timedelta(days=3), '1 D'),
+        (start + timedelta(days=2), '1 D'),
+        (start + timedelta(days=1), '1 D'),
+    ]
+
+
+def test_plan_chunks_boundaries():
+    start = datetime(2024, 1, 1, tzinfo=UTC)
+    # A partial chunk still needs a full request; an empty or inverted range needs none
+    assert plan_chunks(start, start + timedelta(seconds=1), '1 secs') == [(start + timedelta(seconds=1), '1800 S')]
+    assert plan_chunks(start, start + timedelta(seconds=1801), '1 secs')[-1] == (start + timedelta(seconds=1), '1800 S')
+    assert plan_chunks(start, start, '1 day') == []
+    assert plan_chunks(start, start - timedelta(days=1), '1 day') == []
+
+
+def test_pacing_caps_requests_per_window():
+    pacing = PacingBudget(burst_requests=1000, identical_interval=0)
+    for i in range(60):
+        assert pacing.delay(i, i, now=float(i)) == 0
+        pacing.sent.append(float(i))
+    assert pacing.delay(60, 60, now=60.0) == 540.0
+    assert pacing.delay(60, 60, now=600.0) == 0
+
+
+def test_pacing_spaces_identical_requests():
+    pacing = PacingBudget()
+    pacing.identical['req'] = 100.0
+    assert pacing.delay('c', 'req', now=105.0) == 10.0
+    assert pacing.delay('c', 'other', now=105.0) == 0
+    assert pacing.delay('c', 'req', now=115.0) == 0
+
+
+def test_pacing_limits_bursts_per_contract():
+    pacing = PacingBudget()
+    pacing.by_contract['c'].extend([10.0] * 6)
+    assert pacing.delay('c', 'x', now=10.5) == 1.5
+    assert pacing.delay('d', 'x', now=10.5) == 0
+    assert pacing.delay('c', 'x', now=12.0) == 0
+
+
+class FakeClient:
+    """Serves hourly bars for the 72 hours before each request's end time."""
+
+    def __init__(self, backfill):
+        self.backfill = backfill
+        self.requests = []
+
+    def reqHistoricalData(self, req_id, contract, end_text, duration, bar_size, *args):
+        self.requests.append(end_text)
+        end = datetime.strptime(end_text, "%Y%m%d %H:%M:%S GMT").replace(tzinfo=UTC)
+        for hours in range(1, 73):
+            bar = BarData()
+            bar.date = str(int((end - timedelta(hours=hours)).timestamp()))
+            self.backfill.historicalData(req_id, bar)
+        self.backfill.historicalDataEnd(req_id, "", "")
+
+    def cancelHistoricalData(self, req_id):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.client = None
+        self.next_id = 0
+
+    def register_request(self, handler):
+        self.next_id += 1
+        return self.next_id
+
+    def unregister_request(self, req_id):
+        pass
+
+
+class CheckpointStorage:
+    """Keeps bar_data rows and backfill_checkpoints in memory, answering the backfill's queries."""
+
+    def __init__(self):
+        self.bars = []
+        self.checkpoints = {}
+
+    async def ensure_partitions(self, table_name, start, end):
+        pass
+
+    async def get_or_create_table(self, table_name):
+        return SimpleNamespace(schema='public', name=table_name)
+
+    async def insert_data(self, table_name, rows):
+        self.bars.extend(rows)
+        return len(rows)
+
+    async def upsert_data(self, table_name, rows, conflict_columns=None):
+        for row in rows:
+            self.checkpoints[tuple(row[column] for column in conflict_columns)] = dict(row)
+
+    async def fetch(self, query, con_id, bar_size, what_to_show, start, end=None):
+        rows = [row for row in self.checkpoints.values()
+                if (row['con_id'], row['bar_size'], row['what_to_show'], row['range_start'])
+                == (con_id, bar_size, what_to_show, start)]
+        if 'max(range_end)' in query:
+            ends = [row['range_end'] for row in rows if row['completed'] and row['range_end'] <= end]
+            return [{'range_end': max(ends) if ends else None}]
+        if 'NOT completed' in query:
+            rows = sorted((row for row in rows if not row['completed']), key=lambda row: row['updated_at'])
+            return rows[-1:]
+        return [row for row in rows if row['range_end'] == end]
+
+
+def make_backfill(storage):
+    connection = FakeConnection()
+    pacing = PacingBudget(max_requests=10 ** 6, identical_interval=0, burst_requests=10 ** 6)
+    backfill = HistoricalBackfill(connection, storage, pacing=pacing)
+    connection.client = FakeClient(backfill)
+    return backfill, connection.client
+
+
+def stock():
+    contract = Contract()
+    contract.conId, contract.symbol = 265598, 'AAPL'
+    return contract
+
+
+START = datetime(2024, 1, 1, tzinfo=UTC)
+
+
+def test_unfinished_backfill_resumes_from_open_checkpoint():
+    storage = CheckpointStorage()
+    end = START + timedelta(days=3)
+    # A run with this end stopped after its newest chunk
+    asyncio.run(storage.upsert_data('backfill_checkpoints', [{
+        'con_id': 265598, 'bar_size': '1 hour', 'what_to_show': 'MIDPOINT', 'range_start': START,
+        'range_end': end, 'covered_from': START + timedelta(days=2), 'completed': False,
+        'bars_written': 24, 'updated_at': datetime.now(UTC),
+    }], conflict_columns=['con_id', 'bar_size', 'what_to_show', 'range_start', 'range_end']))
+    backfill, client = make_backfill(storage)
+
+    written = asyncio.run(backfill.backfill([stock()], '1 hour', START))
+
+    assert client.requests == ['20240103 00:00:00 GMT']
+    assert written == {265598: 72}
+    assert min(row['time'] for row in storage.bars) == START
+    assert max(row['time'] for row in storage.bars) < START + timedelta(days=2)
+
+
+def test_rerun_after_completion_fetches_only_new_bars():
+    storage = CheckpointStorage()
+    backfill, client = make_backfill(storage)
+    now = datetime.now(UTC).replace(minute=0, second=0, microsecond=0)
+    start, first_end = now - timedelta(days=2), now - timedelta(days=1)
+    asyncio.run(backfill.backfill([stock()], '1 hour', start, first_end))
+    first_bars = len(storage.bars)
+    assert first_bars == 24
+
+    asyncio.run(backfill.backfill([stock()], '1 hour', start))
+
+    new_rows = storage.bars[first_bars:]
+    assert len(client.requests) == 2
+    assert len(new_rows) == 24
+    assert min(row['time'] for row in new_rows) >= first_end
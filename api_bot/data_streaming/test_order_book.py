@@ -0,0 +1,118 @@
+import math
+from ibapi.contract import Contract
+from data_streaming.order_book import OrderBook, OrderBookManager, ASK, BID, INSERT, UPDATE, DELETE, DEPTH_RESET
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def reqMktDepth(self, req_id, contract, depth, is_smart_depth, options):
+        self.calls.append(('reqMktDepth', req_id, contract.symbol))
+
+    def cancelMktDepth(self, req_id, is_smart_depth):
+        self.calls.append(('cancelMktDepth', req_id))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.client = FakeClient()
+        self.handlers = {}
+        self._next_id = 1
+
+    def register_request(self, handler):
+        req_id, self._next_id = self._next_id, self._next_id + 1
+        self.handlers[req_id] = handler
+        return req_id
+
+    def unregister_request(self, req_id):
+        self.handlers.pop(req_id, None)
+
+
+def stock(symbol, con_id=0):
+    contract = Contract()
+    contract.symbol, contract.secType, contract.currency, contract.exchange = symbol, 'STK', 'USD', 'SMART'
+    contract.conId = con_id
+    return contract
+
+
+def bids(book):
+    return [price for price in book.prices[BID] if not math.isnan(price)]
+
+
+def test_insert_shifts_levels_down():
+    book = OrderBook(depth=4)
+    for position, price in enumerate((10.0, 9.0, 8.0)):
+        book.apply(position, INSERT, BID, price, 1)
+    book.apply(0, INSERT, BID, 11.0, 2)
+    assert bids(book) == [11.0, 10.0, 9.0, 8.0]
+    assert book.levels[BID] == 4
+
+    # A full book drops its last level
+    book.apply(1, INSERT, BID, 10.5, 1)
+    assert bids(book) == [11.0, 10.5, 10.0, 9.0]
+    assert book.levels[BID] == 4
+
+
+def test_delete_shifts_levels_up():
+    book = OrderBook(depth=4)
+    for position, price in enumerate((10.0, 9.0, 8.0)):
+        book.apply(position, INSERT, BID, price, position + 1)
+    book.apply(0, DELETE, BID, 0, 0)
+    assert bids(book) == [9.0, 8.0]
+    assert list(book.sizes[BID]) == [2.0, 3.0, 0.0, 0.0]
+    assert book.levels[BID] == 2
+    # Deleting a level the book doesn't have is ignored
+    book.apply(3, DELETE, BID, 0, 0)
+    assert book.levels[BID] == 2
+
+
+def test_insert_or_update_past_the_last_level_extends_the_book():
+    book = OrderBook(depth=4)
+    book.apply(2, INSERT, ASK, 20.0, 5)
+    assert book.levels[ASK] == 3
+    assert book.prices[ASK, 2] == 20.0
+    book.apply(3, UPDATE, ASK, 21.0, 5)
+    assert book.levels[ASK] == 4
+    # Beyond the book's depth
+    book.apply(4, INSERT, ASK, 22.0, 5)
+    assert book.levels[ASK] == 4
+
+
+def test_top_of_book_figures():
+    book = OrderBook(depth=2)
+    book.apply(0, INSERT, BID, 99.0, 300)
+    book.apply(0, INSERT, ASK, 101.0, 100)
+    assert book.mid() == 100.0
+    assert book.spread() == 2.0
+    assert book.imbalance() == 0.5
+    assert book.microprice() == 100.5
+
+
+def test_manager_keeps_a_book_per_contract_key():
+    connection = FakeConnection()
+    manager = OrderBookManager(connection, depth=2)
+    # Unresolved contracts all have conId 0 but must not share a book
+    aapl = manager.subscribe(stock('AAPL'))
+    msft = manager.subscribe(stock('MSFT'))
+    assert aapl is not msft
+    assert manager.subscribe(stock('AAPL')) is aapl
+    assert [call[0] for call in connection.client.calls] == ['reqMktDepth', 'reqMktDepth']
+
+    manager.updateMktDepth(1, 0, INSERT, BID, 150.0, 10)
+    assert aapl.best()[0] == 150.0 and math.isnan(msft.best()[0])
+
+    manager.unsubscribe(stock('AAPL'))
+    assert connection.client.calls[-1] == ('cancelMktDepth', 1)
+    assert 1 not in connection.handlers
+    assert manager.subscribe(stock('MSFT')) is msft
+
+
+def test_depth_reset_clears_the_book():
+    manager = OrderBookManager(FakeConnection(), depth=2)
+    book = manager.subscribe(stock('AAPL', con_id=265598))
+    assert manager.book(265598) is book
+    manager.updateMktDepth(1, 0, INSERT, ASK, 151.0, 10)
+    manager.error(1, DEPTH_RESET, "Market depth data has been RESET")
+    assert book.levels == [0, 0]
+    assert math.isnan(book.best()[2])
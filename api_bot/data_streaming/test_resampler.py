@@ -0,0 +1,63 @@
+import pytest
+from data_streaming.resampler import BarResampler
+
+
+def collect(timeframes):
+    emitted = []
+    resampler = BarResampler(lambda key, label, bar: emitted.append((key, label, bar)), base_seconds=5,
+                             timeframes=timeframes)
+    return resampler, emitted
+
+
+def test_minute_bar_from_twelve_base_bars():
+    resampler, emitted = collect({'1 min': 60})
+    for i in range(12):
+        price = 100.0 + i
+        resampler.update(1, 600 + 5 * i, price, price + 2, price - 1, price + 1, 10, price, 3)
+        if i < 11:
+            assert emitted == []
+            assert resampler.current(1, '1 min').close == price + 1
+
+    [(key, label, bar)] = emitted
+    assert (key, label, bar.start, bar.end) == (1, '1 min', 600, 660)
+    assert (bar.open, bar.high, bar.low, bar.close) == (100.0, 113.0, 99.0, 112.0)
+    assert bar.volume == 120
+    assert bar.count == 36
+    assert bar.wap == pytest.approx(105.5)
+    assert resampler.current(1, '1 min') is None
+
+
+def test_gap_emits_the_unfinished_bar():
+    resampler, emitted = collect({'1 min': 60})
+    resampler.update(1, 600, 1.0, 1.0, 1.0, 1.0, 1, 1.0, 1)
+    resampler.update(1, 725, 2.0, 2.0, 2.0, 2.0, 1, 2.0, 1)
+    assert [bar.start for _, _, bar in emitted] == [600]
+    assert resampler.current(1, '1 min').start == 720
+
+
+def test_timeframes_are_independent_per_key():
+    resampler, emitted = collect({'1 min': 60, '5 mins': 300})
+    for i in range(60):
+        resampler.update('a', 5 * i, 1.0, 1.0, 1.0, 1.0, 1, 1.0, 1)
+    resampler.update('b', 0, 1.0, 1.0, 1.0, 1.0, 1, 1.0, 1)
+    labels = [label for key, label, _ in emitted if key == 'a']
+    assert labels.count('1 min') == 5
+    assert labels.count('5 mins') == 1
+    assert all(key == 'a' for key, _, _ in emitted)
+
+
+def test_negative_volume_counts_as_zero():
+    resampler, _ = collect({'1 min': 60})
+    resampler.update(1, 0, 1.0, 1.0, 1.0, 1.5, -1, 1.0, 0)
+    bar = resampler.current(1, '1 min')
+    assert bar.volume == 0
+    assert bar.wap == 1.5
+
+
+def test_failing_callback_does_not_break_updates():
+    def on_bar(key, label, bar):
+        raise ValueError("sink down")
+    resampler = BarResampler(on_bar, timeframes={'1 min': 60})
+    for i in range(13):
+        resampler.update(1, 5 * i, 1.0, 1.0, 1.0, 1.0, 1, 1.0, 1)
+    assert resampler.current(1, '1 min').start == 60
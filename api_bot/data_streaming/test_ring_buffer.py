@@ -0,0 +1,61 @@
+from data_streaming.ring_buffer import BarRingBuffer
+
+
+def append(ring, *times):
+    for time in times:
+        ring.append(time, 1.0, 2.0, 0.5, 1.5, 10.0, 1.2, 3)
+
+
+def test_latest_returns_oldest_first():
+    ring = BarRingBuffer(capacity=4)
+    assert len(ring.latest()) == 0
+    append(ring, 1, 2, 3)
+    assert list(ring.latest()['time']) == [1, 2, 3]
+    assert list(ring.latest(2)['time']) == [2, 3]
+    assert ring.latest()[0]['close'] == 1.5
+
+
+def test_latest_zero_or_negative_is_empty():
+    ring = BarRingBuffer(capacity=4)
+    append(ring, 1, 2, 3)
+    assert len(ring.latest(0)) == 0
+    assert len(ring.latest(-2)) == 0
+    assert list(ring.latest(10)['time']) == [1, 2, 3]
+
+
+def test_wraps_around_overwriting_the_oldest():
+    ring = BarRingBuffer(capacity=4)
+    append(ring, *range(1, 8))
+    assert len(ring) == 4
+    assert list(ring.latest()['time']) == [4, 5, 6, 7]
+
+
+def test_since_resumes_from_the_returned_sequence():
+    ring = BarRingBuffer(capacity=4)
+    append(ring, 1, 2)
+    bars, sequence = ring.since(0)
+    assert list(bars['time']) == [1, 2]
+    bars, sequence = ring.since(sequence)
+    assert len(bars) == 0
+    append(ring, 3)
+    bars, sequence = ring.since(sequence)
+    assert list(bars['time']) == [3]
+    assert sequence == 3
+
+
+def test_slow_reader_skips_overwritten_bars():
+    ring = BarRingBuffer(capacity=4)
+    append(ring, 1, 2)
+    _, sequence = ring.since(0)
+    append(ring, *range(3, 10))
+    bars, sequence = ring.since(sequence)
+    assert list(bars['time']) == [6, 7, 8, 9]
+    assert sequence == 9
+
+
+def test_returned_bars_are_copies():
+    ring = BarRingBuffer(capacity=2)
+    append(ring, 1, 2)
+    bars = ring.latest()
+    append(ring, 3, 4)
+    assert list(bars['time']) == [1, 2]
@@ -0,0 +1,116 @@
+import pytest
+from ibapi.contract import Contract
+from data_streaming.subscriptions import MarketDataSubscriptionManager, LineBudgetExceeded, TICKS, BARS
+
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda req_id, *args: self.calls.append((name, req_id))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.client = RecordingClient()
+        self.registered = set()
+        self._next_id = 1
+
+    def register_request(self, handler):
+        req_id, self._next_id = self._next_id, self._next_id + 1
+        self.registered.add(req_id)
+        return req_id
+
+    def unregister_request(self, req_id):
+        self.registered.discard(req_id)
+
+
+class Handler:
+    def __init__(self):
+        self.prices = []
+
+    def tickPrice(self, con_id, tick_type, price, attrib):
+        self.prices.append((con_id, price))
+
+
+def stock(symbol, con_id):
+    contract = Contract()
+    contract.symbol, contract.secType, contract.currency, contract.exchange = symbol, 'STK', 'USD', 'SMART'
+    contract.conId = con_id
+    return contract
+
+
+AAPL, MSFT, IBM = stock('AAPL', 1), stock('MSFT', 2), stock('IBM', 3)
+
+
+def test_subscribers_share_one_subscription():
+    connection = FakeConnection()
+    manager = MarketDataSubscriptionManager(connection)
+    first, second = Handler(), Handler()
+    assert manager.subscribe(AAPL, TICKS, first) == 1
+    manager.subscribe(AAPL, TICKS, second)
+    assert connection.client.calls == [('reqMktData', 1)]
+
+    manager.tickPrice(1, 4, 150.0, None)
+    assert first.prices == second.prices == [(1, 150.0)]
+    assert manager.line_usage()['used'] == 1
+
+
+def test_released_subscription_stays_idle_until_reused():
+    connection = FakeConnection()
+    manager = MarketDataSubscriptionManager(connection)
+    handler = Handler()
+    manager.subscribe(AAPL, TICKS, handler)
+    manager.unsubscribe(AAPL, TICKS, handler)
+    assert manager.line_usage()['idle'] == 1
+
+    manager.subscribe(AAPL, TICKS, Handler())
+    assert connection.client.calls == [('reqMktData', 1)]
+    assert manager.line_usage()['idle'] == 0
+
+
+def test_least_recently_released_idle_subscription_is_evicted():
+    connection = FakeConnection()
+    manager = MarketDataSubscriptionManager(connection, line_budget=2)
+    aapl, msft = Handler(), Handler()
+    manager.subscribe(AAPL, TICKS, aapl)
+    manager.subscribe(MSFT, TICKS, msft)
+    manager.unsubscribe(AAPL, TICKS, aapl)
+    manager.unsubscribe(MSFT, TICKS, msft)
+
+    manager.subscribe(IBM, TICKS, Handler())
+    assert ('cancelMktData', 1) in connection.client.calls
+    assert ('cancelMktData', 2) not in connection.client.calls
+    assert connection.registered == {2, 3}
+    usage = manager.line_usage()
+    assert (usage['used'], usage['idle'], usage['evictions']) == (2, 1, 1)
+
+
+def test_over_budget_subscribe_evicts_nothing():
+    connection = FakeConnection()
+    manager = MarketDataSubscriptionManager(connection, line_budget=2, line_costs={TICKS: 1, BARS: 2})
+    idle = Handler()
+    manager.subscribe(AAPL, TICKS, Handler())
+    manager.subscribe(MSFT, TICKS, idle)
+    manager.unsubscribe(MSFT, TICKS, idle)
+
+    # Evicting MSFT would still leave too few lines for a bar subscription
+    with pytest.raises(LineBudgetExceeded):
+        manager.subscribe(IBM, BARS, Handler())
+    assert connection.client.calls == [('reqMktData', 1), ('reqMktData', 2)]
+    assert connection.registered == {1, 2}
+    usage = manager.line_usage()
+    assert (usage['used'], usage['idle'], usage['evictions']) == (2, 1, 0)
+
+
+def test_expire_idle_cancels_old_idle_subscriptions():
+    connection = FakeConnection()
+    manager = MarketDataSubscriptionManager(connection, idle_timeout=0.0001)
+    handler = Handler()
+    manager.subscribe(AAPL, BARS, handler)
+    manager.unsubscribe(AAPL, BARS, handler)
+    manager.subscriptions[(1, BARS, None)].released_at -= 1
+    assert manager.expire_idle() == 1
+    assert connection.client.calls == [('reqRealTimeBars', 1), ('cancelRealTimeBars', 1)]
+    assert manager.line_usage()['used'] == 0
@@ -1,46 +1,95 @@
 import asyncio
-from ibapi.client import EClient
-from ibapi.wrapper import EWrapper
+import signal
 from connection.ib_connection import IBConnection
+from connection.recording import CallbackRecorder
 from contracts.contract_builder import ContractBuilder
+from contracts.contract_registry import ContractRegistry
 from data_streaming.real_time_data import RealTimeDataStream
+from data_streaming.subscriptions import MarketDataSubscriptionManager
 from order_execution.executor import OrderExecutor
+from order_execution.execution_capture import ExecutionCapture
 
 from application_statistics.stats_summ_new import StatsManager
 from application_statistics.account_portfolio import PortfolioManager
 
-from data_storage.postgresql_client import PostgresqlClient
+from data_storage.async_postgresql_client import AsyncPostgresqlClient
+from data_storage.write_buffer import WriteBehindBuffer
+from data_storage.columnar_archive import ColumnarArchive
 from utilsL.logging_config import (setup_logging, get_logger, log_time)
+from utilsL.instrumentation import metrics
+from utilsL.tracing import tracer
 
 
-class TradingApp(EWrapper, EClient):
-    def __init__(self):
-        EClient.__init__(self, self)
+class TradingApp:
+    def __init__(self, host='127.0.0.1', port=4002, client_id=120, storage_manager=None, cycle_interval=60,
+                 record_dir=None, trace_file='latency_traces.jsonl', universe=()):
         self.logger = get_logger(__name__)
-        self.connection = IBConnection(self)
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.cycle_interval = cycle_interval
+        # Contract specs (e.g. from ContractBuilder) streamed from startup, once resolved to conIds
+        self.universe = list(universe)
+        self.contracts = {}
+        # One socket to the gateway; every component subscribes to its dispatcher
+        self.connection = IBConnection()
         self.contract_builder = ContractBuilder()
-        self.data_stream = RealTimeDataStream(self)
-        self.order_executor = OrderExecutor(self)
-        self.storage_manager = PostgresqlClient(db_name='test', db_user='myuser', db_password='kchau99', is_test_mode=False, use_local=True)
-        self.stats_manager = StatsManager('127.0.0.1', 4002, 123, self.storage_manager)
-        self.portfolio_manager = PortfolioManager('127.0.0.1', 4002, 122, self.storage_manager)
+        self.storage_manager = storage_manager or AsyncPostgresqlClient(db_name='test', db_user='myuser', db_password='kchau99', is_test_mode=False)
+        # Specs from the builder resolve to full ContractDetails (cached in memory and Postgres)
+        self.contract_registry = ContractRegistry(self.connection, self.storage_manager)
+        # Callback threads only queue rows; the buffer task batches them into Postgres
+        self.write_buffer = WriteBehindBuffer(self.storage_manager)
+        # Bars are also kept on local disk as Arrow files for research/backtests
+        self.archive = ColumnarArchive('archive')
+        # Market data lines are shared between components and budgeted
+        self.subscriptions = MarketDataSubscriptionManager(self.connection, line_budget=100)
+        self.data_stream = RealTimeDataStream(self.connection, self.write_buffer, archive=self.archive,
+                                              subscriptions=self.subscriptions)
+        self.order_executor = OrderExecutor(self.connection, contract_registry=self.contract_registry)
+        self.execution_capture = ExecutionCapture(self.connection, self.write_buffer)
+        self.stats_manager = StatsManager(self.connection, self.storage_manager, self.write_buffer)
+        self.portfolio_manager = PortfolioManager(self.connection, self.storage_manager, self.write_buffer)
+        # Optionally capture every inbound callback for replay (see connection/recording.py)
+        self.recorder = CallbackRecorder(record_dir) if record_dir else None
+        # Callback-to-commit stage latencies per table are appended here (None to disable)
+        self.trace_file = trace_file
         self.tasks = []
 
     @log_time
     async def run(self):
         try:
-            await self.connection.connect('127.0.0.1', 4002, 120)
+            await self.storage_manager.acquire(self)
+            if self.recorder is not None:
+                self.connection.add_tap(self.recorder.record)
+            await self.connection.connect(self.host, self.port, self.client_id)
+            await self.execution_capture.backfill()
+            contracts = await self.resolve_universe()
+            try:
+                # `kill -USR1 <pid>` logs the latency histograms on demand
+                asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, metrics.dump)
+            except (AttributeError, NotImplementedError):
+                pass
             
 
 
             # Add other tasks if needed
             self.tasks = [
-                self.create_task(self.stats_manager.run_periodically(60), "Stats Manager"),
-                self.create_task(self.portfolio_manager.run_periodically(60), "Portfolio Manager"),
-                # self.create_task(self.data_stream.stream_real_time_data(contract), "Data Stream"),
+                self.create_task(self.write_buffer.run(), "Write Buffer"),
+                self.create_task(self.storage_manager.maintain_partitions(), "Partition Maintenance"),
+                self.create_task(self.archive.run(), "Archive"),
+                self.create_task(self.execution_capture.run(), "Execution Capture"),
+                self.create_task(self.subscriptions.run(), "Subscriptions"),
+                self.create_task(self.stats_manager.run_periodically(self.cycle_interval), "Stats Manager"),
+                self.create_task(self.portfolio_manager.run_periodically(self.cycle_interval), "Portfolio Manager"),
+                self.create_task(metrics.run(300), "Metrics"),
                 # self.create_task(self.storage_manager.periodic_save(3600), "Storage Manager"),
             ]
 
+            if contracts:
+                self.tasks.append(self.create_task(self.data_stream.stream_real_time_data(contracts), "Data Stream"))
+            if self.trace_file:
+                self.tasks.append(self.create_task(tracer.run(self.trace_file, 300), "Span Tracing"))
+
             # Run all tasks concurrently
             if self.tasks:
                 await asyncio.gather(*[task for task, _ in self.tasks], return_exceptions=True)
@@ -54,6 +103,20 @@ class TradingApp(EWrapper, EClient):
 
 
 
+    async def resolve_universe(self):
+        """Resolve the universe specs to full contracts; known ones come from the registry's cache."""
+        if not self.universe:
+            return []
+        contracts = []
+        for spec, matches in zip(self.universe, await self.contract_registry.resolve_many(self.universe)):
+            if len(matches) != 1:
+                self.logger.error(f"Not streaming {spec.symbol} {spec.secType}: spec matched {len(matches)} contracts")
+                continue
+            contracts.append(matches[0].contract)
+        self.contracts = {contract.conId: contract for contract in contracts}
+        self.logger.info(f"Resolved {len(contracts)}/{len(self.universe)} universe contracts")
+        return contracts
+
     def create_task(self, coro, name):
         task = asyncio.create_task(coro, name=name)
         task.add_done_callback(self.handle_task_result)
@@ -79,14 +142,20 @@ class TradingApp(EWrapper, EClient):
         
         await asyncio.gather(*[task for task, _ in self.tasks], return_exceptions=True)
 
+        self.order_executor.cleanup()
+        self.execution_capture.cleanup()
         await self.portfolio_manager.cleanup()
         await self.stats_manager.cleanup()
-        await self.storage_manager.close()
+        await self.storage_manager.release(self)
         await self.connection.disconnect()
+        if self.recorder is not None:
+            self.connection.remove_tap(self.recorder.record)
+            await asyncio.to_thread(self.recorder.close)
 
 
 
 if __name__ == "__main__":
-    setup_logging()
+    # ibapi logs every callback that reaches EWrapper at INFO ("ANSWER ..."); keep that to a trickle
+    setup_logging(rate=100, burst=200, rates={'ibapi.wrapper': 5})
     app = TradingApp()
     asyncio.run(app.run())
\ No newline at end of file
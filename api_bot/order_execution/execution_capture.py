@@ -0,0 +1,211 @@
+import asyncio
+import collections
+import logging
+import threading
+import time
+from ibapi.common import UNSET_DOUBLE
+from ibapi.execution import ExecutionFilter
+from connection.async_bridge import PendingRequests, IBRequestError
+
+
+SIDES = {'BOT': 'BUY', 'SLD': 'SELL'}
+
+
+def _value(value):
+    # IB leaves fields it has no value for (e.g. realizedPNL on an opening fill) at UNSET_DOUBLE
+    return None if value == UNSET_DOUBLE else value
+
+
+def execution_row(contract, execution):
+    return {
+        'Symbol': contract.symbol,
+        'Exchange': execution.exchange or contract.exchange,
+        'Currency': contract.currency,
+        'SecType': contract.secType,
+        'ConId': contract.conId,
+        'LocalSymbol': contract.localSymbol,
+        'TradingClass': contract.tradingClass,
+        'Action': SIDES.get(execution.side, execution.side),
+        'OrderId': execution.orderId,
+        'ClientId': execution.clientId,
+        'PermId': execution.permId,
+        'AvgFillPrice': execution.avgPrice,
+        'FillTime': execution.time,
+        'FillQuantity': float(execution.shares),
+        'FillPrice': execution.price,
+        'ExecId': execution.execId,
+        'AcctNumber': execution.acctNumber,
+        'CumQty': float(execution.cumQty),
+        'OrderRef': execution.orderRef,
+        'EvRule': execution.evRule,
+        'EvMultiplier': _value(execution.evMultiplier),
+        'ModelCode': execution.modelCode,
+        'LastLiquidity': execution.lastLiquidity,
+    }
+
+
+COMMISSION_COLUMNS = ('Commission', 'CommissionCurrency', 'RealizedPNL', 'Yield', 'YieldRedemptionDate')
+
+
+def add_commission(row, report):
+    row.update({
+        'Commission': _value(report.commission),
+        'CommissionCurrency': report.currency,
+        'RealizedPNL': _value(report.realizedPNL),
+        'Yield': _value(report.yield_),
+        'YieldRedemptionDate': str(report.yieldRedemptionDate) if report.yieldRedemptionDate else None,
+    })
+    return row
+
+
+class ExecutionCapture:
+    """Streams executions into account_trades, joined with their commission reports.
+
+    execDetails and commissionReport arrive separately, keyed by execId.
+    An execution waits in a bounded, insertion-ordered index until its report
+    arrives; then the joined row goes to the write buffer. Executions whose
+    report does not come within `commission_timeout` seconds, or that are
+    pushed out when more than `max_pending` are waiting, are written without
+    commission. Reports that arrive before their execution are held the same
+    way, and a report arriving after its execution was written without one
+    upserts the joined row (the last `max_pending` such executions are kept
+    for this). The unique ExecId index on account_trades keeps rows from a live
+    fill and a reqExecutions backfill of the same fill from doubling up."""
+
+    TABLE_NAME = 'account_trades'
+
+    def __init__(self, connection, write_buffer, fill_store=None, commission_timeout=30,
+                 max_pending=10000, recent_exec_ids=100000):
+        self.logger = logging.getLogger(__name__)
+        self.connection = connection
+        self.write_buffer = write_buffer
+        self.fill_store = fill_store
+        self.commission_timeout = commission_timeout
+        self.max_pending = max_pending
+        self.recent_exec_ids = recent_exec_ids
+        self.pending = PendingRequests()
+        self._lock = threading.Lock()
+        self._executions = collections.OrderedDict()
+        self._reports = collections.OrderedDict()
+        self._written = collections.OrderedDict()
+        # Rows written without commission, for reports that turn up late
+        self._uncommissioned = collections.OrderedDict()
+        self.rows_written = 0
+        self.rows_without_commission = 0
+        self.late_commissions = 0
+        connection.subscribe(self)
+
+    async def backfill(self, exec_filter=None, timeout=30):
+        """Capture the executions the gateway still has (today's, by default) via reqExecutions."""
+        req_id = self.connection.register_request(self)
+        completed = self.pending.create(req_id)
+        try:
+            self.connection.client.reqExecutions(req_id, exec_filter or ExecutionFilter())
+            await asyncio.wait_for(completed, timeout)
+            self.logger.info(f"Execution backfill complete, {len(self._executions)} awaiting commission reports")
+        except (asyncio.TimeoutError, IBRequestError) as e:
+            self.logger.error(f"Execution backfill failed: {str(e) or 'timeout'}")
+        finally:
+            self.pending.discard(req_id)
+            self.connection.unregister_request(req_id)
+
+    async def run(self, interval=1.0):
+        """Write executions whose commission report is overdue."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.expire()
+        finally:
+            self.expire(force=True)
+
+    def expire(self, force=False):
+        deadline = time.monotonic() - self.commission_timeout
+        rows = []
+        with self._lock:
+            while self._executions:
+                exec_id, (row, received) = next(iter(self._executions.items()))
+                if not force and received > deadline:
+                    break
+                del self._executions[exec_id]
+                rows.append(row)
+            while self._reports:
+                exec_id, (report, received) = next(iter(self._reports.items()))
+                if not force and received > deadline:
+                    break
+                del self._reports[exec_id]
+        if rows:
+            self.logger.warning(f"Writing {len(rows)} executions without a commission report")
+            self.rows_without_commission += len(rows)
+            self._write(rows, commissioned=False)
+
+    def _write(self, rows, commissioned=True):
+        with self._lock:
+            for row in rows:
+                self._written[row['ExecId']] = None
+                if not commissioned:
+                    self._uncommissioned[row['ExecId']] = row
+            while len(self._written) > self.recent_exec_ids:
+                self._written.popitem(last=False)
+            while len(self._uncommissioned) > self.max_pending:
+                self._uncommissioned.popitem(last=False)
+        self.write_buffer.put(self.TABLE_NAME, rows)
+        self.rows_written += len(rows)
+        if self.fill_store is not None:
+            for row in rows:
+                self.fill_store.append(row)
+
+    def cleanup(self):
+        self.connection.unsubscribe(self)
+
+
+
+    def execDetails(self, reqId, contract, execution):
+        exec_id = execution.execId
+        row = execution_row(contract, execution)
+        evicted = []
+        with self._lock:
+            if exec_id in self._written or exec_id in self._executions:
+                return
+            report = self._reports.pop(exec_id, None)
+            if report is None:
+                self._executions[exec_id] = (row, time.monotonic())
+                while len(self._executions) > self.max_pending:
+                    evicted.append(self._executions.popitem(last=False)[1][0])
+        if report is not None:
+            self._write([add_commission(row, report[0])])
+        if evicted:
+            self.rows_without_commission += len(evicted)
+            self._write(evicted, commissioned=False)
+
+    def execDetailsEnd(self, reqId):
+        self.pending.resolve(reqId)
+
+    def commissionReport(self, commissionReport):
+        exec_id = commissionReport.execId
+        late = None
+        with self._lock:
+            if exec_id in self._written:
+                late = self._uncommissioned.pop(exec_id, None)
+                if late is None:
+                    return
+                pending = None
+            else:
+                pending = self._executions.pop(exec_id, None)
+                if pending is None:
+                    self._reports[exec_id] = (commissionReport, time.monotonic())
+                    while len(self._reports) > self.max_pending:
+                        self._reports.popitem(last=False)
+        if late is not None:
+            self._write_late_commission(add_commission(dict(late), commissionReport))
+        if pending is not None:
+            self._write([add_commission(pending[0], commissionReport)])
+
+    def _write_late_commission(self, row):
+        # The whole row, so it is complete even if this upsert commits before the original insert
+        self.write_buffer.put(self.TABLE_NAME, [row], upsert_on=('ExecId',))
+        self.late_commissions += 1
+        if self.fill_store is not None:
+            self.fill_store.update(row['ExecId'], **{name: row[name] for name in COMMISSION_COLUMNS})
+
+    def error(self, reqId, errorCode, errorString):
+        self.pending.reject(reqId, IBRequestError(reqId, errorCode, errorString))
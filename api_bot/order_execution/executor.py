@@ -1,44 +1,147 @@
-from ibapi.order import Order
 import logging
+import threading
+from ibapi.order import Order
+from order_execution.order_handle import OrderHandle
+from order_execution.order_ids import OrderIdAllocator
+
 
 class OrderExecutor:
-    def __init__(self, app):
-        self.app = app
-        self.logger = logging.getLogger(__name__)
+    """Places orders over the shared connection and returns an OrderHandle per order.
 
-    def place_market_order(self, contract, action, quantity):
-        try:
-            order = Order()
-            order.action = action
-            order.orderType = "MKT"
-            order.totalQuantity = quantity
+    The executor subscribes to the dispatcher's order callbacks (orderStatus,
+    openOrder, execDetails, commissionReport and errors carrying an order id)
+    and forwards them to the handle of the order, so strategies can await
+    acknowledgement, fills or cancellation instead of polling. With a
+    ContractRegistry, orders can name their instrument by conId."""
 
-            self.app.placeOrder(self.app.nextOrderId(), contract, order)
-            self.logger.info(f"Placed market order: {action} {quantity} {contract.symbol}")
+    def __init__(self, connection, order_ids=None, contract_registry=None):
+        self.connection = connection
+        self.contract_registry = contract_registry
+        self.logger = logging.getLogger(__name__)
+        self.order_ids = order_ids or OrderIdAllocator()
+        self.orders = {}
+        self.orders_by_exec_id = {}
+        self._lock = threading.Lock()
+        connection.subscribe(self.order_ids)
+        connection.subscribe(self)
+
+    async def wait_until_ready(self, timeout=10):
+        """Wait for the first nextValidId after connecting."""
+        await self.order_ids.wait_seeded(timeout)
+
+    def place_order(self, contract, order):
+        """Send an order for a Contract, or a conId already resolved by the registry;
+        must be called on the event loop. Returns its OrderHandle."""
+        if isinstance(contract, int):
+            contract = self._resolved(contract)
+        try:
+            order_id = self.order_ids.next_id()
+            order.orderId = order_id
+            handle = OrderHandle(order_id, contract, order)
+            with self._lock:
+                self.orders[order_id] = handle
+            handle.mark_sent()
+            self.connection.client.placeOrder(order_id, contract, order)
+            self.logger.info(f"Placed {order.orderType} order {order_id}: {order.action} {order.totalQuantity} {contract.symbol}")
+            return handle
         except Exception as e:
-            self.logger.error(f"Failed to place market order: {str(e)}")
+            self.logger.error(f"Failed to place {order.orderType} order: {str(e)}")
+            raise
 
-    # Add methods for other order types
+    def _resolved(self, con_id):
+        contract = self.contract_registry.contract(con_id) if self.contract_registry is not None else None
+        if contract is None:
+            raise LookupError(f"conId {con_id} is not resolved; resolve it through the ContractRegistry first")
+        return contract
+
+    def place_market_order(self, contract, action, quantity):
+        order = Order()
+        order.action = action
+        order.orderType = "MKT"
+        order.totalQuantity = quantity
+        return self.place_order(contract, order)
+
+    def place_limit_order(self, contract, action, quantity, limit_price, tif="DAY"):
+        order = Order()
+        order.action = action
+        order.orderType = "LMT"
+        order.totalQuantity = quantity
+        order.lmtPrice = limit_price
+        order.tif = tif
+        return self.place_order(contract, order)
+
+    def place_stop_order(self, contract, action, quantity, stop_price, tif="DAY"):
+        order = Order()
+        order.action = action
+        order.orderType = "STP"
+        order.totalQuantity = quantity
+        order.auxPrice = stop_price
+        order.tif = tif
+        return self.place_order(contract, order)
+
+    def cancel_order(self, handle):
+        order_id = handle.order_id if isinstance(handle, OrderHandle) else handle
+        self.connection.client.cancelOrder(order_id)
+        return self.orders.get(order_id)
+
+    def latencies(self):
+        """(order_id, ack latency, fill latency) for every order placed this session."""
+        return [(handle.order_id, handle.ack_latency, handle.fill_latency) for handle in list(self.orders.values())]
+
+    def cleanup(self):
+        self.connection.unsubscribe(self)
+        self.connection.unsubscribe(self.order_ids)
+
+
+
+    def orderStatus(self, orderId, status, filled, remaining, avgFillPrice, permId,
+                    parentId, lastFillPrice, clientId, whyHeld, mktCapPrice):
+        handle = self.orders.get(orderId)
+        if handle is not None:
+            handle.on_status(status, filled, remaining, avgFillPrice, permId, lastFillPrice)
+            if handle.is_done:
+                self.logger.info(f"Order {orderId} {status}: filled {filled} @ {avgFillPrice}, "
+                                 f"ack {handle.ack_latency}s, fill {handle.fill_latency}s")
+
+    def openOrder(self, orderId, contract, order, orderState):
+        handle = self.orders.get(orderId)
+        if handle is not None:
+            handle.on_open_order(order, orderState)
+
+    def execDetails(self, reqId, contract, execution):
+        handle = self.orders.get(execution.orderId)
+        if handle is not None:
+            with self._lock:
+                self.orders_by_exec_id[execution.execId] = handle
+            handle.on_execution(execution)
+
+    def commissionReport(self, commissionReport):
+        handle = self.orders_by_exec_id.get(commissionReport.execId)
+        if handle is not None:
+            handle.on_commission(commissionReport)
+
+    def error(self, reqId, errorCode, errorString):
+        handle = self.orders.get(reqId)
+        if handle is not None:
+            handle.on_error(errorCode, errorString)
 
 
 
 
-import pandas as pd
 from datetime import datetime
+from order_execution.fill_store import FillStore
+
 
 class LimitOrderTracker:
-    def __init__(self):
-        self.df = pd.DataFrame(columns=[
-            'Symbol', 'Exchange', 'Currency', 'SecType', 'ConId', 'LocalSymbol', 'TradingClass',
-            'Action', 'Quantity', 'OrderType', 'LimitPrice', 'TimeInForce',
-            'OrderId', 'ClientId', 'PermId', 'AuxPrice',
-            'Status', 'Filled', 'Remaining', 'AvgFillPrice', 'LastFillPrice',
-            'ParentId', 'WhyHeld', 'MktCapPrice',
-            'FillTime', 'FillQuantity', 'FillPrice', 'Commission',
-            'ExecId', 'AcctNumber', 'CumQty', 'OrderRef', 'EvRule', 'EvMultiplier', 'ModelCode', 'LastLiquidity',
-            'RealizedPNL', 'Yield', 'YieldRedemptionDate',
-            'InitOrderTime', 'ExecutionTime',
-        ])
+    """Collects filled trades (ib_insync Trade objects) into a FillStore."""
+
+    def __init__(self, fill_store=None):
+        self.logger = logging.getLogger(__name__)
+        self.fills = fill_store or FillStore()
+
+    @property
+    def df(self):
+        return self.fills.to_frame()
 
     def format_time(self, time_input):
         if isinstance(time_input, datetime):
@@ -74,12 +177,12 @@ class LimitOrderTracker:
             'ParentId': trade.orderStatus.parentId,
             'WhyHeld': trade.orderStatus.whyHeld,
             'MktCapPrice': trade.orderStatus.mktCapPrice,
-            'InitOrderTime': execution_time if isinstance(execution_time, str) else f"{execution_time:.3f}",
+            'InitOrderTime': init_order_time if isinstance(init_order_time, str) else f"{init_order_time:.3f}",
             'ExecutionTime': execution_time if isinstance(execution_time, str) else f"{execution_time:.3f}"
 
         }
 
-        new_rows = []
+        added = 0
         for fill in trade.fills:
             fill_info = trade_info.copy()
             fill_info.update({
@@ -99,18 +202,18 @@ class LimitOrderTracker:
                 'Yield': fill.commissionReport.yield_,
                 'YieldRedemptionDate': fill.commissionReport.yieldRedemptionDate
             })
-            new_rows.append(fill_info)
-
-        new_df = pd.DataFrame(new_rows)
-        self.df = pd.concat([self.df, new_df], ignore_index=True)
+            added += self.fills.append(fill_info)
+        return added
 
     def save_to_csv(self):
         filename = f"trade_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         self.df.to_csv(filename, index=False)
-        print(f"Trade log saved to {filename}")
-
-# Usage:
-tracker = LimitOrderTracker()
-
-# To save the current state of the DataFrame:
-#tracker.save_to_csv()
\ No newline at end of file
+        self.logger.info(f"Trade log saved to {filename}")
+
+    def flush(self, write_buffer=None, parquet_dir=None):
+        """Hand the fills added since the last flush to account_trades and/or Parquet."""
+        if write_buffer is not None:
+            self.fills.flush_to_buffer(write_buffer)
+        if parquet_dir is not None:
+            self.fills.flush_parquet(parquet_dir)
+        self.fills.discard_flushed()
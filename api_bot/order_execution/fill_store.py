@@ -0,0 +1,202 @@
+import collections
+import os
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Float, Integer, BigInteger
+from data_storage.schemas import get_schema
+
+
+def _column_dtype(column):
+    if isinstance(column.type, Float):
+        return np.float64
+    if isinstance(column.type, (Integer, BigInteger)):
+        return np.int64
+    return object
+
+
+class FillStore:
+    """Append-only columnar store of fills, one row per execution.
+
+    Columns are the account_trades columns, each held in a preallocated
+    NumPy array (float64/int64 for numeric columns, object for strings) that
+    doubles when full, so append() is amortized O(1) and never copies the
+    existing rows per fill. ExecId is indexed for dedupe and for updating a
+    fill when its commission report arrives.
+
+    Rows are numbered by a sequence that keeps counting across discards.
+    Every sink in use (the account_trades table, Parquet files, ...) has a
+    watermark in that sequence; flush_* hands over the rows appended since
+    that sink's last flush plus any it already had that were update()d
+    since. A sink is tracked from its first flush, or from the start if
+    named in `sinks`. discard_flushed() drops rows every tracked sink has
+    taken, keeping memory flat over a long session; the last
+    `recent_exec_ids` dropped ExecIds are still deduplicated."""
+
+    TABLE_NAME = 'account_trades'
+
+    def __init__(self, capacity=1024, sinks=(), recent_exec_ids=100000):
+        self.columns = {column.name: _column_dtype(column) for column in get_schema(self.TABLE_NAME).columns}
+        self.capacity = capacity
+        self.size = 0
+        self.arrays = {name: self._empty(dtype, capacity) for name, dtype in self.columns.items()}
+        # Sequence number of the row at position 0
+        self.base = 0
+        self.exec_index = {}
+        self.recent_exec_ids = recent_exec_ids
+        self._discarded = collections.OrderedDict()
+        self.watermarks = {sink: 0 for sink in sinks}
+        # Per sink, sequence numbers below its watermark updated since it took them
+        self._dirty = {sink: set() for sink in sinks}
+        self._lock = threading.Lock()
+        self._parquet_parts = 0
+
+    @staticmethod
+    def _empty(dtype, capacity):
+        if dtype is np.float64:
+            return np.full(capacity, np.nan)
+        if dtype is np.int64:
+            return np.zeros(capacity, dtype=np.int64)
+        return np.full(capacity, None, dtype=object)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, exec_id):
+        return exec_id in self.exec_index or exec_id in self._discarded
+
+    def _grow(self):
+        self.capacity *= 2
+        for name, dtype in self.columns.items():
+            grown = self._empty(dtype, self.capacity)
+            grown[:self.size] = self.arrays[name][:self.size]
+            self.arrays[name] = grown
+
+    def append(self, fill):
+        """Add one fill (dict keyed by account_trades column). False if its ExecId was seen before."""
+        exec_id = fill.get('ExecId')
+        with self._lock:
+            if exec_id is not None and (exec_id in self.exec_index or exec_id in self._discarded):
+                return False
+            if self.size == self.capacity:
+                self._grow()
+            position = self.size
+            for name, value in fill.items():
+                if value is not None and name in self.arrays:
+                    self.arrays[name][position] = value
+            if exec_id is not None:
+                self.exec_index[exec_id] = self.base + position
+            self.size += 1
+            return True
+
+    def update(self, exec_id, **fields):
+        """Set fields on a held fill, e.g. Commission once the report arrives.
+
+        Sinks that already took the fill get it again on their next flush.
+        False if the fill is unknown or already discarded."""
+        with self._lock:
+            sequence = self.exec_index.get(exec_id)
+            if sequence is None:
+                return False
+            for name, value in fields.items():
+                self.arrays[name][sequence - self.base] = value
+            for sink, mark in self.watermarks.items():
+                if sequence < mark:
+                    self._dirty[sink].add(sequence)
+            return True
+
+    def _take(self, sink):
+        with self._lock:
+            if sink not in self.watermarks:
+                self.watermarks[sink] = self.base
+                self._dirty[sink] = set()
+            start, end = self.watermarks[sink], self.base + self.size
+            self.watermarks[sink] = end
+            new = {name: array[start - self.base:self.size].copy() for name, array in self.arrays.items()}
+            updated = sorted(self._dirty[sink])
+            self._dirty[sink] = set()
+            positions = [sequence - self.base for sequence in updated]
+            again = {name: array[positions] for name, array in self.arrays.items()}
+            return new, again, updated
+
+    def _rewind(self, sink, count, updated):
+        with self._lock:
+            self.watermarks[sink] -= count
+            self._dirty[sink].update(updated)
+
+    @staticmethod
+    def _rows(columns):
+        names = list(columns)
+        values = [columns[name].tolist() for name in names]
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+    def flush_to_buffer(self, write_buffer):
+        """Queue the fills appended since the last call for account_trades.
+
+        Fills updated after they were queued go again as upserts on ExecId."""
+        new, again, updated = self._take('account_trades')
+        rows = self._rows(new)
+        count = len(rows)
+        if updated and write_buffer.put(self.TABLE_NAME, self._rows(again), upsert_on=('ExecId',)) < len(updated):
+            # Offer every updated fill again next time; upserts are idempotent
+            self._rewind('account_trades', 0, updated)
+        if not count:
+            return 0
+        accepted = write_buffer.put(self.TABLE_NAME, rows)
+        if accepted < count:
+            # The buffer took a prefix; the rest is offered again next time
+            self._rewind('account_trades', count - accepted, ())
+        return accepted
+
+    def flush_parquet(self, directory):
+        """Write the fills appended or updated since the last call as a new Parquet file; returns its path.
+
+        An updated fill appears again in the later file, which supersedes the earlier row."""
+        new, again, updated = self._take('parquet')
+        count = len(next(iter(new.values())))
+        if not count and not updated:
+            return None
+        columns = {name: np.concatenate([again[name], new[name]]) for name in new}
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._parquet_parts += 1
+            path = os.path.join(directory, f"fills_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self._parquet_parts:04d}.parquet")
+            pq.write_table(pa.table({name: pa.array(array, from_pandas=True) for name, array in columns.items()}), path)
+            return path
+        except Exception:
+            self._rewind('parquet', count, updated)
+            raise
+
+    def discard_flushed(self):
+        """Drop rows every tracked sink has taken (and not had updated since), moving the rest to the front."""
+        with self._lock:
+            if not self.watermarks:
+                return 0
+            done = min(self.watermarks.values())
+            for dirty in self._dirty.values():
+                if dirty:
+                    done = min(done, min(dirty))
+            done -= self.base
+            if done <= 0:
+                return 0
+            for exec_id in self.arrays['ExecId'][:done]:
+                # Dropped fills stay deduplicated for a while, so replays are not stored twice
+                if exec_id is not None and self.exec_index.pop(exec_id, None) is not None:
+                    self._discarded[exec_id] = None
+            while len(self._discarded) > self.recent_exec_ids:
+                self._discarded.popitem(last=False)
+            remaining = self.size - done
+            for name, dtype in self.columns.items():
+                array = self.arrays[name]
+                array[:remaining] = array[done:self.size]
+                array[remaining:self.size] = self._empty(dtype, self.size - remaining)
+            self.size = remaining
+            self.base += done
+            return done
+
+    def to_frame(self):
+        with self._lock:
+            return pd.DataFrame({name: array[:self.size].copy() for name, array in self.arrays.items()})
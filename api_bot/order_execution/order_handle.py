@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+from connection.async_bridge import resolve_threadsafe, reject_threadsafe
+
+
+# Statuses sent before the order reaches the gateway's order book
+PENDING_STATUSES = {'PendingSubmit', 'ApiPending'}
+CANCELLED_STATUSES = {'Cancelled', 'ApiCancelled'}
+
+# Errors that mean the order will not be worked at all
+REJECTION_ERRORS = {103, 104, 105, 106, 107, 109, 110, 111, 200, 201, 203}
+
+
+class OrderError(Exception):
+    def __init__(self, order_id, status, message=""):
+        super().__init__(f"Order {order_id} ended {status}" + (f": {message}" if message else ""))
+        self.order_id = order_id
+        self.status = status
+        self.message = message
+
+
+def _consume_exception(future):
+    # A state that was never reached fails its future; nobody has to await it
+    if not future.cancelled():
+        future.exception()
+
+
+class OrderHandle:
+    """A placed order and awaitables for the states it goes through.
+
+    submitted        - the gateway acknowledged the order (first status past PendingSubmit)
+    partially_filled - the first execution arrived
+    filled           - the order is completely filled
+    cancelled        - the order was cancelled
+    done             - the order reached a terminal state; resolves to the final status
+
+    States that can no longer be reached (e.g. `filled` after a cancel or a
+    rejection) fail with OrderError, so awaiting any of them never hangs on a
+    finished order. Callbacks arrive on the IB reader thread and complete the
+    futures through the loop. Latencies are in seconds from placeOrder."""
+
+    def __init__(self, order_id, contract, order, loop=None):
+        loop = loop or asyncio.get_running_loop()
+        self.order_id = order_id
+        self.contract = contract
+        self.order = order
+        self.perm_id = None
+        self.status = 'PendingSubmit'
+        self.filled_quantity = 0.0
+        self.remaining = order.totalQuantity
+        self.avg_fill_price = 0.0
+        self.last_fill_price = 0.0
+        self.executions = []
+        self.commission_reports = {}
+        self.errors = []
+
+        self.submitted_at = None
+        self.ack_latency = None
+        self.first_fill_latency = None
+        self.fill_latency = None
+
+        self.submitted = loop.create_future()
+        self.partially_filled = loop.create_future()
+        self.filled = loop.create_future()
+        self.cancelled = loop.create_future()
+        self.done = loop.create_future()
+        for future in (self.submitted, self.partially_filled, self.filled, self.cancelled):
+            future.add_done_callback(_consume_exception)
+        self._lock = threading.Lock()
+        self._terminal = False
+
+    def __repr__(self):
+        return (f"OrderHandle({self.order_id}, {self.order.action} {self.order.totalQuantity} "
+                f"{self.contract.symbol}, {self.status}, filled={self.filled_quantity})")
+
+    @property
+    def is_done(self):
+        return self._terminal
+
+    def mark_sent(self):
+        self.submitted_at = time.perf_counter()
+
+    def _elapsed(self):
+        return time.perf_counter() - self.submitted_at if self.submitted_at is not None else None
+
+    def _acknowledge(self):
+        if self.ack_latency is None:
+            self.ack_latency = self._elapsed()
+            resolve_threadsafe(self.submitted, self)
+
+    def on_open_order(self, order, order_state):
+        with self._lock:
+            self.perm_id = order.permId or self.perm_id
+            if order_state.status not in PENDING_STATUSES:
+                self._acknowledge()
+
+    def on_status(self, status, filled, remaining, avg_fill_price, perm_id, last_fill_price):
+        with self._lock:
+            if self._terminal:
+                return
+            self.status = status
+            self.filled_quantity = float(filled)
+            self.remaining = float(remaining)
+            self.avg_fill_price = avg_fill_price
+            self.last_fill_price = last_fill_price
+            self.perm_id = perm_id or self.perm_id
+
+            if status not in PENDING_STATUSES:
+                self._acknowledge()
+            if self.filled_quantity > 0:
+                self._first_fill()
+            if status == 'Filled':
+                self.fill_latency = self._elapsed()
+                resolve_threadsafe(self.filled, self)
+                self._finish(status)
+            elif status in CANCELLED_STATUSES:
+                resolve_threadsafe(self.cancelled, self)
+                self._finish(status)
+            elif status == 'Inactive':
+                self._finish(status)
+
+    def on_execution(self, execution):
+        with self._lock:
+            self.executions.append(execution)
+            self._first_fill()
+
+    def on_commission(self, report):
+        with self._lock:
+            self.commission_reports[report.execId] = report
+
+    def on_error(self, error_code, error_string):
+        with self._lock:
+            self.errors.append((error_code, error_string))
+            if error_code in REJECTION_ERRORS and not self._terminal:
+                self.status = 'Rejected'
+                self._finish('Rejected', error_string)
+
+    def _first_fill(self):
+        if self.first_fill_latency is None:
+            self.first_fill_latency = self._elapsed()
+            self._acknowledge()
+            resolve_threadsafe(self.partially_filled, self)
+
+    def _finish(self, status, message=""):
+        self._terminal = True
+        error = OrderError(self.order_id, status, message)
+        for future in (self.submitted, self.partially_filled, self.filled, self.cancelled):
+            reject_threadsafe(future, error)
+        resolve_threadsafe(self.done, status)
+
+    @property
+    def commission(self):
+        return sum(report.commission for report in self.commission_reports.values())
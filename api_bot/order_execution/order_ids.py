@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import threading
+from connection.async_bridge import resolve_threadsafe
+
+
+class OrderIdAllocator:
+    """Hands out order ids locally, seeded from the gateway's nextValidId.
+
+    next_id() is a lock-protected increment, safe from threads and
+    coroutines, and never talks to the gateway. Ids are reserved in blocks:
+    before an id from a new block is handed out, the end of the block is
+    written to `state_path`, so after a restart (or a crash) allocation
+    resumes above every id that could have been used, even if the gateway's
+    nextValidId lags behind.
+
+    The allocator subscribes to nextValidId and connectionClosed. After a
+    disconnect next_id() refuses to allocate until the gateway reseeds it on
+    reconnect; a reseed never moves the counter backwards."""
+
+    def __init__(self, state_path='order_ids.state', block_size=100):
+        self.logger = logging.getLogger(__name__)
+        self.state_path = state_path
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next_id = None
+        self._reserved = self._load_high_water()
+        self._seeded = False
+        self._waiters = []
+
+    def _load_high_water(self):
+        try:
+            with open(self.state_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            self.logger.warning(f"Ignoring unreadable order id state in {self.state_path}")
+            return 0
+
+    def _persist_high_water(self, value):
+        temp = f"{self.state_path}.tmp"
+        with open(temp, 'w') as f:
+            f.write(str(value))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.state_path)
+
+    @property
+    def seeded(self):
+        return self._seeded
+
+    @property
+    def high_water(self):
+        return self._reserved
+
+    def seed(self, next_valid_id):
+        with self._lock:
+            candidates = [next_valid_id, self._reserved]
+            if self._next_id is not None:
+                candidates.append(self._next_id)
+            self._next_id = max(candidates)
+            self._seeded = True
+            waiters, self._waiters = self._waiters, []
+        self.logger.info(f"Order ids seeded at {self._next_id} (gateway sent {next_valid_id})")
+        for waiter in waiters:
+            resolve_threadsafe(waiter, self._next_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._seeded = False
+
+    def next_id(self):
+        with self._lock:
+            if not self._seeded:
+                raise RuntimeError("Order ids are not seeded (no nextValidId since connecting)")
+            order_id = self._next_id
+            if order_id >= self._reserved:
+                self._reserved = order_id + self.block_size
+                self._persist_high_water(self._reserved)
+            self._next_id += 1
+            return order_id
+
+    async def wait_seeded(self, timeout=10):
+        if self._seeded:
+            return self._next_id
+        waiter = asyncio.get_running_loop().create_future()
+        with self._lock:
+            if self._seeded:
+                return self._next_id
+            self._waiters.append(waiter)
+        return await asyncio.wait_for(waiter, timeout)
+
+    def resync(self, client):
+        """Ask the gateway for a fresh nextValidId (e.g. after another client placed orders)."""
+        client.reqIds(-1)
+
+
+
+    def nextValidId(self, orderId):
+        self.seed(orderId)
+
+    def connectionClosed(self):
+        self.invalidate()
@@ -0,0 +1,129 @@
+import pandas as pd
+from order_execution.fill_store import FillStore
+
+
+class RecordingBuffer:
+    """WriteBehindBuffer stand-in that keeps what was put, accepting at most `limit` rows per put."""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.puts = []
+
+    def put(self, table_name, rows, received=None, upsert_on=None):
+        accepted = rows if self.limit is None else rows[:self.limit]
+        self.puts.append((table_name, accepted, upsert_on))
+        return len(accepted)
+
+
+def fill(exec_id, **fields):
+    return dict({'ExecId': exec_id, 'Symbol': 'AAPL', 'FillQuantity': 10.0, 'FillPrice': 150.0}, **fields)
+
+
+def test_append_dedupes_exec_ids():
+    store = FillStore(capacity=2)
+    assert store.append(fill('e1'))
+    assert not store.append(fill('e1'))
+    assert store.append(fill('e2'))
+    assert store.append(fill('e3'))  # grows past the initial capacity
+    assert len(store) == 3
+    assert list(store.to_frame()['ExecId']) == ['e1', 'e2', 'e3']
+
+
+def test_flush_to_buffer_queues_each_fill_once():
+    store = FillStore()
+    buffer = RecordingBuffer()
+    store.append(fill('e1'))
+    store.append(fill('e2'))
+
+    assert store.flush_to_buffer(buffer) == 2
+    assert store.flush_to_buffer(buffer) == 0
+    store.append(fill('e3'))
+    assert store.flush_to_buffer(buffer) == 1
+
+    assert [[row['ExecId'] for row in rows] for _, rows, _ in buffer.puts] == [['e1', 'e2'], ['e3']]
+
+
+def test_flush_to_buffer_offers_rejected_rows_again():
+    store = FillStore()
+    buffer = RecordingBuffer(limit=1)
+    store.append(fill('e1'))
+    store.append(fill('e2'))
+
+    assert store.flush_to_buffer(buffer) == 1
+    assert store.flush_to_buffer(buffer) == 1
+    assert [rows[0]['ExecId'] for _, rows, _ in buffer.puts] == ['e1', 'e2']
+
+
+def test_discard_flushed_frees_rows_but_keeps_dedupe():
+    store = FillStore()
+    buffer = RecordingBuffer()
+    for cycle in range(50):
+        store.append(fill(f'e{cycle}'))
+        store.flush_to_buffer(buffer)
+        assert store.discard_flushed() == 1
+    assert len(store) == 0
+    assert store.exec_index == {}
+    assert 'e0' in store
+    assert not store.append(fill('e0'))
+
+
+def test_discard_flushed_waits_for_every_sink_named():
+    store = FillStore(sinks=('account_trades', 'parquet'))
+    store.append(fill('e1'))
+    store.flush_to_buffer(RecordingBuffer())
+    assert store.discard_flushed() == 0
+    assert len(store) == 1
+
+
+def test_recent_exec_ids_is_bounded():
+    store = FillStore(recent_exec_ids=2)
+    for exec_id in ('e1', 'e2', 'e3'):
+        store.append(fill(exec_id))
+    store.flush_to_buffer(RecordingBuffer())
+    store.discard_flushed()
+    assert 'e1' not in store
+    assert 'e2' in store and 'e3' in store
+
+
+def test_update_after_flush_is_upserted():
+    store = FillStore()
+    buffer = RecordingBuffer()
+    store.append(fill('e1'))
+    store.append(fill('e2'))
+    store.flush_to_buffer(buffer)
+
+    assert store.update('e2', Commission=1.25)
+    assert not store.update('unknown', Commission=1.0)
+    # e2 is kept until its update has been taken
+    assert store.discard_flushed() == 1
+
+    store.flush_to_buffer(buffer)
+    table_name, rows, upsert_on = buffer.puts[-1]
+    assert (table_name, upsert_on) == ('account_trades', ('ExecId',))
+    assert [(row['ExecId'], row['Commission']) for row in rows] == [('e2', 1.25)]
+    assert store.discard_flushed() == 1
+    assert len(store) == 0
+
+
+def test_update_before_flush_goes_with_the_insert():
+    store = FillStore()
+    buffer = RecordingBuffer()
+    store.append(fill('e1'))
+    store.update('e1', Commission=0.5)
+    store.flush_to_buffer(buffer)
+    assert len(buffer.puts) == 1
+    assert buffer.puts[0][1][0]['Commission'] == 0.5
+
+
+def test_flush_parquet_writes_new_and_updated_fills(tmp_path):
+    store = FillStore()
+    store.append(fill('e1'))
+    first = store.flush_parquet(tmp_path)
+    assert list(pd.read_parquet(first)['ExecId']) == ['e1']
+    assert store.flush_parquet(tmp_path) is None
+
+    store.update('e1', Commission=2.0)
+    store.append(fill('e2'))
+    frame = pd.read_parquet(store.flush_parquet(tmp_path))
+    assert list(frame['ExecId']) == ['e1', 'e2']
+    assert frame['Commission'][0] == 2.0
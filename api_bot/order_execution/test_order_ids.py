@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from order_execution.order_ids import OrderIdAllocator
+
+
+def test_refuses_ids_until_seeded(tmp_path):
+    allocator = OrderIdAllocator(tmp_path / 'order_ids.state')
+    with pytest.raises(RuntimeError):
+        allocator.next_id()
+    allocator.nextValidId(17)
+    assert [allocator.next_id() for _ in range(3)] == [17, 18, 19]
+
+
+def test_reserves_blocks_ahead_of_allocation(tmp_path):
+    state = tmp_path / 'order_ids.state'
+    allocator = OrderIdAllocator(state, block_size=10)
+    allocator.seed(1)
+    allocator.next_id()
+    assert state.read_text() == '11'
+    for _ in range(9):
+        allocator.next_id()
+    assert allocator.next_id() == 11
+    assert allocator.high_water == 21
+    assert state.read_text() == '21'
+
+
+def test_resumes_above_the_reserved_block_after_restart(tmp_path):
+    state = tmp_path / 'order_ids.state'
+    allocator = OrderIdAllocator(state, block_size=10)
+    allocator.seed(1)
+    allocator.next_id()
+
+    restarted = OrderIdAllocator(state, block_size=10)
+    # The gateway lags behind ids the previous run may have used
+    restarted.seed(2)
+    assert restarted.next_id() == 11
+
+
+def test_reseed_never_moves_backwards(tmp_path):
+    allocator = OrderIdAllocator(tmp_path / 'order_ids.state', block_size=10)
+    allocator.seed(50)
+    allocator.next_id()
+    allocator.connectionClosed()
+    with pytest.raises(RuntimeError):
+        allocator.next_id()
+    allocator.nextValidId(40)
+    # Above the whole reserved block, not just the last id handed out
+    assert allocator.next_id() == 60
+    allocator.seed(500)
+    assert allocator.next_id() == 500
+
+
+def test_unreadable_state_is_ignored(tmp_path):
+    state = tmp_path / 'order_ids.state'
+    state.write_text('garbage')
+    allocator = OrderIdAllocator(state)
+    assert allocator.high_water == 0
+
+
+def test_wait_seeded_resolves_on_next_valid_id(tmp_path):
+    allocator = OrderIdAllocator(tmp_path / 'order_ids.state')
+
+    async def main():
+        waiter = asyncio.create_task(allocator.wait_seeded(timeout=5))
+        await asyncio.sleep(0)
+        allocator.nextValidId(7)
+        return await waiter
+
+    assert asyncio.run(main()) == 7
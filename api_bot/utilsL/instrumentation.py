@@ -0,0 +1,255 @@
+import asyncio
+import functools
+import inspect
+import logging
+import math
+import threading
+import time
+
+
+# Histogram buckets grow by 5% from 1 µs, so a percentile is within 5% of
+# the true value; 430 buckets reach past 20 minutes.
+MIN_LATENCY = 1e-6
+GROWTH = 1.05
+BUCKETS = 430
+_LOG_GROWTH = math.log(GROWTH)
+
+
+class Histogram:
+    """Latency histogram with fixed log-spaced buckets.
+
+    record() is O(1) and never allocates, so it can sit on the reader thread.
+    Count, total, min and max are exact; percentiles come from the buckets."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.buckets = [0] * BUCKETS
+            self.count = 0
+            self.total = 0.0
+            self.min = math.inf
+            self.max = 0.0
+
+    def record(self, seconds, count=1):
+        """Record one observation, or `count` equal ones."""
+        index = int(math.log(seconds / MIN_LATENCY) / _LOG_GROWTH) if seconds > MIN_LATENCY else 0
+        with self._lock:
+            self.buckets[min(index, BUCKETS - 1)] += count
+            self.count += count
+            self.total += seconds * count
+            if seconds < self.min:
+                self.min = seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, p):
+        with self._lock:
+            return self._percentile(p)
+
+    def _percentile(self, p):
+        # Caller holds the lock
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                # Upper edge of the bucket, clamped to what was actually seen
+                return min(max(MIN_LATENCY * GROWTH ** (index + 1), self.min), self.max)
+        return self.max
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self._percentile(50),
+                'p99': self._percentile(99),
+                'max': self.max if self.count else None,
+                'total': self.total,
+            }
+
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+
+class Timer:
+    """Context manager (sync or async) recording its body's duration into a histogram.
+
+    A body that raises is also counted in the `<name>.errors` counter."""
+
+    __slots__ = ('registry', 'name', 'histogram', 'start', 'elapsed')
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.histogram = registry.histogram(name)
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.record(self.elapsed)
+        if exc_type is not None:
+            self.registry.counter(f"{self.name}.errors").add()
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class MetricsRegistry:
+    """Named latency histograms, counters and gauges, dumped to the log on demand or on a timer."""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.monotonic()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram(name))
+        return histogram
+
+    def counter(self, name):
+        counter = self.counters.get(name)
+        if counter is None:
+            with self._lock:
+                counter = self.counters.setdefault(name, Counter(name))
+        return counter
+
+    def count(self, name, n=1):
+        self.counter(name).add(n)
+
+    def gauge(self, name, read):
+        """Register a callable read whenever a snapshot is taken; None readings are left out."""
+        with self._lock:
+            self.gauges[name] = read
+
+    def _read_gauges(self, gauges):
+        readings = {}
+        for name, read in gauges:
+            try:
+                value = read()
+            except Exception as e:
+                self.logger.error(f"Reading gauge {name} failed: {str(e)}")
+                continue
+            if value is not None:
+                readings[name] = value
+        return readings
+
+    def timer(self, name):
+        """`with metrics.timer(name):` or `async with metrics.timer(name):`."""
+        return Timer(self, name)
+
+    def timed(self, name=None):
+        """Decorator timing each call of a function or coroutine function.
+
+        The name defaults to the function's qualified name. A coroutine
+        function is timed until its coroutine finishes, not until it is created."""
+        def decorator(func):
+            metric = name or f"{func.__module__}.{func.__qualname__}"
+
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with Timer(self, metric):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with Timer(self, metric):
+                    return func(*args, **kwargs)
+            return wrapper
+
+        # Both @timed and @timed("name")
+        if callable(name):
+            func, name = name, None
+            return decorator(func)
+        return decorator
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            histograms = list(self.histograms.values())
+            counters = list(self.counters.values())
+            gauges = list(self.gauges.items())
+        result = {
+            'interval': time.monotonic() - self.started,
+            'histograms': {h.name: h.snapshot() for h in histograms if h.count},
+            'counters': {c.name: c.value for c in counters if c.value},
+            'gauges': self._read_gauges(gauges),
+        }
+        if reset:
+            self.reset()
+        return result
+
+    def reset(self):
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            for counter in self.counters.values():
+                counter.reset()
+            self.started = time.monotonic()
+
+    def report(self, reset=False):
+        snapshot = self.snapshot(reset)
+        lines = [f"Metrics over {snapshot['interval']:.0f}s"]
+        if snapshot['histograms']:
+            lines.append(f"  {'name':<60}{'count':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+            for name, stats in sorted(snapshot['histograms'].items()):
+                lines.append(f"  {name:<60}{stats['count']:>10}{stats['p50'] * 1000:>10.3f}"
+                             f"{stats['p99'] * 1000:>10.3f}{stats['max'] * 1000:>10.3f}")
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"  {name:<60}{value:>10}")
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append(f"  {name:<60}{value:>10.4g}")
+        return "\n".join(lines)
+
+    def dump(self, reset=False, level=logging.INFO):
+        self.logger.log(level, self.report(reset))
+
+    async def run(self, interval=300, reset=True):
+        """Dump to the log every `interval` seconds, by default covering only the last interval."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.dump(reset=reset)
+        finally:
+            self.dump()
+
+
+# Process-wide registry the bot's components report into
+metrics = MetricsRegistry()
+timed = metrics.timed
+timer = metrics.timer
+count = metrics.count
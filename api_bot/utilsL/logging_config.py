@@ -1,32 +1,146 @@
+import atexit
+import functools
+import inspect
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+from utilsL.instrumentation import metrics
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Argument types that can't change between the logging call and the writer thread
+SCALAR_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that hands the record over unformatted.
+
+    The stock prepare() formats the message on the logging thread; here a
+    string message with scalar args travels as it is and is only merged by
+    the writer thread's formatter. Anything else (a dict, a list, an object
+    with a __str__) could be mutated before the writer gets to it, so those
+    records are formatted on the calling thread."""
+
+    def prepare(self, record):
+        args = record.args
+        if not isinstance(record.msg, str) or (
+                args and (isinstance(args, dict) or not all(isinstance(arg, SCALAR_TYPES) for arg in args))):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info and not record.exc_text:
+            # Tracebacks can't be pickled or outlive their frames; render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class LogListener(logging.handlers.QueueListener):
+    """QueueListener whose stop() may be called more than once (e.g. by the app and at exit)."""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per logger name, for loggers on hot paths.
 
-def setup_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        filename='ib_bot.log'
-    )
+    Each logger may emit `rate` records per second with bursts of `burst`;
+    `rates` overrides the rate for individual logger names (None for no
+    limit). Records beyond that are dropped, except ERROR and CRITICAL ones,
+    and the next record let through notes how many were suppressed."""
+
+    def __init__(self, rate=None, burst=20, rates=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.rates = dict(rates or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        rate = self.rates.get(record.name, self.rate)
+        if rate is None or record.levelno >= logging.ERROR:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, dropped = self._buckets.get(record.name, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[record.name] = (tokens, now, dropped + 1)
+                self.suppressed += 1
+                return False
+            self._buckets[record.name] = (tokens - 1, now, 0)
+        if dropped:
+            record.msg = f"{record.getMessage()} [{dropped} similar messages suppressed]"
+            record.args = None
+        return True
+
+
+def setup_logging(filename='ib_bot.log', level=logging.INFO, max_bytes=50 * 2**20, backup_count=10, when=None,
+                  rate=None, burst=20, rates=None):
+    """Route all logging through a queue to a writer thread.
+
+    Loggers only enqueue records; a QueueListener thread formats them and
+    writes `filename`, rotating it at `max_bytes` or, if `when` is given
+    (e.g. 'midnight', 'H'), on that schedule, keeping `backup_count` old
+    files. `rate`/`burst`/`rates` configure RateLimitFilter. Returns the
+    listener, which is also stopped (flushing the queue) at exit."""
+    if when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(filename, when=when, backupCount=backup_count,
+                                                                 delay=True)
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count,
+                                                            delay=True)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RateLimitFilter(rate, burst, rates))
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = LogListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
 
 def get_logger(name):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.ERROR)  # Set to ERROR to match your previous intention
-    return logger
+    # The level comes from setup_logging (or the caller's logging config)
+    return logging.getLogger(name)
+
 
 
 
 
 logger = get_logger(__name__)
 
-import time
-import functools
 def log_time(func):
+    """Log the duration of each call and record it in the metrics registry.
+
+    Coroutine functions are timed until the coroutine finishes."""
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            logger.info(">>>>>>>>>>>>Starting %s...<<<<<<<<<<<<<<<<", func.__name__)
+            with metrics.timer(name) as timer:
+                result = await func(*args, **kwargs)
+            logger.info("<< Finished Function: %s in %.4f seconds. >>", func.__name__, timer.elapsed)
+            return result
+        return async_wrapper
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        logger.info(f">>>>>>>>>>>>Starting {func.__name__}...<<<<<<<<<<<<<<<<")
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        duration = end_time - start_time
-        logger.info(f"<< Finished Function: {func.__name__} in {duration:.4f} seconds. >>")
+        logger.info(">>>>>>>>>>>>Starting %s...<<<<<<<<<<<<<<<<", func.__name__)
+        with metrics.timer(name) as timer:
+            result = func(*args, **kwargs)
+        logger.info("<< Finished Function: %s in %.4f seconds. >>", func.__name__, timer.elapsed)
         return result
     return wrapper
@@ -0,0 +1,65 @@
+import logging
+import sys
+from utilsL.logging_config import DeferredQueueHandler, RateLimitFilter
+
+
+def record(msg, *args, level=logging.INFO, name='hot'):
+    return logging.LogRecord(name, level, __file__, 1, msg, args or None, None)
+
+
+def test_rate_limit_drops_beyond_burst_and_reports_it():
+    rate_filter = RateLimitFilter(rate=0.001, burst=2)
+    assert rate_filter.filter(record("tick %d", 1))
+    assert rate_filter.filter(record("tick %d", 2))
+    assert not rate_filter.filter(record("tick %d", 3))
+    assert not rate_filter.filter(record("tick %d", 4))
+    assert rate_filter.suppressed == 2
+
+    # Once the bucket refills, the next record carries the count
+    rate_filter._buckets['hot'] = (1, *rate_filter._buckets['hot'][1:])
+    passed = record("tick %d", 5)
+    assert rate_filter.filter(passed)
+    assert passed.getMessage() == "tick 5 [2 similar messages suppressed]"
+
+
+def test_errors_are_never_rate_limited():
+    rate_filter = RateLimitFilter(rate=0.001, burst=1)
+    assert rate_filter.filter(record("first"))
+    assert not rate_filter.filter(record("second"))
+    assert rate_filter.filter(record("failed", level=logging.ERROR))
+    assert rate_filter.filter(record("down", level=logging.CRITICAL))
+
+
+def test_rates_are_per_logger():
+    rate_filter = RateLimitFilter(rate=0.001, burst=1, rates={'quiet': None})
+    assert rate_filter.filter(record("a"))
+    assert not rate_filter.filter(record("b"))
+    assert rate_filter.filter(record("c", name='other'))
+    assert all(rate_filter.filter(record("d", name='quiet')) for _ in range(5))
+
+
+def test_scalar_args_are_formatted_later():
+    handler = DeferredQueueHandler(None)
+    prepared = handler.prepare(record("%s filled %d at %.2f", 'AAPL', 100, 150.0))
+    assert prepared.msg == "%s filled %d at %.2f"
+    assert prepared.getMessage() == "AAPL filled 100 at 150.00"
+
+
+def test_mutable_args_are_formatted_immediately():
+    handler = DeferredQueueHandler(None)
+    positions = {'AAPL': 100}
+    prepared = handler.prepare(record("positions %s", positions))
+    positions['MSFT'] = 50
+    assert prepared.getMessage() == "positions {'AAPL': 100}"
+    assert prepared.args is None
+
+
+def test_exceptions_are_rendered_before_queueing():
+    handler = DeferredQueueHandler(None)
+    try:
+        raise ValueError("bad fill")
+    except ValueError:
+        failed = logging.LogRecord('hot', logging.ERROR, __file__, 1, "failed", None, sys.exc_info())
+    prepared = handler.prepare(failed)
+    assert prepared.exc_info is None
+    assert "ValueError: bad fill" in prepared.exc_text
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from utilsL.instrumentation import Histogram
+
+
+# Stages a row passes through on its way from an IB callback into Postgres:
+#   receive  the callback delivering its value arrived (reader thread)
+#   enqueue  the row was handed to the write buffer
+#   flush    the buffer started the insert_data call carrying it
+#   commit   that call returned, i.e. its transaction committed
+STAGES = ('receive_to_enqueue', 'enqueue_to_flush', 'flush_to_commit', 'receive_to_commit')
+
+
+class Span:
+    """Rows queued by one write_buffer.put() call.
+
+    `received` holds each row's receive time (time.monotonic()), or is None
+    when the producer doesn't stamp them; those rows only get the stages
+    from enqueue on."""
+
+    __slots__ = ('count', 'enqueued', 'received')
+
+    def __init__(self, count, enqueued, received=None):
+        self.count = count
+        self.enqueued = enqueued
+        self.received = received
+
+    def trim(self, count):
+        """Keep only the last `count` rows."""
+        if self.received is not None:
+            self.received = self.received[len(self.received) - count:]
+        self.count = count
+
+
+class SpanTracer:
+    """Per-table latency histograms of each stage between callback and commit.
+
+    The write buffer reports every committed batch through record(); the
+    aggregate is written as one JSON line per interval by run(), or on
+    demand by export()."""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.tables = {}
+        self.started = time.monotonic()
+
+    def _histograms(self, table_name):
+        histograms = self.tables.get(table_name)
+        if histograms is None:
+            with self._lock:
+                histograms = self.tables.setdefault(
+                    table_name, {stage: Histogram(f"{table_name}.{stage}") for stage in STAGES})
+        return histograms
+
+    def record(self, table_name, spans, flushed, committed):
+        histograms = self._histograms(table_name)
+        for span in spans:
+            histograms['enqueue_to_flush'].record(flushed - span.enqueued, span.count)
+            histograms['flush_to_commit'].record(committed - flushed, span.count)
+            if span.received is None:
+                continue
+            for received in span.received:
+                if received is not None:
+                    histograms['receive_to_enqueue'].record(span.enqueued - received)
+                    histograms['receive_to_commit'].record(committed - received)
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            tables = list(self.tables.items())
+        result = {
+            'interval': time.monotonic() - self.started,
+            'tables': {
+                table_name: {stage: histogram.snapshot() for stage, histogram in histograms.items() if histogram.count}
+                for table_name, histograms in tables
+            },
+        }
+        if reset:
+            self.reset()
+        return result
+
+    def reset(self):
+        with self._lock:
+            for histograms in self.tables.values():
+                for histogram in histograms.values():
+                    histogram.reset()
+            self.started = time.monotonic()
+
+    def report(self, reset=False):
+        snapshot = self.snapshot(reset)
+        lines = [f"Callback-to-commit stages over {snapshot['interval']:.0f}s"]
+        lines.append(f"  {'table':<24}{'stage':<22}{'rows':>10}{'p50 ms':>12}{'p99 ms':>12}{'max ms':>12}")
+        for table_name, stages in sorted(snapshot['tables'].items()):
+            for stage in STAGES:
+                stats = stages.get(stage)
+                if stats:
+                    lines.append(f"  {table_name:<24}{stage:<22}{stats['count']:>10}{stats['p50'] * 1000:>12.3f}"
+                                 f"{stats['p99'] * 1000:>12.3f}{stats['max'] * 1000:>12.3f}")
+        return "\n".join(lines)
+
+    def export(self, path, reset=False):
+        """Append the current aggregate to `path` as a JSON line."""
+        snapshot = self.snapshot(reset)
+        snapshot['time'] = time.time()
+        with open(path, 'a') as f:
+            f.write(json.dumps(snapshot) + "\n")
+
+    async def run(self, path, interval=60, reset=True):
+        """Export to `path` every `interval` seconds, by default covering only the last interval."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await asyncio.to_thread(self.export, path, reset)
+        finally:
+            try:
+                self.export(path)
+            except OSError as e:
+                self.logger.error(f"Failed to export span traces to {path}: {str(e)}")
+
+
+# Process-wide tracer the write buffer reports into
+tracer = SpanTracer()